@@ -5,7 +5,8 @@ import json
 from datetime import datetime
 from typing import Union
 import os
-from secgym.excytin_env import ExcytinEnv, ATTACKS
+from secgym.excytin_env import ExcytinEnv, ATTACKS, get_attack_info
+from secgym.database.container_manager import get_container_manager
 from secgym.evaluator import LLMEvaluator, Evaluator
 from secgym.myconfig import CONFIG_LIST
 from secgym.qagen.alert_graph import AlertGraph
@@ -160,6 +161,12 @@ def get_args():
     parser.add_argument("--full_db", action="store_true", help="Use full database for the experiment. Need to setup 'AlphineSkiHouse' database first.")
     parser.add_argument("--trial_run", action="store_true", help="Run the experiment in trial mode, will only run 2 questions from the first attack")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite the saved agent file if it exists")
+    parser.add_argument("--log_format", type=str, default="json", help="Format of the env logs: 'json' (rewritten after each question), 'jsonl' or 'jsonl.gz' (appended)")
+    parser.add_argument("--backend", type=str, default="mysql", help="Database backend: 'mysql' (docker containers) or 'sqlite' (files built with setup_sqlite.py)")
+    parser.add_argument("--layer_views", action="store_true", help="Serve the log/alert_only layers from views of the alert containers (setup with --layer_views)")
+    parser.add_argument("--observation_format", type=str, default="repr", help="How query results are shown to the agent: 'repr', 'tsv' or 'markdown'")
+    parser.add_argument("--start_containers", action="store_true", help="Start all containers of the run concurrently before running, and wait until they are ready")
+    parser.add_argument("--max_obs_tokens", type=int, default=None, help="Token budget of a query result shown to the agent, no limit by default")
     args = parser.parse_args()
     return args
 
@@ -244,10 +251,17 @@ if __name__ == "__main__":
         sub_dir += f"_{args.split}"
     os.makedirs(f"{base_dir}/{sub_dir}", exist_ok=True)
 
+    if args.start_containers and args.backend == "mysql":
+        containers = {}
+        for attack in ATTACKS:
+            info = get_attack_info(attack, layer=layer, use_full_db=use_full_db, layer_views=args.layer_views, verbose=False)
+            containers[info["container_name"]] = info["port"]
+        get_container_manager().start_all(containers)
+
     for attack in ATTACKS:
         print(f"Running attack: {attack}")
         save_agent_file = f"{base_dir}/{sub_dir}/agent_{attack}.json" 
-        save_env_file = f"{base_dir}/{sub_dir}/env_{attack}.json"
+        save_env_file = f"{base_dir}/{sub_dir}/env_{attack}.{args.log_format}"
 
         thug_env = ExcytinEnv(
             attack=attack,
@@ -257,6 +271,11 @@ if __name__ == "__main__":
             split=args.split,
             use_full_db=use_full_db,
             layer=layer,
+            backend=args.backend,
+            observation_format=args.observation_format,
+            layer_views=args.layer_views,
+            max_obs_tokens=args.max_obs_tokens,
+            auto_start=args.start_containers,
         )
         
         avg_success, tested_num, avg_reward = run_experiment(
@@ -0,0 +1,223 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+import time
+from typing import Dict, Tuple, Union
+
+import aiomysql
+
+from secgym.connection_pool import ROWS_EXAMINED_QUERY
+from secgym.excytin_env import ExcytinEnv, ResultCollector, SCHEMA_ACTION, _DEFAULT
+from secgym.query_cache import is_cacheable
+
+# aiomysql pools are bound to the event loop they were created in
+_ASYNC_POOLS: Dict[tuple, aiomysql.Pool] = {}
+
+
+class _FetchTracker:
+    """Wraps an unbuffered cursor and records whether all rows of its result were read."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.exhausted = False
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    async def fetchall(self) -> list:
+        rows = await self.cursor.fetchall()
+        self.exhausted = True
+        return rows
+
+    async def fetchmany(self, size: int) -> list:
+        rows = await self.cursor.fetchmany(size)
+        # an unbuffered cursor only returns fewer rows than asked at the end of the result
+        self.exhausted = len(rows) < size
+        return rows
+
+
+async def get_async_connection_pool(
+    port: str,
+    database_name: str,
+    host: str = "localhost",
+    pool_size: int = 8,
+    max_execution_time: int = 30000,  # in ms
+    user: str = "root",
+    password: str = "admin",
+) -> aiomysql.Pool:
+    """Get the pool for a database in the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    key = (id(loop), host, str(port), database_name)
+    if key not in _ASYNC_POOLS:
+        _ASYNC_POOLS[key] = await aiomysql.create_pool(
+            host=host,
+            port=int(port),
+            user=user,
+            password=password,
+            db=database_name,
+            minsize=0,
+            maxsize=pool_size,
+            init_command=f"SET SESSION MAX_EXECUTION_TIME={max_execution_time}",
+        )
+    return _ASYNC_POOLS[key]
+
+
+async def close_async_pools() -> None:
+    """Close the pools created in the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _ASYNC_POOLS if k[0] == loop_id]:
+        pool = _ASYNC_POOLS.pop(key)
+        pool.close()
+        await pool.wait_closed()
+
+
+class AsyncExcytinEnv(ExcytinEnv):
+    """ExcytinEnv with coroutine `astep`/`areset` backed by aiomysql.
+
+    Queries run on a non-blocking connection, and the (blocking) LLM evaluation of a submission
+    runs in a worker thread, so one event loop can interleave many episodes, e.g.:
+
+        envs = [AsyncExcytinEnv(attack, evaluator=evaluator, save_file=...) for attack in ATTACKS]
+        await asyncio.gather(*(run_episode(env) for env in envs))
+
+    Observations, rewards, done flags, info and the logged trajectories are the same as with `step`/`reset`.
+    The sync API of ExcytinEnv keeps working on the same env.
+    """
+
+    async def astep(self, action: str, submit=False, stringify=True, timeout=_DEFAULT) -> Tuple[object, float, bool, Dict]:
+        """Async version of `step`, see `ExcytinEnv.step`."""
+        if self.curr_question is None:
+            raise ValueError("Cannot step in the environment without resetting first.")
+
+        query_success = True
+        if submit:
+            observation, reward, done, info = await asyncio.to_thread(self._submit, action)
+        elif self.step_count < self.max_steps and SCHEMA_ACTION.match(action):
+            observation, reward, done, info, query_success = await asyncio.to_thread(self._schema_step, action)
+        elif self.step_count < self.max_steps:
+            result = None
+            try:
+                result = await self._afetch_result(action, timeout)
+                observation = self._format_result(result, stringify)
+            except Exception as e:
+                observation = self._format_error(e)
+                query_success = False
+
+            reward = 0
+            done = False
+            info = {"query_stats": self._query_step_stats(result, observation)}
+        else:
+            observation, reward, done, info = self._max_steps_reached()
+
+        return self._record_step(action, observation, reward, done, info, query_success, submit)
+
+    async def areset(self, idx=None, save_log=True) -> Tuple[str, Dict]:
+        """Async version of `reset`, saving the log of the previous episode in a worker thread."""
+        return await asyncio.to_thread(self.reset, idx, save_log)
+
+    async def aexecute_query(self, query: str) -> Tuple[object, bool]:
+        """Async version of `execute_query`."""
+        try:
+            return await self._acached(query, self.database_id, self._afetch_all), True
+        except Exception as e:
+            return self._format_error(e), False
+
+    async def _afetch_result(self, query: str, timeout=_DEFAULT) -> dict:
+        return await self._acached(query, self._result_cache_key(), self._afetch_streaming, timeout)
+
+    async def _acached(self, query: str, database_key: str, fetch_fn, timeout=_DEFAULT):
+        """Async version of `ExcytinEnv._cached`."""
+        if self.backend == "sqlite":
+            # the embedded database is local, reads are run in a worker thread
+            sync_fetch = self._fetch_all if fetch_fn == self._afetch_all else self._fetch_streaming
+            return await asyncio.to_thread(self._cached, query, database_key, sync_fetch, timeout)
+
+        timeout = self.query_timeout if timeout is _DEFAULT else timeout
+        stats = self._new_query_stats()
+        start_time = time.time()
+        use_cache = self.query_cache is not None and is_cacheable(query)
+        if use_cache:
+            hit, result = self.query_cache.get(database_key, query)
+            if hit:
+                stats.update({"cache_hit": True, "rows_examined": 0, "wall_time": time.time() - start_time})
+                return result
+
+        pool = await get_async_connection_pool(
+            self.port, self.database_name, pool_size=self.pool_size, user=self.db_user, password=self.db_password
+        )
+        connection = await pool.acquire()
+        timer = None
+        if timeout:
+            timer = asyncio.get_running_loop().call_later(timeout, self._acancel_query, connection.thread_id(), stats)
+        tracker = None
+        try:
+            # unbuffered cursor, rows are streamed from the server as they are fetched
+            tracker = _FetchTracker(connection.cursor(aiomysql.SSCursor))
+            try:
+                await tracker.cursor.execute(query)
+            except Exception:
+                tracker.exhausted = True  # the server answered with an error, there is nothing to read
+                raise
+            tracker.exhausted = tracker.description is None
+            result = await fetch_fn(tracker)
+            if tracker.exhausted:
+                await tracker.cursor.close()
+                if self.track_rows_examined:
+                    stats["rows_examined"] = await self._arows_examined(connection)
+        except Exception as e:
+            if stats["timed_out"]:
+                raise TimeoutError(f"Query exceeded {timeout} seconds and was cancelled.") from e
+            raise
+        finally:
+            try:
+                if tracker is None or not tracker.exhausted:
+                    # closing the cursor would read the rest of the rows: stop the statement and drop the connection
+                    try:
+                        await asyncio.to_thread(self.pool.kill_query, connection.thread_id())
+                    except Exception as e:
+                        print(f"Warning: Could not cancel query before closing the connection: {e}")
+                    connection.close()
+                elif not is_cacheable(query):
+                    # aiomysql cannot reset a session: a statement that may have changed it (USE, SET, user
+                    # variables, locks...) must not leak into the next episode borrowing the connection
+                    connection.close()
+                pool.release(connection)
+            finally:
+                # the timer stays armed until the connection is released
+                if timer is not None:
+                    timer.cancel()
+                stats["wall_time"] = time.time() - start_time
+
+        if use_cache:
+            self.query_cache.put(database_key, query, result)
+        return result
+
+    def _acancel_query(self, connection_id: int, stats: dict) -> None:
+        stats["timed_out"] = True
+        # KILL QUERY is sent from a separate connection in a worker thread
+        asyncio.ensure_future(asyncio.to_thread(self.pool.kill_query, connection_id))
+
+    @staticmethod
+    async def _arows_examined(connection) -> Union[int, None]:
+        try:
+            async with connection.cursor() as cursor:
+                await cursor.execute(ROWS_EXAMINED_QUERY)
+                row = await cursor.fetchone()
+        except Exception:
+            return None
+        return None if row is None else int(row[0])
+
+    @staticmethod
+    async def _afetch_all(cursor) -> list:
+        return list(await cursor.fetchall())
+
+    async def _afetch_streaming(self, cursor) -> dict:
+        collector = ResultCollector(self.max_entry_return, self.max_str_len, self.max_count_rows)
+        if cursor.description is None:
+            return collector.result()
+        collector.columns = [d[0] for d in cursor.description]
+        while collector.add_batch(list(await cursor.fetchmany(self.fetch_size))):
+            pass
+        return collector.result()
@@ -0,0 +1,224 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+from typing import Callable, Dict, Tuple, Union
+
+import mysql.connector
+
+# the agent's statement is the most recent completed statement of the connection's thread
+ROWS_EXAMINED_QUERY = (
+    "SELECT ROWS_EXAMINED FROM performance_schema.events_statements_history "
+    "WHERE THREAD_ID = PS_CURRENT_THREAD_ID() ORDER BY EVENT_ID DESC LIMIT 1"
+)
+
+
+class ConnectionPool:
+    """A bounded pool of warm MySQL connections to one incident database.
+
+    Connections are created lazily, configured once (execution time limit and database selection)
+    and then handed out again and again, so an environment does not pay the connection setup on every
+    construction. At most `pool_size` connections are ever opened, which keeps many concurrent
+    environments on one host below MySQL's `max_connections`.
+    """
+
+    def __init__(
+        self,
+        port: Union[str, int],
+        database_name: str,
+        host: str = "localhost",
+        user: str = "root",
+        password: str = "admin",
+        pool_size: int = 8,
+        max_execution_time: int = 30000,  # in ms
+        acquire_timeout: Union[float, None] = 300,  # in seconds, None to wait forever
+    ):
+        self.host = host
+        self.port = str(port)
+        self.database_name = database_name
+        self.user = user
+        self.password = password
+        self.pool_size = pool_size
+        self.max_execution_time = max_execution_time
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = Queue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._closed = False
+
+    def _connect(self):
+        connection = mysql.connector.connect(
+            host=self.host, port=self.port, user=self.user, password=self.password
+        )
+        if not connection.is_connected():
+            raise ValueError("Could not connect to the database.")
+        self._configure(connection)
+        return connection
+
+    def _configure(self, connection) -> None:
+        cursor = connection.cursor()
+        cursor.execute(f"SET SESSION MAX_EXECUTION_TIME={self.max_execution_time}")
+        cursor.execute(f"USE {self.database_name};")
+        cursor.close()
+
+    def _reset(self, connection) -> bool:
+        """Give a connection the session of a new one, returns False if it could not be restored."""
+        try:
+            # drops the database selection, session variables, user variables and temporary tables,
+            # returns False if the server does not support it
+            if not connection.cmd_reset_connection():
+                return False
+            self._configure(connection)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Borrow a connection, blocking until one is free if the pool is exhausted."""
+        if self.acquire_timeout is None:
+            acquired = self._slots.acquire()
+        else:
+            acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        if not acquired:
+            raise TimeoutError(
+                f"No free connection to {self.host}:{self.port} after {self.acquire_timeout}s (pool size {self.pool_size})."
+            )
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except Empty:
+                    return self._connect()
+                if connection.is_connected():
+                    return connection
+                # stale connection, e.g. the server restarted: drop it and try the next one
+                self._close_quietly(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection, before_reuse: Union[Callable[[], None], None] = None) -> None:
+        """Return a borrowed connection to the pool.
+
+        The agent's statements can change the session (e.g. `USE other_db` or `SET SESSION ...`), which must not
+        leak into the other envs sharing the pool: the session is reset and configured again, and the connection
+        is closed instead if that fails. A connection with an unread result (e.g. rows beyond the display budget)
+        is discarded rather than drained, since reading the rest can take as long as the query itself. Once the
+        pool is closed, released connections are closed.
+
+        Args:
+            connection: The borrowed connection.
+            before_reuse: Called right before the connection is handed to other borrowers, e.g. to disarm a timer
+                that would cancel the borrower's query.
+        """
+        try:
+            if connection.is_connected():
+                if connection.unread_result:
+                    self.discard(connection)
+                    return
+                if not self._closed and self._reset(connection):
+                    if before_reuse is not None:
+                        before_reuse()
+                    self._idle.put(connection)
+                    return
+            self._close_quietly(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def kill_query(self, connection_id: int) -> None:
+        """Cancel the statement running on a connection with `KILL QUERY`, from a separate connection."""
+        killer = mysql.connector.connect(
+            host=self.host, port=self.port, user=self.user, password=self.password
+        )
+        try:
+            cursor = killer.cursor()
+            cursor.execute(f"KILL QUERY {int(connection_id)}")
+            cursor.close()
+        finally:
+            killer.close()
+
+    def cancel(self, connection) -> None:
+        """Cancel the statement running on a borrowed connection."""
+        self.kill_query(connection.connection_id)
+
+    def discard(self, connection) -> None:
+        """Stop the statement running on a connection and close it without reading the rest of its result."""
+        try:
+            self.cancel(connection)
+        except Exception as e:
+            print(f"Warning: Could not cancel query before closing the connection: {e}")
+        self._close_quietly(connection)
+
+    @staticmethod
+    def rows_examined(connection) -> Union[int, None]:
+        """Rows examined by the last statement on a connection, None if performance_schema is unavailable."""
+        try:
+            cursor = connection.cursor()
+            cursor.execute(ROWS_EXAMINED_QUERY)
+            row = cursor.fetchone()
+            cursor.close()
+        except Exception:
+            return None
+        return None if row is None else int(row[0])
+
+    def close(self) -> None:
+        """Close all idle connections. Borrowed connections are closed when they are released after this."""
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            self._close_quietly(connection)
+
+    @staticmethod
+    def _close_quietly(connection) -> None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_POOLS: Dict[Tuple[str, str, str], ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(
+    port: Union[str, int],
+    database_name: str,
+    host: str = "localhost",
+    pool_size: int = 8,
+    **kwargs,
+) -> ConnectionPool:
+    """Get the process-wide pool for a database, creating it on first use.
+
+    Pools are keyed by (host, port, database), i.e. by the container from `ATTACKS`, so every
+    environment talking to the same container shares the same bounded set of connections.
+    `pool_size` and other arguments only take effect when the pool is first created.
+    """
+    key = (host, str(port), database_name)
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = ConnectionPool(
+                port=port, database_name=database_name, host=host, pool_size=pool_size, **kwargs
+            )
+        return _POOLS[key]
+
+
+def close_all_pools() -> None:
+    """Close the idle connections of every pool in this process."""
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
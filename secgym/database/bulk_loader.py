@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import mysql.connector
+
+from secgym.database.setup_database import (
+    get_table_files,
+    generate_load_data_sql,
+    generate_typed_load_data_sql,
+)
+
+
+def _load_connection(port, database_name, host="localhost", user="root", password="admin"):
+    connection = mysql.connector.connect(host=host, port=port, user=user, password=password, database=database_name)
+    cursor = connection.cursor()
+    # the tables have no keys while loading, and nothing reads them before the load is done
+    cursor.execute("SET SESSION unique_checks = 0")
+    cursor.execute("SET SESSION foreign_key_checks = 0")
+    cursor.execute("SET SESSION sql_log_bin = 0")
+    cursor.close()
+    return connection
+
+
+def check_csv_mount(csv_folder, port="3306"):
+    """Raise a ValueError unless the container on `port` has `csv_folder` mounted at /var/lib/mysql-files.
+
+    LOAD DATA reads the CSV files from there, and only containers made by `create_container` mount it:
+    a container restored from a snapshot (`snapshot.restore_mysql_container`) only mounts its data directory.
+    """
+    import docker
+
+    client = docker.from_env()
+    for container in client.containers.list():
+        bindings = container.attrs["HostConfig"].get("PortBindings") or {}
+        if not any(binding.get("HostPort") == str(port) for binding in bindings.get("3306/tcp") or []):
+            continue
+        for mount in container.attrs.get("Mounts", []):
+            if mount["Destination"] != "/var/lib/mysql-files":
+                continue
+            if os.path.realpath(mount["Source"]) != os.path.realpath(csv_folder):
+                raise ValueError(
+                    f"Container {container.name} on port {port} mounts {mount['Source']} at /var/lib/mysql-files, not {csv_folder}."
+                )
+            return
+        raise ValueError(
+            f"Container {container.name} on port {port} does not mount a CSV folder at /var/lib/mysql-files (e.g. it was "
+            f"restored from a snapshot), files cannot be loaded into it. Rebuild it with setup_database.py without --snapshot."
+        )
+    raise ValueError(f"No running container is published on port {port}.")
+
+
+def bulk_load(
+        csv_folder,
+        database_name,
+        port="3306",
+        skip_tables=["SecurityAlert", "SecurityIncident"],
+        num_workers=4,
+        typed_columns=False,
+        index_plan=None,
+        host="localhost",
+        only_files=None,
+        verbose=True
+        ):
+    """Load the CSV files of a folder into a running MySQL container over concurrent connections.
+
+    The tables must already exist, e.g. created from the init file of
+    `create_sql_file_from_csv_folder(..., load_data=False)`, and `csv_folder` must be mounted at
+    /var/lib/mysql-files in the container as done by `create_container`. Each CSV file (or chunk
+    `<table>_i.csv` of a table folder) is one LOAD DATA job; the largest files are started first.
+    Indexes from `index_plan` are created once all chunks of a table are loaded.
+
+    Args:
+        csv_folder (str): Path to the folder containing the CSV and .meta files.
+        database_name (str): Name of the database holding the tables.
+        port (str): Port of the MySQL container.
+        skip_tables (list): List of table names to skip, same as for the init file.
+        num_workers (int): Number of concurrent connections.
+        typed_columns (bool): Whether the tables were created with typed columns.
+        index_plan (dict): Indexes to create after loading, see `index_planner.plan_indexes`.
+        only_files (list): Only load these CSV files (relative to `csv_folder`, e.g. `<table>/<table>_i.csv`) into
+            tables that are already loaded, e.g. the chunks added by `delta_sync.merge_delta`. No index_plan then, the indexes exist.
+
+    Returns:
+        dict: For each table, the rows, bytes, seconds spent loading it (summed over its chunks), conversion warnings and index_seconds.
+    """
+    tables = get_table_files(csv_folder, skip_tables)
+    if only_files is not None:
+        tables = [table for table in tables if any(csv_file in only_files for csv_file in table[2])]
+    jobs = []
+    for table_name, type_map, csv_files in tables:
+        json_columns = [col for col, dtype in type_map.items() if dtype == "dynamic"]
+        for csv_file in csv_files:
+            if only_files is not None and csv_file not in only_files:
+                continue
+            if typed_columns:
+                sql = generate_typed_load_data_sql(csv_file, table_name, type_map)
+            else:
+                sql = generate_load_data_sql(csv_file, table_name, type_map.keys(), json_columns)
+            jobs.append((table_name, sql, os.path.getsize(os.path.join(csv_folder, csv_file))))
+    jobs.sort(key=lambda job: -job[2])
+
+    remaining_chunks = defaultdict(int)
+    for table_name, _, _ in jobs:
+        remaining_chunks[table_name] += 1
+    stats = {table_name: {"rows": 0, "bytes": 0, "seconds": 0.0, "warnings": 0} for table_name, _, _ in tables}
+    lock = threading.Lock()
+    local = threading.local()
+    connections = []
+
+    def get_connection():
+        if not hasattr(local, "connection"):
+            local.connection = _load_connection(port, database_name, host=host)
+            with lock:
+                connections.append(local.connection)
+        return local.connection
+
+    def create_indexes(table_name):
+        if index_plan is None or len(index_plan.get(table_name, [])) == 0:
+            return
+        from secgym.database.index_planner import generate_create_index_sql
+        type_map = next(t for name, t, _ in tables if name == table_name)
+        cursor = get_connection().cursor()
+        for columns in index_plan[table_name]:
+            cursor.execute(generate_create_index_sql(table_name, columns, type_map, typed=typed_columns))
+        cursor.close()
+
+    def run_job(table_name, sql, num_bytes):
+        start_time = time.time()
+        connection = get_connection()
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        rows = cursor.rowcount
+        # typed loads turn values that do not convert into NULL with a warning
+        warnings = cursor.warning_count
+        cursor.close()
+        connection.commit()
+        with lock:
+            stats[table_name]["rows"] += max(rows, 0)
+            stats[table_name]["bytes"] += num_bytes
+            stats[table_name]["seconds"] += time.time() - start_time
+            stats[table_name]["warnings"] += warnings
+            remaining_chunks[table_name] -= 1
+            table_done = remaining_chunks[table_name] == 0
+        if table_done:
+            index_start = time.time()
+            create_indexes(table_name)
+            with lock:
+                stats[table_name]["index_seconds"] = time.time() - index_start
+            if verbose:
+                _print_table_stats(table_name, stats[table_name])
+
+    start_time = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(run_job, *job) for job in jobs]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        for connection in connections:
+            connection.close()
+
+    if verbose:
+        total_bytes = sum(s["bytes"] for s in stats.values())
+        total_time = time.time() - start_time
+        print(
+            f"Loaded {len(stats)} tables, {sum(s['rows'] for s in stats.values())} rows, "
+            f"{total_bytes / 1e6:.1f} MB in {total_time:.1f} seconds ({total_bytes / 1e6 / max(total_time, 1e-9):.1f} MB/s)"
+        )
+    return stats
+
+
+def _print_table_stats(table_name, table_stats):
+    seconds = max(table_stats["seconds"], 1e-9)
+    print(
+        f"Loaded {table_name}: {table_stats['rows']} rows, {table_stats['bytes'] / 1e6:.1f} MB in {seconds:.1f} seconds "
+        f"({table_stats['rows'] / seconds:.0f} rows/s, {table_stats['bytes'] / 1e6 / seconds:.1f} MB/s), "
+        f"indexes in {table_stats.get('index_seconds', 0.0):.1f} seconds"
+    )
+    if table_stats.get("warnings", 0) > 0:
+        print(f"Warning: {table_stats['warnings']} values of {table_name} did not convert to their column type and were set to NULL.")
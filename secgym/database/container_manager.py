@@ -0,0 +1,278 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Union
+
+
+def probe_mysql(port, host="localhost", user="root", password="admin", connect_timeout=2.0) -> bool:
+    """Whether the server on `host:port` answers `SELECT 1`.
+
+    The TCP check is cheap and fails fast while the port is closed. While the MySQL entrypoint runs the
+    init file, the temporary server does not listen on TCP, so a successful probe also means the data is loaded.
+    """
+    try:
+        with socket.create_connection((host, int(port)), timeout=connect_timeout):
+            pass
+    except OSError:
+        return False
+
+    import mysql.connector
+    try:
+        connection = mysql.connector.connect(
+            host=host, port=port, user=user, password=password, connection_timeout=int(max(connect_timeout, 1))
+        )
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        finally:
+            connection.close()
+        return True
+    except mysql.connector.Error:
+        return False
+
+
+def wait_until_ready(
+        port,
+        host="localhost",
+        user="root",
+        password="admin",
+        timeout=600,
+        initial_interval=0.1,
+        max_interval=2.0,
+        container=None
+    ) -> float:
+    """Probe the server with exponential backoff until it is ready, returns the time it took.
+
+    Args:
+        port (str): Port of the MySQL server.
+        timeout (float): Seconds to wait before raising a TimeoutError.
+        initial_interval (float): Seconds between the first probes, doubled after each failure up to `max_interval`.
+        container: The docker container serving the port, if given a RuntimeError is raised as soon as it exits.
+    """
+    start_time = time.time()
+    interval = initial_interval
+    while not probe_mysql(port, host=host, user=user, password=password):
+        if container is not None:
+            container.reload()
+            if container.status == "exited":
+                raise RuntimeError(f"Container {container.name} has exited due to an error.")
+        if time.time() - start_time > timeout:
+            raise TimeoutError(f"MySQL on {host}:{port} did not accept connections within {timeout} seconds.")
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    return time.time() - start_time
+
+
+class ContainerManager:
+    """Start the incident containers and wait until they are ready, concurrently.
+
+    Containers are identified by name, each with the port it is published on. The containers must
+    have been built with setup_database.py, the manager only starts stopped containers and waits for
+    them. Starting a container is done once: concurrent calls for the same container wait for the
+    first one instead of starting it again.
+    """
+
+    def __init__(self, host: str = "localhost", user: str = "root", password: str = "admin", timeout: float = 600):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self._ports = {}
+        self._ready = set()
+        self._external = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import docker
+            self._client = docker.from_env()
+        return self._client
+
+    def _get_lock(self, container_name: str) -> threading.Lock:
+        with self._lock:
+            if container_name not in self._locks:
+                self._locks[container_name] = threading.Lock()
+            return self._locks[container_name]
+
+    def register(self, container_name: str, port: str, external: bool = False) -> None:
+        """Add a container and the port it is published on.
+
+        With `external`, the server may also run outside of docker (e.g. a MySQL installed on the host): if there is
+        no container with that name, a server answering on the port is used instead.
+        """
+        with self._lock:
+            self._ports[container_name] = str(port)
+            if external:
+                self._external.add(container_name)
+            else:
+                self._external.discard(container_name)
+
+    def _get_container(self, container_name: str):
+        """The docker container, None if it does not exist and may be external."""
+        from docker.errors import NotFound
+        try:
+            return self._get_client().containers.get(container_name)
+        except NotFound:
+            if container_name in self._external:
+                return None
+            raise ValueError(
+                f"Container {container_name} does not exist, please build it with secgym/database/setup_database.py."
+            )
+        except Exception:
+            if container_name in self._external:
+                return None  # e.g. no docker daemon
+            raise
+
+    @staticmethod
+    def _published_ports(container) -> list:
+        bindings = container.attrs.get("HostConfig", {}).get("PortBindings") or {}
+        return [binding.get("HostPort") for binding in bindings.get("3306/tcp") or []]
+
+    def ensure_ready(self, container_name: str, port: Union[str, None] = None) -> float:
+        """Start the container if it is not running and wait until it answers, returns the seconds waited.
+
+        A server answering on the port is not enough: containers of different layers can be published on the same
+        port, so the container itself must be running with that port binding.
+        """
+        if port is not None:
+            self.register(container_name, port, external=container_name in self._external)
+        port = self._ports[container_name]
+        if container_name in self._ready:
+            return 0.0
+        with self._get_lock(container_name):
+            if container_name in self._ready:
+                return 0.0
+            start_time = time.time()
+            container = self._get_container(container_name)
+            if container is not None:
+                if port not in self._published_ports(container):
+                    raise ValueError(
+                        f"Container {container_name} is published on port(s) {self._published_ports(container)}, not {port}."
+                    )
+                if container.status != "running":
+                    print(f"Starting container {container_name} on port {port}...")
+                    container.start()
+            wait_until_ready(
+                port, host=self.host, user=self.user, password=self.password, timeout=self.timeout, container=container
+            )
+            if container is not None:
+                container.reload()
+                if container.status != "running":
+                    raise RuntimeError(f"Container {container_name} is {container.status}, not running.")
+            self._ready.add(container_name)
+            return time.time() - start_time
+
+    def start_all(self, containers: Union[Dict[str, str], None] = None, max_workers: Union[int, None] = None) -> Dict[str, float]:
+        """Start the containers concurrently and wait until all of them are ready.
+
+        Args:
+            containers (dict): Container name to port, all registered containers if None.
+            max_workers (int): Number of containers started at the same time, all of them if None.
+
+        Returns:
+            dict: The seconds each container took to be ready. Raises the first error once all containers are done.
+        """
+        if containers is not None:
+            for container_name, port in containers.items():
+                self.register(container_name, port)
+        names = list(self._ports.keys()) if containers is None else list(containers.keys())
+        if len(names) == 0:
+            return {}
+        start_time = time.time()
+        timings = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(names)) as executor:
+            futures = {executor.submit(self.ensure_ready, name): name for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    timings[name] = future.result()
+                    print(f"Container {name} is ready ({timings[name]:.1f} seconds).")
+                except Exception as e:
+                    errors[name] = e
+                    print(f"Error: container {name} is not ready: {e}")
+        print(f"{len(timings)}/{len(names)} containers ready in {time.time() - start_time:.1f} seconds.")
+        if len(errors) > 0:
+            raise next(iter(errors.values()))
+        return timings
+
+    def status(self, container_name: str) -> Dict:
+        """Docker status of a container and whether its server answers."""
+        from docker.errors import NotFound
+        port = self._ports.get(container_name)
+        try:
+            container = self._get_client().containers.get(container_name)
+            container_status = container.status
+            serves_port = container_status == "running" and port in self._published_ports(container)
+        except NotFound:
+            container_status = "missing"
+            serves_port = container_name in self._external
+        ready = port is not None and serves_port and probe_mysql(port, host=self.host, user=self.user, password=self.password)
+        if not ready:
+            self._ready.discard(container_name)
+        return {"container_name": container_name, "port": port, "status": container_status, "ready": ready}
+
+    def health(self) -> Dict[str, Dict]:
+        """Status of all registered containers."""
+        return {name: self.status(name) for name in list(self._ports.keys())}
+
+    def stop_all(self) -> None:
+        from docker.errors import NotFound
+        for container_name in list(self._ports.keys()):
+            try:
+                container = self._get_client().containers.get(container_name)
+            except NotFound:
+                continue
+            if container.status == "running":
+                print(f"Stopping container {container_name}...")
+                container.stop()
+            self._ready.discard(container_name)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_container_manager() -> ContainerManager:
+    """The container manager shared by all environments of the process."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ContainerManager()
+        return _manager
+
+
+if __name__ == "__main__":
+    from secgym.excytin_env import ATTACKS, get_attack_info
+
+    parser = argparse.ArgumentParser(description='Start the incident containers and check their health')
+    parser.add_argument('--action', type=str, default="start", help="'start', 'status' or 'stop'")
+    parser.add_argument('--layer', type=str, default="alert", help='Layer the containers are built for')
+    parser.add_argument('--full_db', action='store_true', help='Use the container with the full database')
+    parser.add_argument('--max_workers', type=int, default=None, help='Number of containers started at the same time')
+    parser.add_argument('--external', action='store_true', help='Accept a server outside of docker on the port of a missing container')
+    args = parser.parse_args()
+
+    manager = get_container_manager()
+    for attack in ATTACKS:
+        info = get_attack_info(attack, layer=args.layer, use_full_db=args.full_db, verbose=False)
+        manager.register(info["container_name"], info["port"], external=args.external)
+
+    if args.action == "start":
+        manager.start_all(max_workers=args.max_workers)
+    elif args.action == "status":
+        for name, status in manager.health().items():
+            print(f"{name}: port {status['port']}, {status['status']}, {'ready' if status['ready'] else 'not ready'}")
+    elif args.action == "stop":
+        manager.stop_all()
+    else:
+        raise ValueError(f"Invalid action: {args.action}")
@@ -0,0 +1,373 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+
+from secgym.database.log_downloader import LogDownloader
+from secgym.database.log_io import LOG_EXTENSIONS, apply_type_map, is_parquet_file, log_table_columns, read_separated_csv, write_log_table
+
+SYNC_STATE_SUFFIX = "_sync_state.json"
+DELTA_SUFFIX = "_delta"
+DELTA_MANIFEST = "delta_manifest.json"
+
+
+def list_tables(folder: str) -> Dict[str, List[str]]:
+    """The table files of a folder (relative to it) by table name.
+
+    A table is a `<table>.csv` (or .parquet) file, or a `<table>` folder of chunks, see `setup_database.get_table_files`.
+    """
+    tables = {}
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.startswith("."):
+            continue
+        path = os.path.join(folder, file_name)
+        if os.path.isdir(path):
+            tables[file_name] = [
+                f"{file_name}/{f}" for f in sorted(os.listdir(path)) if f.endswith(LOG_EXTENSIONS) and not f.startswith("._")
+            ]
+        elif file_name.endswith(LOG_EXTENSIONS):
+            tables.setdefault(os.path.splitext(file_name)[0], []).append(file_name)
+    return tables
+
+
+def read_table_type_map(folder: str, table_name: str) -> Dict[str, str]:
+    """The .meta type map of a table of the folder, empty if it has none."""
+    for meta_path in [os.path.join(folder, table_name, f"{table_name}_0.meta"), os.path.join(folder, f"{table_name}.meta")]:
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                return json.load(f)
+    return {}
+
+
+def _read_as_stored(path: str, columns: Union[List[str], None] = None) -> pd.DataFrame:
+    if is_parquet_file(path):
+        return pd.read_parquet(path, columns=columns)
+    # the values as written, so that rows hash the same whichever file they are read from
+    return read_separated_csv(path, dtype=str, keep_default_na=False, on_bad_lines="skip", usecols=columns)
+
+
+def _time_generated(df: pd.DataFrame) -> pd.Series:
+    return pd.to_datetime(df["TimeGenerated"], utc=True, errors="coerce", format="mixed")
+
+
+def row_hashes(df: pd.DataFrame, type_map: Dict[str, str]) -> List[str]:
+    """A hash of each row, over its values converted to the table types so that the same record
+    read from a CSV or a Parquet file, or written by another download, has the same hash."""
+    if len(df) == 0:
+        return []
+    values = apply_type_map(df, type_map).astype("string").fillna("")
+    return [f"{h:016x}" for h in pd.util.hash_pandas_object(values[sorted(values.columns)], index=False)]
+
+
+def files_high_water_mark(folder: str, files: List[str], type_map: Dict[str, str]) -> Tuple[Union[pd.Timestamp, None], List[str]]:
+    """The latest TimeGenerated over the table files and the hashes of the rows at that time.
+
+    Only the TimeGenerated column is read to find the mark, then the files holding it are read again for its rows.
+    """
+    high_water_mark = None
+    files_at_mark = []
+    for file in files:
+        path = os.path.join(folder, file)
+        if "TimeGenerated" not in log_table_columns(path):
+            continue
+        file_max = _time_generated(_read_as_stored(path, columns=["TimeGenerated"])).max()
+        if pd.isna(file_max):
+            continue
+        if high_water_mark is None or file_max > high_water_mark:
+            high_water_mark, files_at_mark = file_max, [path]
+        elif file_max == high_water_mark:
+            files_at_mark.append(path)
+
+    boundary_hashes = set()
+    for path in files_at_mark:
+        df = _read_as_stored(path)
+        boundary_hashes.update(row_hashes(df[_time_generated(df) == high_water_mark], type_map))
+    return high_water_mark, sorted(boundary_hashes)
+
+
+class SyncState:
+    """High-water marks of the tables of a folder, saved next to it as `<folder>_sync_state.json`.
+
+    The mark of a table is the latest TimeGenerated it holds, with the hashes of its rows at that time:
+    a delta starts at the mark (inclusive) and drops the rows of the mark already there. Tables without
+    a mark get it from their files, see `files_high_water_mark`. The hashes are taken on the rows as
+    downloaded, so the state belongs to the folder before anonymization.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.normpath(folder) + SYNC_STATE_SUFFIX
+        self.tables = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.tables = json.load(f).get("tables", {})
+
+    def high_water_mark(self, table_name: str, rescan: bool = False) -> Tuple[Union[pd.Timestamp, None], List[str]]:
+        entry = self.tables.get(table_name)
+        if entry is None or rescan:
+            files = list_tables(self.folder).get(table_name, [])
+            high_water_mark, boundary_hashes = files_high_water_mark(
+                self.folder, files, read_table_type_map(self.folder, table_name)
+            )
+            if high_water_mark is None:
+                return None, []
+            self.update(table_name, high_water_mark, boundary_hashes)
+            entry = self.tables[table_name]
+        return pd.Timestamp(entry["high_water_mark"]), entry["boundary_hashes"]
+
+    def update(self, table_name: str, high_water_mark: pd.Timestamp, boundary_hashes: List[str], sync_id: Union[str, None] = None) -> None:
+        self.tables[table_name] = {
+            "high_water_mark": high_water_mark.isoformat(),
+            "boundary_hashes": list(boundary_hashes),
+            "sync_id": sync_id,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tables": self.tables}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def drop_boundary_duplicates(folder: str, files: List[str], type_map: Dict[str, str], high_water_mark: pd.Timestamp, boundary_hashes: List[str]) -> int:
+    """Remove the rows at the high-water mark that are already in the table from the delta files, returns how many.
+
+    Only files holding the mark are rewritten (emptied files are removed), so running it again removes nothing.
+    """
+    boundary_hashes = set(boundary_hashes)
+    removed = 0
+    for file in files:
+        path = os.path.join(folder, file)
+        if not os.path.exists(path) or "TimeGenerated" not in log_table_columns(path):
+            continue
+        df = _read_as_stored(path)
+        at_mark = _time_generated(df) == high_water_mark
+        if not at_mark.any():
+            continue
+        duplicate = pd.Series(False, index=df.index)
+        duplicate[at_mark] = [h in boundary_hashes for h in row_hashes(df[at_mark], type_map)]
+        if not duplicate.any():
+            continue
+        removed += int(duplicate.sum())
+        if duplicate.all():
+            os.remove(path)
+        else:
+            write_log_table(df[~duplicate], path, type_map=type_map if is_parquet_file(path) else None)
+    return removed
+
+
+def delta_sync(
+        workspace_id: str,
+        folder: str,
+        table_names: Union[List[str], None] = None,
+        end_time: Union[datetime, None] = None,
+        ingestion_delay: timedelta = timedelta(minutes=15),
+        sync_id: Union[str, None] = None,
+        client=None,
+        max_workers: int = 8,
+        file_format: str = "csv",
+        rescan: bool = False,
+        verbose: bool = True
+    ) -> str:
+    """Download the rows of the tables newer than what the folder holds into a delta folder.
+
+    Each table is fetched from its high-water mark (see `SyncState`) to `end_time` with a `LogDownloader`,
+    the rows of the mark already in the folder are dropped, and the marks are moved to the end of the delta.
+    The delta is `<folder>_delta/<sync_id>`, with the layout of the folder and a `delta_manifest.json` of its
+    files, so that it can be anonymized on its own (pii_anony/pii_replace.py) and merged with `merge_delta`.
+    A sync that stopped (or had failed windows) resumes with the same `sync_id`, the marks of its tables
+    only move once they are complete.
+
+    Args:
+        workspace_id (str): Azure Log Analytics workspace id.
+        folder (str): Folder of the tables, e.g. data/alphineskihouse.
+        table_names (list): Tables to sync, all tables of the folder if None. Tables without rows are skipped.
+        end_time (datetime): End of the delta, now minus `ingestion_delay` if None, so that rows still being ingested are left for the next sync.
+        sync_id (str): Name of the delta, the end time if None.
+        rescan (bool): Take the high-water marks from the files, even if they are in the sync state.
+
+    Returns:
+        str: The delta folder.
+    """
+    start = time.time()
+    state = SyncState(folder)
+    if sync_id is not None and os.path.exists(os.path.join(os.path.normpath(folder) + DELTA_SUFFIX, sync_id, DELTA_MANIFEST)):
+        # resume: same range as the first run, whatever the state is now
+        delta_folder = os.path.join(os.path.normpath(folder) + DELTA_SUFFIX, sync_id)
+        with open(os.path.join(delta_folder, DELTA_MANIFEST), "r") as f:
+            manifest = json.load(f)
+        end_time = datetime.fromisoformat(manifest["end"])
+        if verbose:
+            print(f"Resuming sync {sync_id} of {folder} up to {end_time}")
+    else:
+        if end_time is None:
+            end_time = (datetime.now(timezone.utc) - ingestion_delay).replace(second=0, microsecond=0)
+        sync_id = sync_id or end_time.strftime("%Y%m%d%H%M%S")
+        delta_folder = os.path.join(os.path.normpath(folder) + DELTA_SUFFIX, sync_id)
+        manifest = {"sync_id": sync_id, "folder": folder, "end": end_time.isoformat(), "tables": {}}
+        for table_name in table_names or list(list_tables(folder).keys()):
+            high_water_mark, boundary_hashes = state.high_water_mark(table_name, rescan=rescan)
+            if high_water_mark is None:
+                print(f"Warning: Skipping {table_name}, it has no rows with a TimeGenerated in {folder}.")
+                continue
+            if high_water_mark.to_pydatetime() >= end_time:
+                continue
+            manifest["tables"][table_name] = {
+                "start": high_water_mark.isoformat(), "start_hashes": boundary_hashes, "complete": False
+            }
+        os.makedirs(delta_folder, exist_ok=True)
+        _save_delta_manifest(delta_folder, manifest)
+
+    tables = manifest["tables"]
+    if verbose:
+        print(f"Syncing {len(tables)} tables of {folder} into {delta_folder}")
+    downloader = LogDownloader(
+        workspace_id, delta_folder, client=client, max_workers=max_workers, file_format=file_format,
+        manifest_path=delta_folder + "_download_manifest.json", verbose=verbose
+    )
+    starts = {table_name: pd.Timestamp(entry["start"]).to_pydatetime() for table_name, entry in tables.items()}
+    downloader.download(list(tables.keys()), starts, end_time)
+
+    for table_name, entry in tables.items():
+        failed = [w for w in downloader.manifest.entries.values() if w["table"] == table_name and w["status"] == "failed"]
+        files = list_tables(delta_folder).get(table_name, [])
+        type_map = read_table_type_map(delta_folder, table_name)
+        duplicates = drop_boundary_duplicates(delta_folder, files, type_map, pd.Timestamp(entry["start"]), entry["start_hashes"])
+        files = list_tables(delta_folder).get(table_name, [])
+        high_water_mark, boundary_hashes = files_high_water_mark(delta_folder, files, type_map)
+        entry.update({
+            "files": files,
+            "rows": sum(len(_read_as_stored(os.path.join(delta_folder, f), columns=["TimeGenerated"])) for f in files),
+            "duplicates": entry.get("duplicates", 0) + duplicates,
+            "complete": len(failed) == 0,
+        })
+        if len(failed) > 0:
+            print(f"Warning: {len(failed)} windows of {table_name} failed, run the sync again with sync_id={sync_id} to resume it.")
+        elif high_water_mark is not None:
+            entry["high_water_mark"] = high_water_mark.isoformat()
+            state.update(table_name, high_water_mark, boundary_hashes, sync_id=sync_id)
+        if verbose:
+            print(f"{table_name}: {entry['rows']} new rows in {len(files)} files, {entry['duplicates']} duplicates dropped")
+    _save_delta_manifest(delta_folder, manifest)
+    if verbose:
+        print(f"Synced {sum(e['rows'] for e in tables.values())} rows in {time.time() - start:.1f} seconds")
+    return delta_folder
+
+
+def _save_delta_manifest(delta_folder: str, manifest: Dict) -> None:
+    tmp_path = os.path.join(delta_folder, DELTA_MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(delta_folder, DELTA_MANIFEST))
+
+
+def _to_table_folder(folder: str, table_name: str) -> None:
+    """Move a `<table>.csv` table into a `<table>` folder as its first chunk, so that deltas can be added as chunks."""
+    os.makedirs(os.path.join(folder, table_name), exist_ok=True)
+    for extension in LOG_EXTENSIONS + (".meta",):
+        path = os.path.join(folder, f"{table_name}{extension}")
+        if os.path.exists(path):
+            os.replace(path, os.path.join(folder, table_name, f"{table_name}_0{extension}"))
+
+
+def merge_delta(delta_folder: str, folder: str, verbose: bool = True) -> List[str]:
+    """Move the files of a delta into the folder of the tables, as new chunks.
+
+    A table stored as a single file becomes a folder of chunks first, new tables are moved as they are.
+    `delta_folder` may be the anonymized copy of the delta, the files are listed from it.
+
+    Returns:
+        list: The files added, relative to `folder`, to be loaded with `bulk_loader.bulk_load(..., only_files=...)`.
+    """
+    existing_tables = list_tables(folder)
+    added = []
+    for table_name, files in list_tables(delta_folder).items():
+        if len(files) == 0:
+            continue
+        if table_name in existing_tables and not os.path.isdir(os.path.join(folder, table_name)):
+            _to_table_folder(folder, table_name)
+        os.makedirs(os.path.join(folder, table_name), exist_ok=True)
+        meta_path = os.path.join(folder, table_name, f"{table_name}_0.meta")
+        delta_meta_path = os.path.join(delta_folder, table_name, f"{table_name}_0.meta")
+        if not os.path.exists(meta_path) and os.path.exists(delta_meta_path):
+            shutil.copyfile(delta_meta_path, meta_path)
+        for file in files:
+            target = os.path.join(folder, table_name, os.path.basename(file))
+            if os.path.exists(target):
+                raise ValueError(f"Cannot merge {file} of {delta_folder}, {target} already exists.")
+            shutil.move(os.path.join(delta_folder, file), target)
+            added.append(f"{table_name}/{os.path.basename(file)}")
+        if verbose:
+            print(f"Merged {len(files)} files of {table_name} into {folder}")
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Incremental sync of the tables of a folder from a Log Analytics workspace')
+    parser.add_argument('--action', type=str, default="sync", help="'sync' to download a delta, 'merge' to merge one into the folder")
+    parser.add_argument('--folder', type=str, required=True, help='Folder of the tables, e.g. data/alphineskihouse')
+    parser.add_argument('--workspace_id', type=str, default=None, help='Log Analytics workspace id')
+    parser.add_argument('--tables', type=str, nargs='*', default=None, help='Tables to sync, all tables of the folder by default')
+    parser.add_argument('--sync_id', type=str, default=None, help='Name of the delta, to resume a sync')
+    parser.add_argument('--max_workers', type=int, default=8, help='Maximum number of requests in flight')
+    parser.add_argument('--file_format', type=str, default="csv", help="'csv' or 'parquet'")
+    parser.add_argument('--rescan', action='store_true', help='Take the high-water marks from the files')
+    parser.add_argument('--delta', type=str, default=None, help='Delta folder to merge into --folder')
+    parser.add_argument('--anonymized_delta', type=str, default=None, help='Anonymized copy of the delta, merged into --anonymized_folder')
+    parser.add_argument('--anonymized_folder', type=str, default=None, help='Anonymized folder of the tables, e.g. data_anonymized/incidents/incident_5')
+    parser.add_argument('--port', type=str, default=None, help='With merge, load the files merged into --anonymized_folder into the MySQL container on this port')
+    parser.add_argument('--database_name', type=str, default="env_monitor_db", help='Database the merged files are loaded into')
+    parser.add_argument('--typed_columns', action='store_true', help='The tables were created with typed columns, same as for setup_database.py')
+    args = parser.parse_args()
+
+    if args.action == "sync":
+        if args.workspace_id is None:
+            raise ValueError("--workspace_id is required to sync")
+        delta_folder = delta_sync(
+            args.workspace_id, args.folder, table_names=args.tables, sync_id=args.sync_id,
+            max_workers=args.max_workers, file_format=args.file_format, rescan=args.rescan
+        )
+        print(
+            f"Delta saved to {delta_folder}, merge it with --action merge --delta {delta_folder} --folder {args.folder}, "
+            f"and its anonymized copy with --anonymized_delta <copy> --anonymized_folder <folder> [--port <port>]"
+        )
+    elif args.action == "merge":
+        if args.delta is None and args.anonymized_delta is None:
+            raise ValueError("--delta or --anonymized_delta is required to merge")
+        if (args.anonymized_delta is None) != (args.anonymized_folder is None):
+            raise ValueError("--anonymized_delta and --anonymized_folder go together")
+        if args.port is not None:
+            if args.anonymized_folder is None:
+                raise ValueError("--port loads the files merged into --anonymized_folder, which is required")
+            from secgym.database.bulk_loader import check_csv_mount
+            # before anything is merged, so that the merge can be run again
+            check_csv_mount(args.anonymized_folder, args.port)
+
+        if args.delta is not None:
+            # the raw delta goes with the raw folder, whose rows the high-water marks of the sync state come from
+            merge_delta(args.delta, args.folder)
+        if args.anonymized_delta is not None:
+            added = merge_delta(args.anonymized_delta, args.anonymized_folder)
+            if args.port is not None and len(added) > 0:
+                import mysql.connector
+                from secgym.database.bulk_loader import bulk_load
+                from secgym.database.setup_database import generate_build_id_sql, new_build_id
+                bulk_load(
+                    args.anonymized_folder, args.database_name, port=args.port, skip_tables=[],
+                    typed_columns=args.typed_columns, only_files=added
+                )
+                # the data changed, cached query results of the previous build must not be served
+                connection = mysql.connector.connect(host="localhost", port=args.port, user="root", password="admin")
+                cursor = connection.cursor()
+                for statement in generate_build_id_sql(args.database_name, new_build_id()):
+                    cursor.execute(statement)
+                connection.commit()
+                connection.close()
+    else:
+        raise ValueError(f"Invalid action: {args.action}")
@@ -11,15 +11,25 @@ from azure.identity import DefaultAzureCredential
 from typing import Optional, Union, Tuple
 from textwrap import dedent
 
-credential = DefaultAzureCredential()
-client = LogsQueryClient(credential)
+from secgym.database.log_io import LogTableWriter, find_log_table, is_parquet_file, table_to_chunk_folder, with_format
+from secgym.database.log_downloader import ChunkSizeController, estimate_rows_bytes
+
+_client = None
+
+def get_client() -> LogsQueryClient:
+    """The Log Analytics client, created on first use so that importing this module needs no credentials."""
+    global _client
+    if _client is None:
+        _client = LogsQueryClient(DefaultAzureCredential())
+    return _client
 
 def get_count(
         workspace_id: str,
         table_name: str,
-        timpespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]]
+        timpespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]],
+        client=None
     ) -> int:
-
+    client = client or get_client()
     response = client.query_workspace(workspace_id, f"{table_name} | count", timespan=timpespan)
 
     if response.status == LogsQueryStatus.SUCCESS:
@@ -30,9 +40,10 @@ def get_count(
 def calculate_size_per_entry(
         workspace_id: str,
         table_name: str,
-        timpespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]]
+        timpespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]],
+        client=None
     ) -> int:
-
+    client = client or get_client()
     response = client.query_workspace(workspace_id, f"{table_name} | limit 2000", timespan=timpespan, include_statistics=True)
     if response.status == LogsQueryStatus.SUCCESS:
         if  response.statistics['query']['datasetStatistics'][0]['tableRowCount'] == 0:
@@ -49,7 +60,8 @@ def check_segemented_query(
         timespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]],
         max_size_allowed: int = 60000000, # in bytes, ~60MB
         max_count_allowed: int = 500000,
-        verbose: bool = False
+        verbose: bool = False,
+        client=None
     ) -> Tuple[bool, int]:
     """
     Check if the query need to be segmented or not
@@ -70,8 +82,8 @@ def check_segemented_query(
     """
     # https://learn.microsoft.com/en-us/azure/azure-monitor/service-limits#la-query-api
 
-    total_count = get_count(workspace_id, table_name, timespan)
-    size_per_entry = calculate_size_per_entry(workspace_id, table_name, timespan)
+    total_count = get_count(workspace_id, table_name, timespan, client=client)
+    size_per_entry = calculate_size_per_entry(workspace_id, table_name, timespan, client=client)
     if total_count == -1 or size_per_entry == -1:
         return True, 0, -1, -1
     total_size = total_count * size_per_entry 
@@ -96,26 +108,37 @@ def check_segemented_query(
               )
     return True, int(row_per_query), total_count, total_size
 
-def save_table(file_path_name, response, need_metadata=False, previous_data=None):
-    """Helper function of `query_and_save_data` to save the table to a csv file"""
+def save_table(file_path_name, response, need_metadata=False, file_format="csv", append=False):
+    """Helper function of `query_and_save_data` to save the table to a csv file, or a typed parquet file if `file_format` is "parquet"
+
+    The rows are written as they come with a `LogTableWriter`, with `append` they are added to the existing file.
+
+    Returns:
+        Tuple: The earliest and latest TimeGenerated of the rows written, (-1, -1) if there are none.
+    """
     table = response.tables[0]
-    df = pd.DataFrame(data=table.rows, columns=table.columns)
-    if previous_data is not None:
-        df = pd.concat([previous_data, df], ignore_index=True)
-    if len(df) == 0:
+    if len(table.rows) == 0:
         return -1, -1
-    metadata = dict(zip(df.columns.tolist(), table.columns_types))
+    metadata = dict(zip(table.columns, table.columns_types))
     if need_metadata:
-        with open(file_path_name.replace(".csv", ".meta"), "w") as f:
+        with open(with_format(file_path_name, "meta"), "w") as f:
             json.dump(metadata, f)
 
-    json_columns = [col for col, dtype in metadata.items() if dtype == "dynamic"]
-    for column in json_columns:
-        df[column] = df[column].apply(lambda x: "{}" if x == "" else x)
-        df[column] = df[column].apply(lambda x: "{}" if pd.isnull(x) else x)
-    
-    df.to_csv(file_path_name, index=False, sep="❖", encoding='utf-8')
-    return df["TimeGenerated"].min(), df["TimeGenerated"].max()
+    with LogTableWriter(with_format(file_path_name, file_format), metadata, append=append) as writer:
+        writer.write(pd.DataFrame(data=table.rows, columns=table.columns))
+    return writer.min_time, writer.max_time
+
+def row_key(row) -> str:
+    """Key of a response row, used to skip the rows already saved."""
+    return json.dumps(list(row), default=str)
+
+def rows_at_time(table, time: datetime) -> set:
+    """Keys of the rows of a response table whose TimeGenerated is `time`."""
+    if "TimeGenerated" not in table.columns:
+        return set()
+    i = list(table.columns).index("TimeGenerated")
+    time = pd.Timestamp(time)
+    return {row_key(row) for row in table.rows if pd.to_datetime(row[i], utc=True) == time}
 
 def query_and_save_data(
         workspace_id: str,
@@ -123,46 +146,57 @@ def query_and_save_data(
         timespan: Optional[Union[timedelta, Tuple[datetime, timedelta], Tuple[datetime, datetime]]],
         file_path: str,
         verbose: bool = False,
-        append: bool = False
+        append: bool = False,
+        file_format: str = "csv",
+        client=None
 ):
+    client = client or get_client()
     max_size_allowed: int = 60000000
-    need_segement, row_per_query, total_count, total_size = check_segemented_query(workspace_id, table_name, timespan, verbose=verbose, max_size_allowed=max_size_allowed)
+    need_segement, row_per_query, total_count, total_size = check_segemented_query(workspace_id, table_name, timespan, verbose=verbose, max_size_allowed=max_size_allowed, client=client)
 
-    previous_data = None
+    previous_file = None
     chunk_id = 0
     if append:
-        if os.path.exists(os.path.join(file_path, f"{table_name}.csv")):
-            previous_data = pd.read_csv(os.path.join(file_path, f"{table_name}.csv"), sep="❖", encoding='utf-8', engine='python')
+        previous_file = find_log_table(os.path.join(file_path, table_name))
+        if previous_file is not None and is_parquet_file(previous_file):
+            # appending would rewrite the whole file, the new rows go to the next chunk of a table folder instead
+            table_to_chunk_folder(previous_file)
+            previous_file = None
+            file_format = "parquet"
+        if previous_file is not None:
+            # the new rows are appended to the file in its format
+            file_format = os.path.splitext(previous_file)[1][1:]
         elif os.path.exists(os.path.join(file_path, f"{table_name}")):
             # get the latest chunk number
             chunk_id = max([int(f.split("_")[-1].split(".")[0]) for f in os.listdir(os.path.join(file_path, f"{table_name}"))]) + 1
 
     if need_segement:
+        if row_per_query <= 0:
+            # the size of the table could not be estimated
+            row_per_query = 500000
         updated_file_path = os.path.join(file_path, table_name)
         os.makedirs(updated_file_path, exist_ok=True)
         
-        # get total time range in hours, conver to start and end time
+        # get total time range, conver to start and end time
         if isinstance(timespan, timedelta):
-            timespan = (datetime.utcnow() - timespan, datetime.utcnow())
+            timespan = (datetime.now(timezone.utc) - timespan, datetime.now(timezone.utc))
         elif isinstance(timespan[1], timedelta):
-            total_hours = timespan[1].total_seconds() / 3600
             timespan = (timespan[0], timespan[0] + timespan[1])
-        else:
-            total_hours = (timespan[1] - timespan[0]).total_seconds() / 3600
-        
-        # print(type(timespan[0]))
-        # get size per hour
-        size_per_hour = total_size / total_hours
-        # approximate 200MB per time chunk
-        time_chunk = int(200 * 1024 * 1024 / size_per_hour)
-        print(f"Time chunk: {time_chunk} hours")
+        total_hours = (timespan[1] - timespan[0]).total_seconds() / 3600
+
+        # first window from the estimated size per hour, then sized from the actual responses
+        size_per_hour = max(total_size / total_hours, 1)
+        controller = ChunkSizeController(
+            timedelta(hours=max_size_allowed * 0.8 / size_per_hour),
+            target_rows=int(row_per_query * 0.8),
+            target_bytes=int(max_size_allowed * 0.8),
+        )
+        print(f"Time chunk: {controller.window}")
 
         tmp_start_time = timespan[0]
-        # if table_name == "AADNonInteractiveUserSignInLogs":
-        #     # 2024-07-15 13:02:04.923788+00:00
-        #     tmp_start_time = datetime(2024, 7, 15, 13, 2, 4, 923788, tzinfo=timezone.utc) + timedelta(milliseconds=1)
-        #     chunk_id = 44
-        #     print(f"Resuming from chunk 44, {tmp_start_time}")
+        # keys of the saved rows at tmp_start_time, see `row_key`
+        saved_at_start = set()
+        consecutive_errors = 0
         query_template = dedent("""{table_name} 
 | order by TimeGenerated asc
 | serialize
@@ -171,7 +205,7 @@ def query_and_save_data(
 """)        
         while tmp_start_time < timespan[1]:
             # get data from a time chunk
-            tmp_timespan = (tmp_start_time, min(tmp_start_time + timedelta(hours=time_chunk), timespan[1]))
+            tmp_timespan = (tmp_start_time, min(tmp_start_time + controller.window, timespan[1]))
 
             response = client.query_workspace(
                 workspace_id, 
@@ -182,36 +216,68 @@ def query_and_save_data(
             if response.status != LogsQueryStatus.SUCCESS:
                 error = response.partial_error
                 print(f"Getting error, retry chunk {chunk_id}", error)
-                # update max size allowed and row per query
-                if "'sort' operator" in str(error): 
-                    time_chunk = int(time_chunk * 0.8)
-                    print("Sort operator error, reducing time chunk:", time_chunk)
+                if "'sort' operator" not in str(error):
+                    # update max size allowed and row per query
+                    max_size_allowed -= 2000000
+                    if total_count > 0 and total_size > 0:
+                        row_per_query = min(row_per_query, int(max_size_allowed // (total_size/total_count)))
+                print("Reducing time chunk:", controller.on_error())
+                consecutive_errors += 1
+                if consecutive_errors >= 20:
+                    print(f"Error: {table_name} keeps failing at {tmp_start_time}, stopping.")
+                    break
+                continue
+            consecutive_errors = 0
 
+            table = response.tables[0]
+            # the first row_per_query rows of the window were returned, the rest is in the next request
+            truncated = len(table.rows) >= row_per_query
+            if len(saved_at_start) > 0:
+                # the window starts at the time of the last saved rows, which are returned again
+                table.rows = [row for row in table.rows if row_key(row) not in saved_at_start]
+            rows = table.rows
+            earliest, latest = save_table(os.path.join(updated_file_path, f"{table_name}_{chunk_id}.csv"), response, need_metadata=chunk_id == 0, file_format=file_format)
+            if earliest == -1 and truncated:
+                print(f"Warning: More than {row_per_query} rows of {table_name} at {tmp_start_time}, some of them are skipped.")
+                tmp_start_time = tmp_timespan[0] + timedelta(milliseconds=1)
+                saved_at_start = set()
+                continue
+            if earliest == -1:
+                controller.observe(tmp_timespan[1] - tmp_timespan[0], 0)
+                print(f"No data bewteen {tmp_timespan[0]} - {tmp_timespan[1]}. Moving to next chunk.")
+                tmp_start_time = tmp_timespan[1]
+                saved_at_start = set()
+                continue
+            if truncated:
+                # the rows only cover the window up to the latest one returned, which gives the actual density
+                covered = pd.Timestamp(latest).to_pydatetime() - tmp_timespan[0]
+                if covered > timedelta(0):
+                    controller.observe(covered, len(rows), estimate_rows_bytes(rows))
                 else:
-                    max_size_allowed -= 2000000
-                    row_per_query = min(row_per_query, max_size_allowed // (total_size/total_count))
+                    controller.on_error()
             else:
-                # set new start time to be the last time from the response
-                earliest, latest = save_table(os.path.join(updated_file_path, f"{table_name}_{chunk_id}.csv"), response, need_metadata=chunk_id == 0)
-                if earliest == -1 and tmp_timespan[1] >= timespan[1]:
-                    print(f"Reached end of the table. Exiting.")
-                    break
-                if not tmp_timespan[1] >= timespan[1]:
-                    tmp_start_time = tmp_timespan[1]
-                    print(f"No data bewteen {tmp_timespan[0]} - {tmp_timespan[1]}. Moving to next chunk.")
-                    # print(response.statistics, response.)
-                else:   
-                    tmp_start_time = latest.to_pydatetime() + timedelta(milliseconds=1)
-                    chunk_id += 1
-                    print(f"Chunk {chunk_id}: {earliest} - {latest}")  #Required span: {tmp_timespan} || Actual:
+                controller.observe(tmp_timespan[1] - tmp_timespan[0], len(rows), estimate_rows_bytes(rows))
+            chunk_id += 1
+            print(f"Chunk {chunk_id}: {earliest} - {latest}, {len(rows)} rows, next time chunk: {controller.window}")
+            if truncated:
+                # resume at the last time from the response, rows with the same time may be left in this window
+                latest = pd.Timestamp(latest).to_pydatetime()
+                if latest > tmp_timespan[0]:
+                    saved_at_start = set()
+                saved_at_start |= rows_at_time(table, latest)
+                tmp_start_time = latest
+            else:
+                tmp_start_time = tmp_timespan[1]
+                saved_at_start = set()
+        print(f"Reached end of the table.")
             
     else:
         response = client.query_workspace(workspace_id, f"{table_name}", timespan=timespan)
         if chunk_id != 0:
             print(f"Resuming from chunk {chunk_id}, append 1 file only.")
-            earliest, _ = save_table(os.path.join(file_path, table_name, f"{table_name}_{chunk_id}.csv"), response, need_metadata=True)
+            earliest, _ = save_table(os.path.join(file_path, table_name, f"{table_name}_{chunk_id}.csv"), response, need_metadata=True, file_format=file_format)
         else: 
-            earliest, _ = save_table(os.path.join(file_path, f"{table_name}.csv"), response, need_metadata=True, previous_data=previous_data)
+            earliest, _ = save_table(os.path.join(file_path, f"{table_name}.csv"), response, need_metadata=previous_file is None, file_format=file_format, append=previous_file is not None)
         
         if earliest == -1:
             print(f"Table {table_name} is empty. Skipping.")
@@ -333,11 +399,21 @@ def get_new_times(start_time, end_time):
     return start_time, end_time
 
 
-def download_logs(workspace_id, table_names, start_time, end_time, file_path):
+def download_logs(workspace_id, table_names, start_time, end_time, file_path, file_format="csv", max_workers=None, client=None):
+    """Download tables of a workspace over a time range.
+
+    By default the tables are downloaded one after the other with `query_and_save_data`. With `max_workers`,
+    table x time-window tasks are run concurrently by a `LogDownloader`, which checkpoints its progress
+    so that running the same download again resumes it.
+    """
     os.makedirs(file_path, exist_ok=True)
+    if max_workers is not None:
+        from secgym.database.log_downloader import LogDownloader
+        downloader = LogDownloader(workspace_id, file_path, client=client, max_workers=max_workers, file_format=file_format)
+        return downloader.download(table_names, start_time, end_time)
     for table in table_names:
         try :
-            query_and_save_data(workspace_id, table, (start_time, end_time), file_path, verbose=True, append=False)
+            query_and_save_data(workspace_id, table, (start_time, end_time), file_path, verbose=True, append=False, file_format=file_format, client=client)
         except HttpResponseError as e:
             print(f"Table {table} is failed to save.")
             print(e)
@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+
+from secgym.database.setup_database import get_table_files, get_skip_tables, to_abs_path
+from secgym.trajectory_log import is_jsonl_file, read_trajectory_log
+
+# tables a query reads from
+TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+# predicates that can use an index: equality, IN, ranges and LIKE without a leading wildcard
+PREDICATE_PATTERN = re.compile(
+    r"`?(?:\w+`?\.`?)?(\w+)`?\s*(?:=|<=|>=|<|>|\bIN\s*\(|\bBETWEEN\b|\bLIKE\s+'(?!%))",
+    re.IGNORECASE,
+)
+RANGE_PATTERN = re.compile(
+    r"`?(?:\w+`?\.`?)?(\w+)`?\s*(?:<=|>=|<|>|\bBETWEEN\b)", re.IGNORECASE
+)
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+
+INDEX_PREFIX_LEN = 64  # indexed characters of a TEXT column
+MAX_INDEX_NAME_LEN = 64  # longest identifier MySQL accepts
+
+
+def iter_logged_queries(log_folder: str) -> Iterator[str]:
+    """Iterate over the SQL queries in the env logs (env_*.json, env_*.jsonl[.gz]) under a folder, e.g. latest_experiments."""
+    for root, _, files in os.walk(log_folder):
+        for file_name in sorted(files):
+            if not file_name.startswith("env_"):
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                if is_jsonl_file(file_name):
+                    logs = list(read_trajectory_log(path))
+                elif file_name.endswith(".json"):
+                    with open(path, "r", encoding="utf-8") as f:
+                        logs = json.load(f)
+                else:
+                    continue
+            except (json.JSONDecodeError, UnicodeDecodeError, EOFError, OSError):
+                print(f"Warning: Could not read {file_name}, skipping.")
+                continue
+            for log in logs:
+                for step in log.get("trajectory", []):
+                    if not step.get("info", {}).get("submit", False) and isinstance(step.get("action"), str):
+                        yield step["action"]
+
+
+def mine_filter_columns(queries, type_maps: Dict[str, Dict[str, str]]) -> Tuple[Counter, Counter]:
+    """Count the columns that queries filter on.
+
+    A column is attributed to every table of the query that has it.
+
+    Args:
+        queries (iterable): SQL queries.
+        type_maps (dict): The column types of each table, from the .meta files.
+
+    Returns:
+        Tuple[Counter, Counter]: How often each (table, column) is filtered on, and how often each
+            (table, equality column, range column) pair appears in the same query.
+    """
+    lowered = {t.lower(): (t, {c.lower(): c for c in type_map}) for t, type_map in type_maps.items()}
+    column_counts, pair_counts = Counter(), Counter()
+    for query in queries:
+        # literals can look like predicates, e.g. 'a = b', only keep whether they start with a wildcard
+        query = STRING_LITERAL.sub(lambda m: "'%'" if m.group(0).startswith("'%") else "'x'", query)
+        tables = [lowered[t] for t in {t.lower() for t in TABLE_PATTERN.findall(query)} if t in lowered]
+        if len(tables) == 0:
+            continue
+        where = re.split(r"\bWHERE\b", query, maxsplit=1, flags=re.IGNORECASE)
+        if len(where) < 2:
+            continue
+        filtered = {c.lower() for c in PREDICATE_PATTERN.findall(where[1])}
+        ranged = {c.lower() for c in RANGE_PATTERN.findall(where[1])}
+        for table_name, columns in tables:
+            table_filtered = [columns[c] for c in filtered if c in columns]
+            for column in table_filtered:
+                column_counts[(table_name, column)] += 1
+            for column in table_filtered:
+                for range_column in ranged:
+                    if range_column in columns and columns[range_column] != column:
+                        pair_counts[(table_name, column, columns[range_column])] += 1
+    return column_counts, pair_counts
+
+
+def plan_indexes(
+        type_maps: Dict[str, Dict[str, str]],
+        column_counts: Counter,
+        pair_counts: Counter,
+        min_count: int = 5,
+        max_indexes_per_table: int = 4,
+        ) -> Dict[str, List[List[str]]]:
+    """Choose the indexes of each table from the mined filter columns.
+
+    Composite (equality column, range column) indexes come first, then single column indexes on the
+    most filtered columns that are not already the leading column of an index. JSON (dynamic) columns
+    cannot be indexed and are left out.
+
+    Returns:
+        dict: For each table, a list of indexes, each a list of column names.
+    """
+    plan = {}
+    candidates = sorted(
+        [((t, c), n) for (t, c), n in column_counts.items() if n >= min_count]
+        + [((t, c, r), n) for (t, c, r), n in pair_counts.items() if n >= min_count],
+        key=lambda item: (-len(item[0]), -item[1]),
+    )
+    for key, _ in candidates:
+        table_name, columns = key[0], list(key[1:])
+        if any(type_maps[table_name].get(c) == "dynamic" for c in columns):
+            continue
+        indexes = plan.setdefault(table_name, [])
+        if len(indexes) >= max_indexes_per_table or any(index[0] == columns[0] for index in indexes):
+            continue
+        indexes.append(columns)
+    return plan
+
+
+def generate_create_index_sql(table_name: str, columns: List[str], type_map: Dict[str, str], typed: bool = False) -> str:
+    """Generate a CREATE INDEX statement, with a prefix length on TEXT columns."""
+    parts = []
+    for column in columns:
+        if typed and type_map.get(column) in ["long", "datetime"]:
+            parts.append(f"`{column}`")
+        else:
+            parts.append(f"`{column}`({INDEX_PREFIX_LEN})")
+    index_name = f"idx_{'_'.join(columns)}"
+    if len(index_name) > MAX_INDEX_NAME_LEN:
+        # keep names of long column lists distinct when they share a prefix
+        digest = hashlib.sha1(index_name.encode("utf-8")).hexdigest()[:8]
+        index_name = f"{index_name[:MAX_INDEX_NAME_LEN - len(digest) - 1]}_{digest}"
+    return f"CREATE INDEX `{index_name}` ON `{table_name}` ({', '.join(parts)});"
+
+
+def plan_indexes_from_logs(csv_folder: str, log_folder: str, skip_tables=[], min_count: int = 5) -> Dict[str, List[List[str]]]:
+    """Mine the env logs under `log_folder` and plan the indexes of the tables in `csv_folder`."""
+    type_maps = {table_name: type_map for table_name, type_map, _ in get_table_files(csv_folder, skip_tables)}
+    column_counts, pair_counts = mine_filter_columns(iter_logged_queries(log_folder), type_maps)
+    return plan_indexes(type_maps, column_counts, pair_counts, min_count=min_count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plan the indexes of a database from the queries in env logs')
+    parser.add_argument('--csv', type=str, help='Folder containing the CSV files')
+    parser.add_argument('--logs', type=str, default="../../latest_experiments", help='Folder with env_*.json or env_*.jsonl logs')
+    parser.add_argument('--layer', type=str, default="alert", help='Layer to use for the agent')
+    parser.add_argument('--min_count', type=int, default=5, help='Minimum number of queries filtering on a column')
+    args = parser.parse_args()
+
+    csv_folder = to_abs_path(args.csv)
+    plan = plan_indexes_from_logs(
+        csv_folder, to_abs_path(args.logs), get_skip_tables(args.layer, csv_folder), min_count=args.min_count
+    )
+    for table_name, indexes in sorted(plan.items()):
+        for columns in indexes:
+            print(f"{table_name}: {', '.join(columns)}")
@@ -0,0 +1,382 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple, Union
+
+from secgym.database.log_io import with_format
+
+MANIFEST_SUFFIX = "_download_manifest.json"
+
+
+def _status_name(response) -> str:
+    """Name of the status of a `query_workspace` response, e.g. SUCCESS or PARTIAL."""
+    status = response.status
+    return str(getattr(status, "name", status)).upper()
+
+
+def is_throttling_error(e: Exception) -> bool:
+    """Whether an error of `query_workspace` means the API throttled the request."""
+    if getattr(e, "status_code", None) in [429, 503]:
+        return True
+    message = str(e).lower()
+    return "throttl" in message or "too many requests" in message
+
+
+def retry_after_seconds(e: Exception) -> Union[float, None]:
+    """The Retry-After header of a throttled request, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def kql_datetime(value: datetime) -> str:
+    """A KQL datetime literal, in UTC."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return f"datetime({value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')})"
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def estimate_rows_bytes(rows, sample_size: int = 100) -> int:
+    """Approximate size of the rows of a response, from the string length of a sample of them."""
+    if len(rows) == 0:
+        return 0
+    step = max(1, len(rows) // sample_size)
+    sample = rows[::step]
+    return int(sum(len(str(row)) for row in sample) / len(sample) * len(rows))
+
+
+class ChunkSizeController:
+    """Pick the time window of the next request from the rows and bytes the previous requests returned.
+
+    After each response, the window is resized so that a response of the same density would hold
+    `target_rows` rows and `target_bytes` bytes: it grows on sparse periods and shrinks on dense ones.
+    A step changes the window by at most `max_step` times, and a truncated response or an error
+    shrinks it by `shrink_factor`.
+
+    Args:
+        initial_window (timedelta): Window of the first request.
+        target_rows (int): Rows a response should hold, below the row limit of the API.
+        target_bytes (int): Bytes a response should hold, below the size limit of the API.
+        min_window (timedelta): The window never gets smaller than this.
+        max_window (timedelta): The window never gets larger than this.
+    """
+
+    def __init__(
+            self,
+            initial_window: timedelta,
+            target_rows: int = 400000,
+            target_bytes: int = 48000000,
+            min_window: timedelta = timedelta(minutes=1),
+            max_window: timedelta = timedelta(days=7),
+            max_step: float = 4.0,
+            shrink_factor: float = 0.5
+        ):
+        self.target_rows = target_rows
+        self.target_bytes = target_bytes
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_step = max_step
+        self.shrink_factor = shrink_factor
+        self.window = self._clamp(initial_window)
+
+    def _clamp(self, window: timedelta) -> timedelta:
+        return max(self.min_window, min(self.max_window, window))
+
+    def observe(self, window: timedelta, num_rows: int, num_bytes: Union[int, None] = None, truncated: bool = False) -> timedelta:
+        """Update the window from a response covering `window`, returns the window of the next request."""
+        if truncated:
+            return self.on_error()
+        if num_rows == 0:
+            scale = self.max_step
+        else:
+            scale = self.target_rows / num_rows
+            if num_bytes:
+                scale = min(scale, self.target_bytes / num_bytes)
+            scale = max(1 / self.max_step, min(self.max_step, scale))
+        self.window = self._clamp(window * scale)
+        return self.window
+
+    def on_error(self) -> timedelta:
+        """Shrink the window after a truncated response or an error, returns the window of the next request."""
+        self.window = self._clamp(self.window * self.shrink_factor)
+        return self.window
+
+
+class DownloadManifest:
+    """Checkpoint of a download, one entry per table and time window, saved after every window.
+
+    An entry records the rows of the window, the file they were written to and its checksum. A window
+    is done if its entry says so and the file is still there with the same checksum, so a download
+    that crashed (or whose files were removed) resumes exactly where it stopped. Windows that had to be
+    split are recorded as such, and their halves are downloaded instead.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f).get("windows", {})
+
+    @staticmethod
+    def key(table_name: str, start: datetime, end: datetime) -> str:
+        return f"{table_name}/{start.isoformat()}/{end.isoformat()}"
+
+    def get(self, table_name: str, start: datetime, end: datetime) -> Union[Dict, None]:
+        return self.entries.get(self.key(table_name, start, end))
+
+    def is_done(self, table_name: str, start: datetime, end: datetime, folder: str) -> bool:
+        entry = self.get(table_name, start, end)
+        if entry is None or entry["status"] != "done":
+            return False
+        if entry["file"] is None:
+            return True  # empty window
+        path = os.path.join(folder, entry["file"])
+        return os.path.exists(path) and file_checksum(path) == entry["checksum"]
+
+    def record(self, table_name: str, start: datetime, end: datetime, **entry) -> None:
+        with self._lock:
+            self.entries[self.key(table_name, start, end)] = {
+                "table": table_name, "start": start.isoformat(), "end": end.isoformat(), **entry
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"windows": self.entries}, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+class AdaptiveConcurrency:
+    """Limit the number of requests in flight, halving the limit when the API throttles.
+
+    The limit starts at `max_concurrency`, is halved on every throttled request (down to `min_concurrency`)
+    and grows by one after `increase_after` successful requests in a row.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1, increase_after: int = 5):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase_after = increase_after
+        self.limit = max_concurrency
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._condition:
+            self._active -= 1
+            if throttled:
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                self._successes = 0
+                print(f"Throttled, concurrency limit reduced to {self.limit}")
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class LogDownloader:
+    """Download tables of a workspace as table x time-window tasks over a bounded worker pool.
+
+    Each table is written as a folder of chunks, `<table>/<table>_<window start>.csv` (or .parquet) with
+    a `<table>/<table>_0.meta` type map, which is the layout `setup_database.get_table_files` reads. A
+    window whose result is truncated or fails is split in two halves, down to `min_window`. Progress is
+    checkpointed in a `DownloadManifest`, see `download`.
+
+    Args:
+        workspace_id (str): Azure Log Analytics workspace id.
+        file_path (str): Folder the tables are saved to.
+        client: Anything with the `LogsQueryClient.query_workspace` interface, the Azure client if None.
+        max_workers (int): Maximum number of requests in flight.
+        window (timedelta): Width of the time windows the range is cut into.
+        min_window (timedelta): Windows are not split below this width.
+        max_retries (int): Attempts of a throttled request before the window fails.
+        file_format (str): "csv" or "parquet".
+        manifest_path (str): Checkpoint file, `<file_path>_download_manifest.json` by default (next to the folder,
+            so that the folder only holds tables).
+    """
+
+    def __init__(
+            self,
+            workspace_id: str,
+            file_path: str,
+            client=None,
+            max_workers: int = 8,
+            window: timedelta = timedelta(hours=6),
+            min_window: timedelta = timedelta(minutes=1),
+            max_retries: int = 8,
+            file_format: str = "csv",
+            manifest_path: Union[str, None] = None,
+            verbose: bool = True
+        ):
+        if client is None:
+            from secgym.database.download_logs import get_client
+            client = get_client()
+        self.workspace_id = workspace_id
+        self.file_path = file_path
+        self.client = client
+        self.max_workers = max_workers
+        self.window = window
+        self.min_window = min_window
+        self.max_retries = max_retries
+        self.file_format = file_format
+        self.verbose = verbose
+        self.concurrency = AdaptiveConcurrency(max_workers)
+        self.manifest = DownloadManifest(manifest_path or os.path.normpath(file_path) + MANIFEST_SUFFIX)
+        self._meta_lock = threading.Lock()
+
+    def plan(
+            self,
+            table_names: List[str],
+            start_time: Union[datetime, Dict[str, datetime]],
+            end_time: datetime
+        ) -> List[Tuple[str, datetime, datetime]]:
+        """Cut the time range into windows for each table, replacing the windows split in an earlier run by their halves.
+
+        `start_time` may be a dict with the start of each table, e.g. its high-water mark for a delta sync.
+        """
+        tasks = []
+        for table_name in table_names:
+            window_start = start_time[table_name] if isinstance(start_time, dict) else start_time
+            while window_start < end_time:
+                window_end = min(window_start + self.window, end_time)
+                tasks.extend(self._expand_split(table_name, window_start, window_end))
+                window_start = window_end
+        return tasks
+
+    def _expand_split(self, table_name: str, start: datetime, end: datetime) -> List[Tuple[str, datetime, datetime]]:
+        entry = self.manifest.get(table_name, start, end)
+        if entry is not None and entry["status"] == "split":
+            middle = start + (end - start) / 2
+            return self._expand_split(table_name, start, middle) + self._expand_split(table_name, middle, end)
+        return [(table_name, start, end)]
+
+    def _query(self, table_name: str, start: datetime, end: datetime):
+        """Query a window, retrying throttled requests with backoff. The bounds are exact: start <= TimeGenerated < end."""
+        query = f"{table_name} | where TimeGenerated >= {kql_datetime(start)} and TimeGenerated < {kql_datetime(end)}"
+        for attempt in range(self.max_retries):
+            self.concurrency.acquire()
+            throttled = False
+            try:
+                return self.client.query_workspace(self.workspace_id, query, timespan=(start, end))
+            except Exception as e:
+                if not is_throttling_error(e):
+                    raise
+                throttled = True
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(60, 2 ** attempt) * (0.5 + random.random())
+            finally:
+                self.concurrency.release(throttled=throttled)
+            time.sleep(delay)
+        raise TimeoutError(f"{table_name} {start} - {end} is still throttled after {self.max_retries} attempts.")
+
+    def _chunk_path(self, table_name: str, start: datetime) -> str:
+        return f"{table_name}/{table_name}_{start.strftime('%Y%m%d%H%M%S%f')}.{self.file_format}"
+
+    def _write_meta(self, table_name: str, table) -> None:
+        meta_path = os.path.join(self.file_path, table_name, f"{table_name}_0.meta")
+        with self._meta_lock:
+            if not os.path.exists(meta_path):
+                with open(meta_path, "w") as f:
+                    json.dump(dict(zip(table.columns, table.columns_types)), f)
+
+    def download_window(self, table_name: str, start: datetime, end: datetime) -> List[Tuple[str, datetime, datetime]]:
+        """Download one window, returns the windows to download instead if it had to be split."""
+        from secgym.database.download_logs import save_table
+
+        response = self._query(table_name, start, end)
+        if _status_name(response) != "SUCCESS":
+            error = getattr(response, "partial_error", None) or getattr(response, "message", None)
+            if end - start > self.min_window:
+                middle = start + (end - start) / 2
+                if self.verbose:
+                    print(f"{table_name} {start} - {end} failed or was truncated, splitting it: {error}")
+                self.manifest.record(table_name, start, end, status="split", error=str(error))
+                return [(table_name, start, middle), (table_name, middle, end)]
+            self.manifest.record(table_name, start, end, status="failed", error=str(error))
+            print(f"Error: {table_name} {start} - {end} failed: {error}")
+            return []
+
+        table = response.tables[0]
+        num_rows = len(table.rows)
+        if num_rows == 0:
+            self.manifest.record(table_name, start, end, status="done", rows=0, file=None, checksum=None)
+            return []
+        os.makedirs(os.path.join(self.file_path, table_name), exist_ok=True)
+        self._write_meta(table_name, table)
+        chunk_path = self._chunk_path(table_name, start)
+        save_table(os.path.join(self.file_path, with_format(chunk_path, "csv")), response, file_format=self.file_format)
+        self.manifest.record(
+            table_name, start, end, status="done", rows=num_rows, file=chunk_path,
+            checksum=file_checksum(os.path.join(self.file_path, chunk_path))
+        )
+        if self.verbose:
+            print(f"{table_name} {start} - {end}: {num_rows} rows")
+        return []
+
+    def download(self, table_names: List[str], start_time: Union[datetime, Dict[str, datetime]], end_time: datetime) -> Dict[str, int]:
+        """Download the tables over the time range, skipping the windows already done. See `plan` for `start_time`.
+
+        Returns:
+            dict: The number of rows downloaded for each table, over all its windows (including earlier runs).
+        """
+        os.makedirs(self.file_path, exist_ok=True)
+        start = time.time()
+        tasks = self.plan(table_names, start_time, end_time)
+        pending = [task for task in tasks if not self.manifest.is_done(task[0], task[1], task[2], self.file_path)]
+        if self.verbose:
+            print(f"{len(tasks)} windows, {len(tasks) - len(pending)} already downloaded")
+
+        failed = 0
+        # one thread per request in flight, the adaptive limit decides how many are actually sent
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download_window, *task): task for task in pending}
+            while len(futures) > 0:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = futures.pop(future)
+                    try:
+                        for subtask in future.result():
+                            futures[executor.submit(self.download_window, *subtask)] = subtask
+                    except Exception as e:
+                        # e.g. an error that is not throttling, recorded so that the window is retried by the next run
+                        self.manifest.record(*task, status="failed", error=str(e))
+                        failed += 1
+                        print(f"Error: {task[0]} {task[1]} - {task[2]} failed: {e}")
+
+        rows = {table_name: 0 for table_name in table_names}
+        for table_name, window_start, window_end in self.plan(table_names, start_time, end_time):
+            entry = self.manifest.get(table_name, window_start, window_end)
+            if entry is not None and entry["status"] == "done":
+                rows[table_name] += entry["rows"]
+        if self.verbose:
+            print(f"Downloaded {sum(rows.values())} rows of {len(table_names)} tables in {time.time() - start:.1f} seconds, {failed} windows failed")
+        return rows
@@ -0,0 +1,467 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import io
+import json
+import os
+import time
+from typing import Dict, List, Union
+
+import pandas as pd
+
+from secgym.database.process_logs import SEPARATOR, QUOTECHAR
+
+TYPE_MAP_KEY = b"secgym.type_map"
+LOG_EXTENSIONS = (".csv", ".parquet")
+# single byte stand-in for the separator, so that the C and pyarrow parsers can be used
+SENTINEL = "\x1f"
+TRANSCODE_BLOCK_SIZE = 1 << 22
+
+
+class SeparatorTranscoder(io.RawIOBase):
+    """Binary file wrapper replacing a multi-byte separator with `SENTINEL` while it is read.
+
+    The file is streamed block by block, a separator cut in two by a block boundary is completed with the
+    next block. Raises ValueError if the file already contains the sentinel, in which case the result
+    would be ambiguous. Use it through `io.BufferedReader`.
+    """
+
+    def __init__(self, path: str, separator: str = SEPARATOR, block_size: int = TRANSCODE_BLOCK_SIZE):
+        super().__init__()
+        self._file = open(path, "rb")
+        self.name = path
+        self._separator = separator.encode("utf-8")
+        self._sentinel = SENTINEL.encode("utf-8")
+        self._block_size = block_size
+        self._buffer = b""
+        self._pending = b""  # bytes that may be the start of a separator
+        self._started = False
+        self._eof = False
+
+    def _transcode(self, block: bytes, last: bool) -> bytes:
+        data = self._pending + block
+        self._pending = b""
+        if not self._started:
+            self._started = True
+            if data.startswith(b"\xef\xbb\xbf"):  # utf-8 BOM
+                data = data[3:]
+        if not last:
+            for keep in range(len(self._separator) - 1, 0, -1):
+                if data.endswith(self._separator[:keep]):
+                    data, self._pending = data[:-keep], data[-keep:]
+                    break
+        if self._sentinel in data:
+            raise ValueError(f"{self.name} contains the sentinel {SENTINEL!r}, cannot transcode it.")
+        return data.replace(self._separator, self._sentinel)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._buffer) == 0 and not self._eof:
+            block = self._file.read(self._block_size)
+            self._eof = len(block) == 0
+            self._buffer = self._transcode(block, self._eof)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def _restore_separator(df: pd.DataFrame, separator: str) -> pd.DataFrame:
+    """Put back separators that were inside quoted fields."""
+    for column in df.columns:
+        values = df[column]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+            continue
+        if values.str.contains(SENTINEL, regex=False).any():
+            df[column] = values.str.replace(SENTINEL, separator, regex=False)
+    return df
+
+
+def read_separated_csv(path: str, separator: str = SEPARATOR, engine: str = "c", chunksize=None, **kwargs):
+    """Read a ❖-separated CSV file with the C (or pyarrow) parser instead of the python one.
+
+    The separator is transcoded to a single byte on the fly, so the file is never copied. With `chunksize`,
+    an iterator over DataFrames of `chunksize` rows is returned, and the file is streamed. Files that
+    already contain the sentinel are read with the python parser (with `chunksize`, the ValueError is
+    raised while iterating instead).
+
+    Args:
+        path (str): Path to the CSV file.
+        separator (str): Field separator of the file.
+        engine (str): "c" or "pyarrow".
+        chunksize (int, optional): Rows per chunk, read the whole file if None.
+        **kwargs: Passed on to `pd.read_csv`, e.g. `usecols`, `dtype` or `on_bad_lines`.
+    """
+    kwargs.setdefault("quotechar", QUOTECHAR)
+    if len(separator.encode("utf-8")) == 1:
+        return pd.read_csv(path, sep=separator, engine=engine, encoding="utf-8-sig", chunksize=chunksize, **kwargs)
+    handle = io.BufferedReader(SeparatorTranscoder(path, separator), TRANSCODE_BLOCK_SIZE)
+    try:
+        if chunksize is None:
+            with handle:
+                df = pd.read_csv(handle, sep=SENTINEL, engine=engine, encoding="utf-8", **kwargs)
+            return _restore_separator(df, separator)
+        reader = pd.read_csv(handle, sep=SENTINEL, engine=engine, encoding="utf-8", chunksize=chunksize, **kwargs)
+        return (_restore_separator(df, separator) for df in reader)
+    except ValueError as e:
+        if repr(SENTINEL) not in str(e):
+            raise
+        print(f"Warning: {e} Falling back to the python parser.")
+        return pd.read_csv(path, sep=separator, engine="python", encoding="utf-8-sig", chunksize=chunksize, **kwargs)
+
+
+def is_parquet_file(path: str) -> bool:
+    return path.endswith(".parquet")
+
+
+def with_format(path: str, file_format: str) -> str:
+    """Swap the extension of a table file, e.g. `T_0.csv` to `T_0.parquet`."""
+    return os.path.splitext(path)[0] + f".{file_format}"
+
+
+def normalize_dynamic(values: pd.Series) -> pd.Series:
+    """JSON strings of a dynamic column, empty values become "{}"."""
+    values = values.astype(object)
+    values = values.where(values.notna(), "{}")
+    is_str = values.map(type).eq(str)
+    if not is_str.all():
+        # e.g. dicts or lists parsed by the client
+        values[~is_str] = values[~is_str].map(json.dumps)
+    return values.mask(values.eq(""), "{}")
+
+
+def apply_type_map(df: pd.DataFrame, type_map: Dict[str, str]) -> pd.DataFrame:
+    """Convert the columns of a table to the types of its .meta type map.
+
+    datetime columns become UTC timestamps, long columns nullable integers, bool columns nullable booleans,
+    dynamic columns JSON strings (empty values become "{}") and everything else strings.
+    """
+    df = df.copy()
+    for column, dtype in type_map.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if dtype == "datetime":
+            df[column] = pd.to_datetime(values, utc=True, errors="coerce", format="mixed")
+        elif dtype == "long":
+            df[column] = pd.to_numeric(values, errors="coerce").astype("Int64")
+        elif dtype == "bool":
+            df[column] = values.map(
+                lambda x: x if isinstance(x, bool) or pd.isna(x) else (None if x == "" else str(x).lower() == "true")
+            ).astype("boolean")
+        elif dtype == "dynamic":
+            df[column] = normalize_dynamic(values).astype("string")
+        else:
+            df[column] = values.map(lambda x: x if x is None or isinstance(x, str) or pd.isna(x) else str(x)).astype("string")
+    return df
+
+
+def write_log_table(df: pd.DataFrame, path: str, type_map: Union[Dict[str, str], None] = None) -> None:
+    """Write a table as Parquet (typed, with the type map embedded) or ❖-separated CSV, by the extension of `path`.
+
+    Parquet is the intermediate format of the pipeline: typed, compressed and readable column by column.
+    The CSV files are only needed for the MySQL load, see `parquet_folder_to_csv`.
+    """
+    tmp_path = path + ".tmp"
+    if is_parquet_file(path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if type_map is not None:
+            df = apply_type_map(df, type_map)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if type_map is not None:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), TYPE_MAP_KEY: json.dumps(type_map)})
+        pq.write_table(table, tmp_path)
+    else:
+        df.to_csv(tmp_path, index=False, sep=SEPARATOR, quotechar=QUOTECHAR, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class LogTableWriter:
+    """Write a table file page by page, so that memory only holds one page whatever the table size.
+
+    CSV files are appended to, Parquet files get one row group per page. Dynamic columns are normalized
+    (see `normalize_dynamic`) and the range of `TimeGenerated` is tracked as pages are written. A new
+    file is written to a temporary path and moved in place on `close`.
+
+    Args:
+        path (str): The table file, .csv or .parquet.
+        type_map (dict): The .meta type map of the table, used to type Parquet files and find dynamic columns.
+        append (bool): Add the pages to the rows of an existing CSV file instead of replacing it. Parquet
+            files cannot be appended to without rewriting them, write the new rows to a new chunk of the
+            table instead (see `table_to_chunk_folder`).
+    """
+
+    def __init__(self, path: str, type_map: Union[Dict[str, str], None] = None, append: bool = False):
+        self.path = path
+        self.type_map = type_map or {}
+        self.append = append and os.path.exists(path)
+        if self.append and is_parquet_file(path):
+            raise ValueError(f"Cannot append to {path}, Parquet files cannot be appended to, see `table_to_chunk_folder`.")
+        self.num_rows = 0
+        self.min_time = None
+        self.max_time = None
+        self._columns = None
+        self._file = None
+        self._parquet_writer = None
+        self._write_path = path if self.append else path + ".tmp"
+
+    def _open(self, df: pd.DataFrame) -> None:
+        self._columns = list(df.columns)
+        if self.append:
+            existing = log_table_columns(self.path)
+            if existing != self._columns:
+                raise ValueError(f"Cannot append to {self.path}, its columns {existing} differ from {self._columns}.")
+        if is_parquet_file(self.path):
+            import pyarrow.parquet as pq
+
+            self._parquet_writer = pq.ParquetWriter(self._write_path, self._to_arrow(df).schema)
+        else:
+            self._file = open(self._write_path, "a" if self.append else "w", encoding="utf-8", newline="")
+            if not self.append:
+                self._file.write(SEPARATOR.join(self._columns) + "\n")
+
+    def _to_arrow(self, df: pd.DataFrame, schema=None):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(apply_type_map(df, self.type_map), schema=schema, preserve_index=False)
+        if schema is None and len(self.type_map) > 0:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), TYPE_MAP_KEY: json.dumps(self.type_map)})
+        return table
+
+    def write(self, df: pd.DataFrame) -> int:
+        """Write a page of rows, returns the number of rows written."""
+        if len(df) == 0:
+            return 0
+        if self._columns is None:
+            self._open(df)
+        if "TimeGenerated" in df.columns:
+            times = pd.to_datetime(df["TimeGenerated"], utc=True, errors="coerce", format="mixed")
+            page_min, page_max = times.min(), times.max()
+            if not pd.isna(page_min):
+                self.min_time = page_min if self.min_time is None else min(self.min_time, page_min)
+                self.max_time = page_max if self.max_time is None else max(self.max_time, page_max)
+        if self._parquet_writer is not None:
+            self._parquet_writer.write_table(self._to_arrow(df[self._columns], schema=self._parquet_writer.schema))
+        else:
+            df = df[self._columns].copy()
+            for column, dtype in self.type_map.items():
+                if dtype == "dynamic" and column in df.columns:
+                    df[column] = normalize_dynamic(df[column])
+            df.to_csv(self._file, index=False, header=False, sep=SEPARATOR, quotechar=QUOTECHAR, lineterminator="\n")
+        self.num_rows += len(df)
+        return len(df)
+
+    def close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+        else:
+            return
+        if self._write_path != self.path:
+            os.replace(self._write_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._write_path != self.path:
+            # keep the previous file as it was
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+            elif self._file is not None:
+                self._file.close()
+            if os.path.exists(self._write_path):
+                os.remove(self._write_path)
+            return False
+        self.close()
+        return False
+
+
+def read_type_map(path: str) -> Union[Dict[str, str], None]:
+    """The type map embedded in a Parquet table, None if there is none."""
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path).metadata or {}
+    if TYPE_MAP_KEY not in metadata:
+        return None
+    return json.loads(metadata[TYPE_MAP_KEY])
+
+
+def log_table_columns(path: str) -> List[str]:
+    """The column names of a table file, without reading its rows."""
+    if is_parquet_file(path):
+        import pyarrow.parquet as pq
+
+        return list(pq.read_schema(path).names)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return f.readline().rstrip("\r\n").split(SEPARATOR)
+
+
+def read_log_table(path: str, columns: Union[List[str], None] = None) -> pd.DataFrame:
+    """Read a table file (Parquet or ❖-separated CSV), only the given columns if any."""
+    if is_parquet_file(path):
+        return pd.read_parquet(path, columns=columns)
+    return read_separated_csv(path, on_bad_lines="skip", usecols=columns)
+
+
+def find_log_table(path_without_extension: str) -> Union[str, None]:
+    """The existing table file for a path without extension, preferring Parquet."""
+    for extension in reversed(LOG_EXTENSIONS):
+        if os.path.exists(path_without_extension + extension):
+            return path_without_extension + extension
+    return None
+
+
+def table_to_chunk_folder(path: str) -> str:
+    """Move a single file table to the first chunk of a `<table>` folder, returns the new path of the file.
+
+    The .meta file and the other formats of the table move along, e.g. `T.parquet`, `T.csv` and `T.meta`
+    become `T/T_0.parquet`, `T/T_0.csv` and `T/T_0.meta`. New rows can then be written to a new chunk
+    without rewriting the existing ones.
+    """
+    folder, file_name = os.path.split(path)
+    table_name, extension = os.path.splitext(file_name)
+    table_folder = os.path.join(folder, table_name)
+    if os.path.isdir(table_folder) and len(os.listdir(table_folder)) > 0:
+        raise ValueError(f"Cannot move {path} to {table_folder}, the folder already has chunks.")
+    os.makedirs(table_folder, exist_ok=True)
+    for source_extension in LOG_EXTENSIONS + (".meta",):
+        source = os.path.join(folder, table_name + source_extension)
+        if os.path.exists(source):
+            os.replace(source, os.path.join(table_folder, f"{table_name}_0{source_extension}"))
+    return os.path.join(table_folder, f"{table_name}_0{extension}")
+
+
+def _table_meta_path(path: str) -> str:
+    """The .meta file of a table file, chunks of a table folder share the meta file of the first chunk."""
+    meta_path = with_format(path, "meta")
+    if not os.path.exists(meta_path):
+        table_folder = os.path.dirname(path)
+        table_name = os.path.basename(table_folder)
+        chunk_meta_path = os.path.join(table_folder, f"{table_name}_0.meta")
+        if os.path.exists(chunk_meta_path):
+            return chunk_meta_path
+    return meta_path
+
+
+def _iter_files(folder: str, extension: str):
+    for root, _, files in os.walk(folder):
+        for file_name in sorted(files):
+            if file_name.endswith(extension) and not file_name.startswith("._"):
+                yield os.path.join(root, file_name)
+
+
+def has_parquet_files(folder: str) -> bool:
+    return next(_iter_files(folder, ".parquet"), None) is not None
+
+
+def parquet_folder_to_csv(folder: str, force: bool = False, verbose: bool = False) -> int:
+    """Emit the ❖-separated CSV (and .meta) files of the Parquet tables in a folder, next to them.
+
+    CSV files newer than their Parquet file are kept unless `force`.
+
+    Returns:
+        int: The number of CSV files written.
+    """
+    written = 0
+    for parquet_path in _iter_files(folder, ".parquet"):
+        csv_path = with_format(parquet_path, "csv")
+        if not force and os.path.exists(csv_path) and os.path.getmtime(csv_path) >= os.path.getmtime(parquet_path):
+            continue
+        start_time = time.time()
+        write_log_table(pd.read_parquet(parquet_path), csv_path)
+        type_map = read_type_map(parquet_path)
+        meta_path = _table_meta_path(parquet_path)
+        if type_map is not None and not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump(type_map, f)
+        written += 1
+        if verbose:
+            print(f"Wrote {csv_path} in {time.time() - start_time:.2f} seconds")
+    return written
+
+
+def csv_folder_to_parquet(folder: str, remove_csv: bool = False, verbose: bool = False) -> int:
+    """Convert the ❖-separated CSV tables of a folder to Parquet, typed with their .meta type maps.
+
+    Returns:
+        int: The number of Parquet files written.
+    """
+    written = 0
+    for csv_path in _iter_files(folder, ".csv"):
+        start_time = time.time()
+        meta_path = _table_meta_path(csv_path)
+        type_map = None
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                type_map = json.load(f)
+        df = read_separated_csv(csv_path, on_bad_lines="skip", dtype=str, keep_default_na=False)
+        write_log_table(df, with_format(csv_path, "parquet"), type_map)
+        if remove_csv:
+            os.remove(csv_path)
+        written += 1
+        if verbose:
+            print(f"Converted {csv_path} in {time.time() - start_time:.2f} seconds")
+    return written
+
+
+def benchmark_readers(path: str, engines=["python", "c", "pyarrow"]) -> Dict[str, float]:
+    """Time reading a ❖-separated CSV file with each parser, returns the seconds per engine."""
+    size = os.path.getsize(path) / 1e6
+    timings = {}
+    num_rows = None
+    for engine in engines:
+        start_time = time.time()
+        try:
+            if engine == "python":
+                # the baseline: the python parser reads the multi-byte separator directly, no transcoding
+                df = pd.read_csv(path, sep=SEPARATOR, quotechar=QUOTECHAR, encoding="utf-8-sig", on_bad_lines="skip", engine="python")
+            else:
+                df = read_separated_csv(path, engine=engine, on_bad_lines="skip")
+        except ImportError as e:
+            print(f"{engine}: skipped ({e})")
+            continue
+        timings[engine] = time.time() - start_time
+        if num_rows is not None and len(df) != num_rows:
+            print(f"Warning: {engine} read {len(df)} rows, python read {num_rows}.")
+        num_rows = len(df) if num_rows is None else num_rows
+        print(
+            f"{engine}: {timings[engine]:.2f} seconds, {size / max(timings[engine], 1e-9):.1f} MB/s, "
+            f"{timings.get('python', timings[engine]) / max(timings[engine], 1e-9):.1f}x the python engine"
+        )
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert downloaded log tables between Parquet and CSV')
+    parser.add_argument('--folder', type=str, help='Folder containing the tables')
+    parser.add_argument('--to', type=str, default="csv", help="'csv' to emit the CSV files for the MySQL load, 'parquet' to convert existing CSV files")
+    parser.add_argument('--force', action='store_true', help='Rewrite CSV files that are up to date')
+    parser.add_argument('--remove_csv', action='store_true', help='Remove the CSV files after converting them to Parquet')
+    parser.add_argument('--benchmark', type=str, default=None, help='Time the CSV parsers on this file instead of converting')
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark_readers(args.benchmark)
+        exit(0)
+
+    if args.to == "csv":
+        num_files = parquet_folder_to_csv(args.folder, force=args.force, verbose=True)
+    elif args.to == "parquet":
+        num_files = csv_folder_to_parquet(args.folder, remove_csv=args.remove_csv, verbose=True)
+    else:
+        raise ValueError(f"Invalid format: {args.to}, please choose from 'csv' or 'parquet'.")
+    print(f"Wrote {num_files} files.")
@@ -3,7 +3,7 @@
 
 
 from secgym.utils.utils import LLM_call
-from secgym.database.process_logs import SEPARATOR
+from secgym.database.log_io import read_separated_csv
 from secgym.myconfig import config_list_4o
 import os
 import pandas as pd
@@ -49,7 +49,7 @@ str_matcher = {
 }
 
 def identify_pii(csv_file, save_file):
-    df = pd.read_csv(csv_file, sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
+    df = read_separated_csv(csv_file, on_bad_lines='skip')
 
     if os.path.exists(save_file):
         with open(save_file, "r") as f:
@@ -182,11 +182,11 @@ for k, val in columns.items():
 
 for file_name in os.listdir(folder):
     if file_name.endswith(".csv"):
-        df = pd.read_csv(os.path.join(folder, file_name), sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
+        df = read_separated_csv(os.path.join(folder, file_name), on_bad_lines='skip')
     elif os.path.isdir(os.path.join(folder, file_name)):
         # get the first csv file
         csv_file = os.path.join(folder, file_name, f"{file_name}_0.csv")
-        df = pd.read_csv(csv_file, sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
+        df = read_separated_csv(csv_file, on_bad_lines='skip')
     else:
         continue
 
@@ -1,14 +1,16 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-
+import argparse
 import random
 import uuid
 import re
 import os
 import json
+import time
 import pandas as pd
 from process_logs import SEPARATOR
+from secgym.database.log_io import read_log_table, log_table_columns, LOG_EXTENSIONS
 from secgym.utils.utils import LLM_call
 
 new_pii_prompt = """Given an input string, you will help create a new string that anonymizes the PII data in the input string.
@@ -121,6 +123,100 @@ def extract_email_from_string(input) -> list:
     return re.findall(r'[\w\.-]+@[\w\.-]+', input)
 
 
+# the detectors of `convert_value` in priority order, a value is anonymized by the first one that matches it
+PII_DETECTORS = [
+    ("uuid", extract_uuid_from_string),
+    ("ip", extract_ip_from_string),
+    ("ipv6", extract_ipv6_from_string),
+    ("mac", extract_mac_address_from_string),
+    ("sid", extract_sid_from_string),
+    ("lat_lon", match_latitute_longitude),
+    ("sharepoint", extract_sharepoint_url_account_from_string),
+    ("email", extract_email_from_string),
+]
+
+# same patterns without groups, a value matches one of them iff the detector finds something in it
+PII_PATTERNS = {
+    "uuid": r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}',
+    "ip": r'[0-9]+(?:\.[0-9]+){3}',
+    "ipv6": r'\b(?:[0-9A-Fa-f]{1,4}:){2,7}[0-9A-Fa-f]{1,4}::?(?:[0-9A-Fa-f]{1,4})?\b',
+    "mac": r'(?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}',
+    "sid": r'S-[0-9-]+',
+    "lat_lon": r'"latitude":[-+]?\d*\.?\d+,|"longitude":[-+]?\d*\.?\d+}',
+    "sharepoint": r'sharepoint.com/personal/[^/]+(?:_vnevado_|/)',
+    "email": r'[\w\.-]+@[\w\.-]+',
+}
+# matches the values some detector finds something in
+COMBINED_PII_PATTERN = "|".join(f"(?:{PII_PATTERNS[name]})" for name, _ in PII_DETECTORS)
+ASCII_PATTERN = r'^[\x00-\x7f]*$'
+
+PII_GENERATORS = {
+    "uuid": lambda _: generate_uuid(),
+    "ip": lambda _: generate_ip(),
+    "ipv6": generate_ipv6,
+    "mac": lambda _: generate_mac(),
+    "sid": generate_sid,
+    "lat_lon": anony_lat_lon,
+}
+
+
+def detect_pii(input) -> tuple:
+    """Run the detectors on a value in priority order, returns the first that matches and its matches, (None, []) if none does."""
+    if not isinstance(input, str):
+        input = str(input)
+    for name, extractor in PII_DETECTORS:
+        matches = extractor(input)
+        if len(matches) > 0:
+            return name, matches
+    return None, []
+
+
+def extract_pii(values) -> pd.DataFrame:
+    """Detect the PII of many values at once, with the same result as `detect_pii` on each of them.
+
+    The detectors run over the whole column as Arrow string kernels (RE2) instead of one `re` call per value
+    and detector: `COMBINED_PII_PATTERN` first leaves out the values without PII, then each detector in
+    priority order claims the values it matches among the remaining ones. Only the chosen detector extracts
+    the matches, over all the values it was chosen for. RE2 and `re` only agree on ASCII (e.g. on `\\w`),
+    so the other values go through `detect_pii`, as do all values if pyarrow is not installed.
+
+    Args:
+        values: The values, e.g. the unique values of a column. Missing values are left out, others converted to strings.
+
+    Returns:
+        pd.DataFrame: Indexed by value, the `kind` of PII (categorical of the detector names, missing if none matched) and its `matches`.
+    """
+    names = [name for name, _ in PII_DETECTORS]
+    values = pd.Series(values, dtype=object).dropna().astype(str).drop_duplicates().reset_index(drop=True)
+    kind = pd.Series(None, index=values.index, dtype=object)
+    try:
+        strings = values.astype("string[pyarrow]")
+        pending = strings.str.contains(ASCII_PATTERN, regex=True).to_numpy(dtype=bool)
+    except ImportError:
+        pending = pd.Series(False, index=values.index).to_numpy()
+    for i in values.index[~pending]:
+        kind[i] = detect_pii(values[i])[0]
+
+    if pending.any():
+        pending[pending] = strings[pending].str.contains(COMBINED_PII_PATTERN, regex=True).to_numpy(dtype=bool)
+    for name in names:
+        if not pending.any():
+            break
+        hit = pending.copy()
+        hit[pending] = strings[pending].str.contains(PII_PATTERNS[name], regex=True).to_numpy(dtype=bool)
+        kind[hit] = name
+        pending &= ~hit
+
+    matches = pd.Series([[] for _ in range(len(values))], index=values.index, dtype=object)
+    for name, extractor in PII_DETECTORS:
+        chosen = kind == name
+        if chosen.any():
+            matches[chosen] = values[chosen].map(extractor)
+    return pd.DataFrame(
+        {"kind": pd.Categorical(kind, categories=names), "matches": matches.values}, index=pd.Index(values, name="value")
+    )
+
+
 class PIIAnonymizer:
     def __init__(self, 
                  pii_column_file:str,
@@ -166,47 +262,45 @@ class PIIAnonymizer:
             all_matches.update(set(matches))
         return all_matches  
 
+    def match_field_dicts(self, values, match_fields:list):
+        """Same as `match_field_dict` over many values, with one pattern for all the fields."""
+        # the values of the fields are quoted strings, so the matches of different fields never overlap
+        pattern = '"(?:' + "|".join(re.escape(field) for field in match_fields) + ')":"([^"]+)"'
+        matches = pd.Series(values, dtype=object).astype(str).str.findall(pattern).explode()
+        return set(matches.dropna())
 
-    def match_one_csv(self, csv_file:str):
-        df = pd.read_csv(csv_file, sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
+    def collect_values(self, csv_file:str):
+        """The values of the pii columns of a table file, the values of the pii fields for dict columns."""
+        # only the pii columns are read, column by column for parquet files
+        columns = [col for col in log_table_columns(csv_file) if col in self.pii_columns]
+        df = read_log_table(csv_file, columns=columns)
 
-        original_length = 0
         all_matches = set()
         for col in df.columns:
             if col in self.pii_columns:
                 uniques = df[col].unique()
-                original_length += len(uniques)
                 print(f"Column: {col} Unique values: {len(uniques)}")
                 if self.pii_columns_dict[col]['is_dict']:
-                    pii_fields = self.pii_columns_dict[col]['pii_fields']
-                    for cvalue in uniques:
-                        matched_strs = self.match_field_dict(cvalue, pii_fields)
-                        # print(f"Getting {len(matched_strs)} matches.")
-                        all_matches.update(matched_strs)
+                    all_matches.update(self.match_field_dicts(uniques, self.pii_columns_dict[col]['pii_fields']))
                 else:
                     all_matches.update(set(uniques))
+        return all_matches
 
-        # filter out hashlist
-        filtered_matches = set()
-        for match in all_matches:
-            if match in self.hashlist:
-                self.hash_hit += 1
-            elif any([i in match for i in self.exempt_list]):
-                self.need_manual[match] = "Exempted"
-                continue
+    def match_one_csv(self, csv_file:str):
+        all_matches = self.collect_values(csv_file)
 
-            filtered_matches.add(match)
+        # filter out hashlist, skip nan
+        matches = pd.Series(list(all_matches), dtype=object).dropna().astype(str)
+        in_hashlist = matches.isin(list(self.hashlist.keys()))
+        self.hash_hit += int(in_hashlist.sum())
+        exempted = ~in_hashlist & matches.str.contains("|".join(re.escape(i) for i in self.exempt_list), regex=True)
+        for match in matches[exempted]:
+            self.need_manual[match] = "Exempted"
+        filtered_matches = matches[~exempted]
 
         print(f"Num str for processing: {len(filtered_matches)}")
         print("-" * 20)
-        for m in filtered_matches:
-            # skip nan
-            if pd.isna(m):
-                continue
-            k = self.convert_value(m)
-            if len(k) > 0:
-                # print(k)
-                self.hashlist.update(k)
+        self.convert_values(filtered_matches)
         
         # clean up batch_in
         if len(self.batch_in) > 0:
@@ -247,64 +341,26 @@ class PIIAnonymizer:
         return response_dict
                 
         
-    def convert_value(self, input:str):
-        # match uuid
-        uuids = extract_uuid_from_string(input)
-        if len(uuids) > 0:
-            # print(f"uuids: {uuids}")
-            return { i: generate_uuid() for i in uuids }  
-        # match ip
-        ips = extract_ip_from_string(input)
-        if len(ips) > 0:
-            # print(f"ips: {ips}")
-            return { i: generate_ip() for i in ips }
-        
-        # match ipv6
-        ipv6s = extract_ipv6_from_string(input)
-        if len(ipv6s) > 0:
-            # print(f"ipv6s: {ipv6s}")
-            return { i: generate_ipv6(i) for i in ipv6s }
-        
-        # match mac address
-        macs = extract_mac_address_from_string(input)
-        if len(macs) > 0:
-            if not isinstance(macs[0], str):
-                print(input)
-            # print(f"macs: {macs}")
-            return { i: generate_mac() for i in macs }
-        
-        # match sid
-        sids = extract_sid_from_string(input)
-        if len(sids) > 0:
-            # print(f"sids: {sids}")
-            return { i: generate_sid(i) for i in sids }
-
-        # match lat lon
-        lat_lon = match_latitute_longitude(input)
-        if len(lat_lon) > 0:
-            return { i: anony_lat_lon(i) for i in lat_lon }
-            
-        # match sharepoint url
-        sharepoint_user_name = extract_sharepoint_url_account_from_string(input)
-        if len(sharepoint_user_name) > 0:
+    def _convert_detected(self, input:str, kind, matches:list):
+        if kind in PII_GENERATORS:
+            return { i: PII_GENERATORS[kind](i) for i in matches }
+
+        if kind == "sharepoint":
             # check if in hashlist
-            for s in sharepoint_user_name:
+            for s in matches:
                 if s not in self.hashlist:
                     # add to batch
                     self.batch_in.append(s)
             return {}
-        
-        # match email
-        email = extract_email_from_string(input)
-        if len(email) > 0:
+
+        if kind == "email":
             # extract string before @ and check if that str is in hashlist
-            for e in email:
+            for e in matches:
                 prestr = e.split("@")[0]
                 if prestr not in self.hashlist:
                     # add to batch
                     self.batch_in.append(prestr)
-
-        if not (len(sharepoint_user_name) > 0 or len(email) > 0):
+        else:
             self.batch_in.append(input)
 
         if len(self.batch_in) < 10:
@@ -312,12 +368,74 @@ class PIIAnonymizer:
 
         return self._llm_gen() # call LLM to generate
 
+    def convert_value(self, input:str):
+        kind, matches = detect_pii(input)
+        return self._convert_detected(input, kind, matches)
+
+    def convert_values(self, values):
+        """Convert many values at once with `extract_pii`, adding the new strings to the hashlist as they are generated.
+
+        Missing values are skipped. Returns the new strings.
+        """
+        new_hashes = {}
+        detected = extract_pii(values)
+        for value, kind, matches in zip(detected.index, detected["kind"], detected["matches"]):
+            k = self._convert_detected(value, None if pd.isna(kind) else kind, matches)
+            if len(k) > 0:
+                self.hashlist.update(k)
+                new_hashes.update(k)
+        return new_hashes
+
+
+def benchmark_extraction(folder:str, pii_column_file:str, num_tables:int=3):
+    """Time `detect_pii` value by value against `extract_pii` on the pii values of the largest tables of a folder.
+
+    Returns:
+        dict: For each table, the number of values and the seconds of both.
+    """
+    # nothing is written, the hashlist is only read if it exists
+    anonymizer = PIIAnonymizer(pii_column_file=pii_column_file, hashlist_file="pii/hashlist.json", config_list=None)
+    table_files = []
+    for root, _, files in os.walk(folder):
+        table_files.extend(os.path.join(root, f) for f in files if f.endswith(LOG_EXTENSIONS))
+    table_files = sorted(table_files, key=os.path.getsize, reverse=True)[:num_tables]
+
+    results = {}
+    for table_file in table_files:
+        values = [v for v in anonymizer.collect_values(table_file) if not pd.isna(v)]
+        start_time = time.time()
+        sequential = [detect_pii(v) for v in values]
+        sequential_time = time.time() - start_time
+        start_time = time.time()
+        detected = extract_pii(values)
+        vectorized_time = time.time() - start_time
+
+        kinds = detected["kind"].astype(object).where(detected["kind"].notna(), None)
+        same = all(
+            kinds[str(v)] == kind and detected["matches"][str(v)] == matches for v, (kind, matches) in zip(values, sequential)
+        )
+        results[table_file] = {"values": len(values), "sequential": sequential_time, "vectorized": vectorized_time}
+        print(
+            f"{table_file}: {len(values)} values, sequential {sequential_time:.2f} seconds, "
+            f"vectorized {vectorized_time:.2f} seconds ({sequential_time / max(vectorized_time, 1e-9):.1f}x), same results: {same}"
+        )
+    return results
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the hashlist of the PII values of the log tables.")
+    parser.add_argument("--benchmark", type=str, default=None, help="Only benchmark the PII extraction on the largest tables of this folder.")
+    parser.add_argument("--pii_column_file", type=str, default="pii/final_filter.json", help="PII columns of the tables.")
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark_extraction(args.benchmark, args.pii_column_file)
+        exit()
+
     from secgym.myconfig import config_list_4o
 
     anoynimizer = PIIAnonymizer(
-        pii_column_file="pii/final_filter.json",
+        pii_column_file=args.pii_column_file,
         hashlist_file="pii/hashlist.json",
         config_list=config_list_4o
     )
@@ -339,11 +457,11 @@ if __name__ == "__main__":
     for folder in folders:
         for file_name in os.listdir(folder):
             print("Processing: ", file_name)
-            if file_name.endswith(".csv"):
+            if file_name.endswith(LOG_EXTENSIONS):
                 csv_files = [os.path.join(folder, file_name)]
             elif os.path.isdir(os.path.join(folder, file_name)):
                 for f in os.listdir(os.path.join(folder, file_name)):
-                    if f.endswith(".csv"):
+                    if f.endswith(LOG_EXTENSIONS):
                         csv_files.append(os.path.join(folder, file_name, f))
 
             else:
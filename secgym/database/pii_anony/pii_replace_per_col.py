@@ -9,6 +9,8 @@ import time
 import random
 import uuid
 
+from secgym.database.log_io import read_log_table, write_log_table, read_type_map, is_parquet_file, LOG_EXTENSIONS
+
 
 SEPARATOR = "❖"
 
@@ -117,7 +119,7 @@ def replace_keys_in_file_pandas(input_folder, output_folder, replace_dict, pii_c
             replace_keys_in_file_pandas(os.path.join(input_folder, filename), os.path.join(output_folder, filename), replace_dict, pii_columns)
             continue
 
-        if filename.endswith('.csv'):
+        if filename.endswith(LOG_EXTENSIONS):
             replace_pii_one_csv(filename, output_folder, input_folder, replace_dict, pii_columns)
 
 
@@ -134,8 +136,9 @@ def replace_pii_one_csv(filename:str, output_folder:str, input_folder, replace_d
     print(f"Processing {filename}...")
     start_time = time.time()
 
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_file_path, sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
+    # Read the CSV or parquet file into a DataFrame
+    df = read_log_table(input_file_path)
+    type_map = read_type_map(input_file_path) if is_parquet_file(input_file_path) else None
 
     # Iterate over each column and classify unique values
     for column in df.columns:
@@ -217,7 +220,7 @@ def replace_pii_one_csv(filename:str, output_folder:str, input_folder, replace_d
             print(f"> Skip {column}:", ", ".join(sample_list[:5]))
 
     # Save the modified DataFrame to the output folder
-    df.to_csv(output_file_path, sep=SEPARATOR, index=False, encoding='utf-8')
+    write_log_table(df, output_file_path, type_map)
     print()
     print(f"Processed and saved {filename} to {output_folder} in {time.time() - start_time:.2f} seconds")
     print("-" * 50) 
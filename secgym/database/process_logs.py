@@ -2,9 +2,16 @@
 # Licensed under the MIT License.
 
 import os
+import csv
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 
+# some dynamic columns hold values larger than the default limit of the csv module
+csv.field_size_limit(2**31 - 1)
+IO_BUFFER_SIZE = 1 << 20
+
 
 def process_csv(csv_folder):
     """Create a single .sql file from a folder of CSV and .meta files.
@@ -26,29 +33,149 @@ def process_csv(csv_folder):
             # process with pandas
             # for column that is dynamic, check if empty and convert to {}, and save to the origninal file
             csv_file_path = os.path.join(csv_folder, f"{table_name}.csv")
-            with open(csv_file_path, 'r') as csv_file:
-                df = pd.read_csv(csv_file, sep=SEPARATOR, encoding='utf-8', on_bad_lines='skip', engine='python')
-                for column in df.columns:
-
-                    if column in json_columns:
-                        print("Processing column:", column)
-                        # convert empty string or None to {}
-                        df[column] = df[column].apply(lambda x: "{}" if x == "" else x)
-                        df[column] = df[column].apply(lambda x: "{}" if pd.isnull(x) else x)
-                        print(df[column].head())
-                # df.to_csv(csv_file_path, index=False)
-                df.to_csv(csv_file_path, index=False, sep=SEPARATOR, quotechar='"', encoding='utf-8')
+            # log_io imports this module for SEPARATOR
+            from secgym.database.log_io import read_separated_csv
+            df = read_separated_csv(csv_file_path, on_bad_lines='skip')
+            for column in df.columns:
+
+                if column in json_columns:
+                    print("Processing column:", column)
+                    # convert empty string or None to {}
+                    df[column] = df[column].apply(lambda x: "{}" if x == "" else x)
+                    df[column] = df[column].apply(lambda x: "{}" if pd.isnull(x) else x)
+                    print(df[column].head())
+            # df.to_csv(csv_file_path, index=False)
+            df.to_csv(csv_file_path, index=False, sep=SEPARATOR, quotechar='"', encoding='utf-8')
 
             break
 
+def _replace_double_quotes(row):
+    return [value.replace('"', "'") for value in row]
+
+
+def rewrite_csv(
+        input_file,
+        output_file,
+        separator,
+        quotechar,
+        new_separator=None,
+        new_quotechar=None,
+        transform=None,
+        output_encoding='utf-8-sig',
+    ):
+    """Stream a CSV file into another one row by row, so that memory stays bounded whatever the file size.
+
+    The output is written to a temporary file next to `output_file` and moved in place once complete,
+    so `output_file` may be `input_file`. Values are copied as strings, rows with more fields than the
+    header are skipped and shorter rows are padded, like `pd.read_csv(..., on_bad_lines='skip')`.
+
+    Args:
+        input_file (str): Path to the input CSV file.
+        output_file (str): Path to the output CSV file.
+        separator (str): Separator of the input file, a single character.
+        quotechar (str): Quote character of the input file.
+        new_separator (str): Separator of the output file, same as the input if None.
+        new_quotechar (str): Quote character of the output file, same as the input if None.
+        transform (callable): Applied to each data row (list of str), must be picklable to be used in a process pool.
+        output_encoding (str): Encoding of the output file.
+
+    Returns:
+        dict: rows, skipped rows, bytes read and seconds, or None if the header has a single column (wrong separator).
+    """
+    start_time = time.time()
+    new_separator = separator if new_separator is None else new_separator
+    new_quotechar = quotechar if new_quotechar is None else new_quotechar
+    tmp_file = output_file + ".tmp"
+    num_bytes = os.path.getsize(input_file)
+    num_rows = 0
+    num_skipped = 0
+    try:
+        with open(input_file, 'r', encoding='utf-8-sig', newline='', buffering=IO_BUFFER_SIZE) as fin:
+            reader = csv.reader(fin, delimiter=separator, quotechar=quotechar)
+            header = next(reader, [])
+            if len(header) <= 1:
+                return None
+            with open(tmp_file, 'w', encoding=output_encoding, newline='', buffering=IO_BUFFER_SIZE) as fout:
+                writer = csv.writer(fout, delimiter=new_separator, quotechar=new_quotechar, lineterminator='\n')
+                writer.writerow(header)
+                width = len(header)
+                for row in reader:
+                    if len(row) == 0:
+                        continue
+                    if len(row) > width:
+                        num_skipped += 1
+                        continue
+                    if len(row) < width:
+                        row = row + [""] * (width - len(row))
+                    if transform is not None:
+                        row = transform(row)
+                    writer.writerow(row)
+                    num_rows += 1
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return {
+        "rows": num_rows,
+        "skipped": num_skipped,
+        "bytes": num_bytes,
+        "seconds": time.time() - start_time,
+    }
+
+
+def rewrite_csv_files(jobs, num_workers=None):
+    """Run `rewrite_csv` jobs in a process pool and report the throughput.
+
+    Args:
+        jobs (list): List of (input_file, output_file, kwargs) tuples.
+        num_workers (int): Number of processes, all cores if None. With 1, the jobs run in this process.
+
+    Returns:
+        dict: For each input file, the stats returned by `rewrite_csv`.
+    """
+    start_time = time.time()
+    results = {}
+
+    def report(input_file, stats):
+        results[input_file] = stats
+        if stats is None:
+            print("Error loading for file: ", input_file)
+            return
+        seconds = max(stats["seconds"], 1e-9)
+        skipped = f", skipped {stats['skipped']} bad lines" if stats["skipped"] > 0 else ""
+        print(
+            f"Processed {input_file}: {stats['rows']} rows, {stats['bytes'] / 1e6:.1f} MB in {seconds:.1f} seconds "
+            f"({stats['bytes'] / 1e6 / seconds:.1f} MB/s){skipped}"
+        )
+
+    # largest files first, so that a big file does not start last
+    jobs = sorted(jobs, key=lambda job: -os.path.getsize(job[0]))
+    if num_workers == 1:
+        for input_file, output_file, kwargs in jobs:
+            report(input_file, rewrite_csv(input_file, output_file, **kwargs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(rewrite_csv, input_file, output_file, **kwargs): input_file for input_file, output_file, kwargs in jobs}
+            for future in as_completed(futures):
+                report(futures[future], future.result())
+
+    total_bytes = sum(stats["bytes"] for stats in results.values() if stats is not None)
+    total_time = max(time.time() - start_time, 1e-9)
+    print(f"Processed {len(results)} files, {total_bytes / 1e6:.1f} MB in {total_time:.1f} seconds ({total_bytes / 1e6 / total_time:.1f} MB/s)")
+    return results
+
+
 def change_separator_in_csv_folder(
         csv_folder, 
         separator,
         quotechar,
         new_separator=None,
         new_quotechar=None,
+        num_workers=None,
     ):
     """Switch separator from ¤ to another
+
+    The files are streamed (see `rewrite_csv`) in a process pool of `num_workers` processes.
     """
     if new_separator is None and new_quotechar is None:
         raise ValueError("Either new_separator or new_quotechar must be provided")
@@ -60,48 +187,37 @@ def change_separator_in_csv_folder(
         new_quotechar = quotechar
         print("new_quotechar is None, using quotechar as new_quotechar")
 
+    csv_files = []
     for file_name in os.listdir(csv_folder):
-        table_name = file_name.split(".")[0]
         if file_name.endswith(".csv"):
-            df = pd.read_csv(os.path.join(csv_folder, f"{table_name}.csv"), sep=separator, quotechar=quotechar, encoding='utf-8-sig', on_bad_lines='skip', engine='python')
-            if len(df.columns) == 1:
-                print("Error loading for file: ", table_name)
-            else:
-                df.to_csv(os.path.join(csv_folder, f"{table_name}.csv"), sep=new_separator, quotechar=new_quotechar, index=False, encoding='utf-8-sig')
-                print(f"Processed {table_name}.csv")
-
+            csv_files.append(file_name)
         elif os.path.isdir(os.path.join(csv_folder, file_name)):
-            table_name = file_name
             # get all the csv files
-            csv_files = [f"{file_name}/{f}" for f in os.listdir(os.path.join(csv_folder, file_name)) if f.endswith(".csv")]
+            csv_files.extend([f"{file_name}/{f}" for f in os.listdir(os.path.join(csv_folder, file_name)) if f.endswith(".csv")])
 
-            for csv_file in csv_files:
-                df = pd.read_csv(os.path.join(csv_folder, csv_file), sep=separator, quotechar=quotechar, encoding='utf-8-sig', on_bad_lines='skip', engine='python')
-                if len(df.columns) == 1:
-                    print("Error loadingfor file: ", csv_file)
-                else:
-                    df.to_csv(os.path.join(csv_folder, csv_file), sep=new_separator, quotechar=new_quotechar, index=False, encoding='utf-8-sig')
-                    print(f"Processed {csv_file} ")
+    kwargs = {"separator": separator, "quotechar": quotechar, "new_separator": new_separator, "new_quotechar": new_quotechar}
+    jobs = [(os.path.join(csv_folder, f), os.path.join(csv_folder, f), kwargs) for f in csv_files]
+    return rewrite_csv_files(jobs, num_workers=num_workers)
 
-    
 
 def convert_double_quotes(input_file, output_file):
-    df = pd.read_csv(input_file, sep="❖", encoding='utf-8', on_bad_lines='skip', engine='python')
-    df.replace('"', "'", regex=True, inplace=True)
-    df.to_csv(output_file, sep="❖", encoding='utf-8', index=False)
+    """Replace double quotes in the values with single quotes, streaming the file."""
+    return rewrite_csv(input_file, output_file, SEPARATOR, QUOTECHAR, transform=_replace_double_quotes, output_encoding='utf-8')
 
 
-def convert_double_quotes_for_one_folder(folder):
-    for root, dirs, files in os.walk(folder):
-        for file in files:
-            # end in csv
+def convert_double_quotes_for_files(files, num_workers=None):
+    kwargs = {"separator": SEPARATOR, "quotechar": QUOTECHAR, "transform": _replace_double_quotes, "output_encoding": 'utf-8'}
+    return rewrite_csv_files([(f, f, kwargs) for f in files], num_workers=num_workers)
 
-            if not file.endswith(".csv"):
-                continue
-            print(file)
-            input_file = os.path.join(root, file)
-            convert_double_quotes(input_file, input_file)
-    
+
+def convert_double_quotes_for_one_folder(folder, num_workers=None):
+    files = []
+    for root, dirs, files_in_dir in os.walk(folder):
+        for file in files_in_dir:
+            # end in csv
+            if file.endswith(".csv"):
+                files.append(os.path.join(root, file))
+    return convert_double_quotes_for_files(files, num_workers=num_workers)
 
 
 SEPARATOR = "❖"
@@ -117,5 +233,4 @@ if __name__ == "__main__":
         "./data/alphineskihouse/DeviceFileEvents/DeviceFileEvents_2.csv"
     ]
 
-    for file in need_conversion:
-        convert_double_quotes(file, file)
\ No newline at end of file
+    convert_double_quotes_for_files(need_conversion)
\ No newline at end of file
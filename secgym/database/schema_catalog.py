@@ -0,0 +1,159 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import os
+import sys
+from typing import Dict, List, Union
+
+from secgym.database.process_logs import SEPARATOR, QUOTECHAR
+from secgym.database.setup_database import get_table_files, get_skip_tables, to_abs_path
+
+csv.field_size_limit(sys.maxsize)
+
+_HASH_SPACE = 1 << 64
+
+
+class DistinctCounter:
+    """K-minimum-values estimate of the number of distinct values, exact below `k` distinct values."""
+
+    def __init__(self, k: int = 1024):
+        self.k = k
+        self._heap = []  # negated hashes of the k smallest hashes seen
+        self._members = set()
+
+    def add(self, value: str) -> None:
+        # not `hash`, which is salted per process: the same data must give the same catalog on every build
+        h = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        if h in self._members:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -h)
+            self._members.add(h)
+        elif h < -self._heap[0]:
+            self._members.discard(-heapq.heappushpop(self._heap, -h))
+            self._members.add(h)
+
+    def estimate(self) -> int:
+        if len(self._heap) < self.k:
+            return len(self._heap)
+        return int((self.k - 1) * _HASH_SPACE / -self._heap[0])
+
+
+def _column_stats(csv_paths: List[str], columns: List[str], num_samples: int, max_sample_len: int):
+    num_rows = 0
+    empty_counts = [0] * len(columns)
+    counters = [DistinctCounter() for _ in columns]
+    samples = [[] for _ in columns]
+    for csv_path in csv_paths:
+        with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f, delimiter=SEPARATOR, quotechar=QUOTECHAR)
+            next(reader, None)  # header
+            for row in reader:
+                if len(row) != len(columns):
+                    continue
+                num_rows += 1
+                for i, value in enumerate(row):
+                    if value == "":
+                        empty_counts[i] += 1
+                        continue
+                    counters[i].add(value)
+                    if len(samples[i]) < num_samples and value[:max_sample_len] not in samples[i]:
+                        samples[i].append(value[:max_sample_len])
+    return num_rows, empty_counts, counters, samples
+
+
+def build_schema_catalog(
+        csv_folder,
+        catalog_path,
+        skip_tables=["SecurityAlert", "SecurityIncident"],
+        num_samples=3,
+        max_sample_len=100,
+        verbose=False
+        ):
+    """Precompute table and column metadata for a database, served by `ExcytinEnv.get_schema`.
+
+    For each table: the row count, and for each column its type from the .meta file, the number of empty
+    values, an estimate of the number of distinct values and a few sample values.
+
+    Args:
+        csv_folder (str): Path to the folder containing the CSV and .meta files.
+        catalog_path (str): Path to the output JSON file.
+        skip_tables (list): List of table names to skip, same as the database.
+        num_samples (int): Number of distinct sample values kept per column.
+        max_sample_len (int): Sample values are cut to this many characters.
+    """
+    catalog = {"tables": {}}
+    for table_name, type_map, csv_files in get_table_files(csv_folder, skip_tables, verbose=verbose):
+        columns = list(type_map.keys())
+        num_rows, empty_counts, counters, samples = _column_stats(
+            [os.path.join(csv_folder, f) for f in csv_files], columns, num_samples, max_sample_len
+        )
+        catalog["tables"][table_name] = {
+            "row_count": num_rows,
+            "columns": [
+                {
+                    "name": col,
+                    "type": type_map[col],
+                    "empty_count": empty_counts[i],
+                    "distinct_estimate": counters[i].estimate(),
+                    "samples": samples[i],
+                }
+                for i, col in enumerate(columns)
+            ],
+        }
+        if verbose:
+            print(f"Catalog {table_name}: {num_rows} rows, {len(columns)} columns")
+
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+    with open(catalog_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=2)
+    return catalog
+
+
+def load_schema_catalog(catalog_path: str) -> Union[Dict, None]:
+    """Load a catalog built by `build_schema_catalog`, None if it does not exist."""
+    if not os.path.exists(catalog_path):
+        return None
+    with open(catalog_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_schema(catalog: Dict, table_name: Union[str, None] = None) -> str:
+    """Describe the tables of a catalog, or the columns of one table, as text for an agent."""
+    tables = catalog["tables"]
+    if table_name is None:
+        lines = [f"{len(tables)} tables:"]
+        for name, table in sorted(tables.items()):
+            columns = ", ".join(c["name"] for c in table["columns"])
+            lines.append(f"{name} ({table['row_count']} rows): {columns}")
+        return "\n".join(lines)
+
+    matches = [name for name in tables if name.lower() == table_name.lower()]
+    if len(matches) == 0:
+        raise ValueError(f"Table {table_name} not found, available tables: {', '.join(sorted(tables))}")
+    table = tables[matches[0]]
+    lines = [f"{matches[0]} ({table['row_count']} rows)", "column | type | distinct | empty | samples"]
+    for c in table["columns"]:
+        lines.append(
+            f"{c['name']} | {c['type']} | ~{c['distinct_estimate']} | {c['empty_count']} | {json.dumps(c['samples'])}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the schema catalog of a database from CSV files')
+    parser.add_argument('--csv', type=str, help='Folder containing the CSV files')
+    parser.add_argument('--container_name', type=str, help='Name of the database container, used to name the catalog')
+    parser.add_argument('--layer', type=str, default="alert", help='Layer to use for the agent')
+    args = parser.parse_args()
+
+    csv_folder = to_abs_path(args.csv)
+    container_name = args.container_name + ("_alert_only" if args.layer == "alert_only" else "")
+    catalog_path = to_abs_path(f"catalogs/{container_name}.json")
+    build_schema_catalog(csv_folder, catalog_path, skip_tables=get_skip_tables(args.layer, csv_folder), verbose=True)
+    print(f"Schema catalog created: {catalog_path}")
@@ -6,13 +6,13 @@ from mysql.connector import Error
 import time
 import os
 import json
-import docker
-from docker.errors import ContainerError, ImageNotFound, APIError, NotFound
+import uuid
 import pandas as pd
 # from secgym.utils import find_most_similar
 import argparse
 
 from secgym.database.process_logs import SEPARATOR, QUOTECHAR
+from secgym.database.container_manager import wait_until_ready
 
 def to_abs_path(path):
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
@@ -40,6 +40,9 @@ def create_container(
     container_name="mysql-container",
     respawn=False
 ):
+    import docker
+    from docker.errors import ContainerError, ImageNotFound, NotFound
+
     client = docker.from_env()
     if respawn:
         # delete the existing container if it exists
@@ -62,6 +65,7 @@ def create_container(
         else:
             container.start()
             print(f"Restarted stopped container with ID: {container.id}")
+            wait_until_ready(port, container=container)
             return container, port
     except NotFound:
         print(f"Container {container_name} does not exist. Creating a new container...")
@@ -93,27 +97,14 @@ def create_container(
             print(f"Started container {container_name} with ID: {container.id} on port {port}")
             container.reload()
 
-            # check log to see "ready for connections"
+            # wait until the init file is loaded and the server accepts connections
             print("Waiting for the container to start...")
-
-            time_limit = 600
-            time_step = 2
-            while time_limit > 0:
-                container.reload()
-                if container.status == "exited":
-                    print(f"Container {container_name} has exited due to an error.")
-                    break
-                logs = container.logs().decode('utf-8')
-                if "MySQL init process done. Ready for start up" in logs:
-                    print(f"Container {container_name} is ready.")
-                    break
-
-                time.sleep(time_step)
-                time_limit -= time_step
-            
-            time.sleep(4)  # Wait for the container to be ready
-            # if time_limit == 0:
-            #     raise Exception(f"Container {container_name} did not start within the time limit.")
+            try:
+                seconds = wait_until_ready(port, container=container)
+                print(f"Container {container_name} is ready ({seconds:.1f} seconds).")
+            except (RuntimeError, TimeoutError) as e:
+                print(f"Error: {e}")
+            container.reload()
 
             return container, port
         except (ContainerError, ImageNotFound) as e:
@@ -125,7 +116,10 @@ def create_sql_file_from_csv_folder(
         sql_file_path, 
         database_name,
         skip_tables=["SecurityAlert", "SecurityIncident"],
-        verbose=False
+        verbose=False,
+        typed_columns=False,
+        index_plan=None,
+        load_data=True
         ):
     """Create a single .sql file from a folder of CSV and .meta files.
 
@@ -134,6 +128,10 @@ def create_sql_file_from_csv_folder(
         sql_file_path (str): Path to the output SQL file.
         database_name (str): Name of the database to create.
         skip_tables (list): List of table names to skip.
+        typed_columns (bool): Use DATETIME(6), BIGINT and JSON columns for datetime, long and dynamic types instead of TEXT.
+        index_plan (dict): Indexes created after loading each table, see `index_planner.plan_indexes`.
+        load_data (bool): Whether to load the data in the .sql file, if False only the tables are created
+            and the data is loaded afterwards with `bulk_loader.bulk_load`.
     """
     sql_statements = [
         "CREATE USER 'admin'@'%' IDENTIFIED BY 'admin';",
@@ -142,6 +140,43 @@ def create_sql_file_from_csv_folder(
         f"CREATE DATABASE IF NOT EXISTS {database_name};",
         f"USE {database_name};"
     ]
+    for table_name, type_map, csv_files in get_table_files(csv_folder, skip_tables, verbose=verbose):
+        json_columns = [col for col, dtype in type_map.items() if dtype == "dynamic"]
+
+        # Generate CREATE TABLE statement
+        create_table_sql = generate_create_table_sql(table_name, type_map, typed=typed_columns)
+        sql_statements.append(create_table_sql)
+        if not load_data:
+            continue
+
+        # Generate LOAD DATA INFILE statement
+        for csv_file in csv_files:
+            if typed_columns:
+                load_data_sql = generate_typed_load_data_sql(csv_file, table_name, type_map)
+            else:
+                load_data_sql = generate_load_data_sql(csv_file, table_name, type_map.keys(), json_columns)
+            sql_statements.append(load_data_sql)
+
+        # indexes are built once the table is loaded, which is faster than maintaining them row by row
+        if index_plan is not None:
+            from secgym.database.index_planner import generate_create_index_sql
+            for columns in index_plan.get(table_name, []):
+                sql_statements.append(generate_create_index_sql(table_name, columns, type_map, typed=typed_columns))
+
+    # Write all SQL statements to the output file
+    with open(sql_file_path, 'w', encoding='utf-8') as sql_file:
+        sql_file.write("\n\n".join(sql_statements))
+
+def get_table_files(csv_folder, skip_tables=[], verbose=False):
+    """List the tables in a folder of CSV and .meta files.
+
+    A table is either a `<table>.csv` file with a `<table>.meta` file, or a `<table>` folder
+    with `<table>_i.csv` chunks and a `<table>_0.meta` file.
+
+    Returns:
+        list: (table_name, type_map, csv_files) for each table, csv_files relative to `csv_folder`.
+    """
+    tables = []
     for file_name in os.listdir(csv_folder):
 
         #skipping apple metadata stuff
@@ -161,59 +196,51 @@ def create_sql_file_from_csv_folder(
                     type_map = json.load(meta_file)
             else:
                 print(f"Meta file not found for {table_name}. Inferring types from the CSV file...")
-                df = pd.read_csv(os.path.join(csv_folder, f"{table_name}.csv"), sep=SEPARATOR, encoding='utf-8-sig', on_bad_lines='skip', engine='python')
+                from secgym.database.log_io import read_separated_csv
+                # only the header is needed
+                df = read_separated_csv(os.path.join(csv_folder, f"{table_name}.csv"), nrows=0)
                 type_map = {str(col): "string" for col in df.columns}
                 # print(type_map)
 
-            json_columns = [col for col, dtype in type_map.items() if dtype == "dynamic"]
-
-            # Generate CREATE TABLE statement
-            create_table_sql = generate_create_table_sql(table_name, type_map)
-            sql_statements.append(create_table_sql)
-
-            # Generate LOAD DATA INFILE statement
-            load_data_sql = generate_load_data_sql(file_name, table_name, type_map.keys(), json_columns)
-            sql_statements.append(load_data_sql)
+            tables.append((table_name, type_map, [file_name]))
         elif os.path.isdir(os.path.join(csv_folder, file_name)):
             # a folder of CSV files. file_name is the table name: SecurityAlert
             # In the folder, there are SecurityAlert_i.csv starting from 1 and a SecurityAlert.meta file
-            # add the corresponding SQL statements: creating one table and loading all the data
-
             table_name = file_name
             with open(os.path.join(csv_folder, f"{file_name}/{file_name}_0.meta"), 'r') as meta_file:
                 type_map = json.load(meta_file)
-            json_columns = [col for col, dtype in type_map.items() if dtype == "dynamic"]
 
             # get all the csv files
             csv_files = [f"{file_name}/{f}" for f in os.listdir(os.path.join(csv_folder, file_name)) if f.endswith(".csv")]
+            tables.append((table_name, type_map, csv_files))
+    return tables
 
-            # Generate CREATE TABLE statement
-            create_table_sql = generate_create_table_sql(table_name, type_map)
-            sql_statements.append(create_table_sql)
+def dtype_to_sql(dtype, typed=False):
+    """Convert a custom dtype to a SQL data type.
 
-            # Generate LOAD DATA INFILE statement
-            for i, csv_file in enumerate(csv_files):
-                load_data_sql = generate_load_data_sql(csv_file, table_name, type_map.keys(), json_columns)
-                sql_statements.append(load_data_sql)
-           
-    # Write all SQL statements to the output file
-    with open(sql_file_path, 'w', encoding='utf-8') as sql_file:
-        sql_file.write("\n\n".join(sql_statements))
-
-def dtype_to_sql(dtype):
-    """Convert a custom dtype to a SQL data type."""
-    mapping = {
-        "string": "TEXT",
-        "long": "TEXT", # BIGINT
-        "datetime": "TEXT",
-        "bool": "TEXT", # BOOLEAN
-        "dynamic": "TEXT" # JSON
-    }
+    Everything is TEXT unless `typed`, in which case datetime, long and dynamic columns get their own types.
+    """
+    if typed:
+        mapping = {
+            "string": "TEXT",
+            "long": "BIGINT",
+            "datetime": "DATETIME(6)",
+            "bool": "TEXT", # "True"/"False" strings, queries compare with these
+            "dynamic": "JSON"
+        }
+    else:
+        mapping = {
+            "string": "TEXT",
+            "long": "TEXT", # BIGINT
+            "datetime": "TEXT",
+            "bool": "TEXT", # BOOLEAN
+            "dynamic": "TEXT" # JSON
+        }
     return mapping.get(dtype, "TEXT")
 
-def generate_create_table_sql(table_name, type_map):
+def generate_create_table_sql(table_name, type_map, typed=False):
     """Generate a CREATE TABLE SQL statement."""
-    column_defs = [f"{col} {dtype_to_sql(dtype)}" for col, dtype in type_map.items()]
+    column_defs = [f"{col} {dtype_to_sql(dtype, typed=typed)}" for col, dtype in type_map.items()]
     columns_sql = ",\n    ".join(column_defs)
     sql = f"CREATE TABLE {table_name} (\n    {columns_sql}\n);"
     if table_name == "Usage":
@@ -221,7 +248,11 @@ def generate_create_table_sql(table_name, type_map):
     return sql
 
 def generate_load_data_sql(file_name, table_name, columns, json_columns):
-    """Generate LOAD DATA INFILE SQL statement."""
+    """Generate LOAD DATA INFILE SQL statement.
+
+    The fields are loaded as they are into TEXT columns, see `generate_typed_load_data_sql` for the load
+    converting them to the column types.
+    """
     separator = SEPARATOR
     quotechar = QUOTECHAR
     load_data_sql = f"""
@@ -233,18 +264,164 @@ LINES TERMINATED BY '\\n'
 IGNORE 1 ROWS;
 """
     load_data_sql = load_data_sql.replace("INTO TABLE Usage", "INTO TABLE `Usage`")
-    set_statements = []
-    for column in columns:
-        if column in json_columns:
-            # convert to {} if the column is empty
-            set_statements.append(f"CASE WHEN @{column} = '' THEN '{{}}' ELSE @{column} END,")
-        else:
-            set_statements.append(f"{column} = NULLIF(@{column}, '')")
-
-    tmp_set = ','.join(set_statements)
-    # load_data_sql += f"""SET {tmp_set};"""
     return load_data_sql
 
+# formats of the exported timestamps once normalized, e.g. 2024-06-20 10:21:33.123456+00:00 or 2024-06-20T10:21:33Z
+DATETIME_FORMAT = "%Y-%m-%d %H:%i:%s"
+DATETIME_FRACTION_FORMAT = "%Y-%m-%d %H:%i:%s.%f"
+
+def sql_value_expression(variable, dtype):
+    """The expression converting a raw CSV field (a user variable) to the value stored in a typed column.
+
+    Empty fields become NULL, except for dynamic columns where they become {} like in the source logs.
+    """
+    if dtype == "datetime":
+        # all times are UTC, drop the T, the offset and the Z before parsing
+        normalized = f"NULLIF(TRIM(TRAILING 'Z' FROM SUBSTRING_INDEX(REPLACE({variable}, 'T', ' '), '+', 1)), '')"
+        return (
+            f"STR_TO_DATE({normalized}, "
+            f"IF(LOCATE('.', {variable}) > 0, '{DATETIME_FRACTION_FORMAT}', '{DATETIME_FORMAT}'))"
+        )
+    if dtype == "long":
+        return f"CAST(NULLIF({variable}, '') AS SIGNED)"
+    if dtype == "dynamic":
+        # a value that is not valid JSON is kept as a JSON string instead of failing the row
+        return f"IF({variable} = '', '{{}}', IF(JSON_VALID({variable}), {variable}, JSON_QUOTE({variable})))"
+    return f"NULLIF({variable}, '')"
+
+def generate_typed_load_data_sql(file_name, table_name, type_map):
+    """Generate a LOAD DATA INFILE SQL statement converting each field to its column type.
+
+    Fields are read into user variables and converted in the SET clause. With IGNORE, a value that
+    does not convert becomes NULL with a warning instead of aborting the load.
+    """
+    variables = ", ".join(f"@v{i}" for i in range(len(type_map)))
+    set_statements = ",\n    ".join(
+        f"`{column}` = {sql_value_expression(f'@v{i}', dtype)}" for i, (column, dtype) in enumerate(type_map.items())
+    )
+    return f"""
+LOAD DATA INFILE '/var/lib/mysql-files/{file_name}'
+IGNORE INTO TABLE `{table_name}`
+FIELDS TERMINATED BY '{SEPARATOR}'
+ENCLOSED BY '{QUOTECHAR}'
+LINES TERMINATED BY '\\n'
+IGNORE 1 ROWS
+({variables})
+SET
+    {set_statements};
+"""
+
+def get_skip_tables(layer, csv_folder):
+    """Get the tables to leave out of the database for a layer."""
+    # - Log level: minimum info, everything should be excluded
+    if layer == "log":
+        skip_tables = ["AzureDiagnostics", "LAQueryLogs", "SecurityIncident", "SecurityAlert", "AlertEvidence", "AlertInfo"]
+    # - Incident level: Have access to security incidents, but not the alerts
+    elif layer == "incident":
+        skip_tables = ["AzureDiagnostics", "LAQueryLogs", "SecurityAlert", "AlertEvidence", "AlertInfo"]
+    elif layer == "alert":
+        # - Alert level: Have access to all:
+        skip_tables = ["AzureDiagnostics", "LAQueryLogs"]
+    elif layer == "alert_only":
+        skip_tables = []
+        for fname in os.listdir(csv_folder):
+            if fname.endswith(".meta") or fname.endswith(".parquet") or fname.startswith("._") or fname.startswith(".DS_Store"):
+                continue
+            if fname.endswith(".csv"):
+                skip_tables.append(fname.replace(".csv", ""))
+            elif os.path.isdir(os.path.join(csv_folder, fname)):
+                skip_tables.append(fname)
+            else:
+                raise ValueError(f"Invalid file type: {fname}")
+
+            # remove SecurityIncident", "SecurityAlert", "AlertEvidence", "AlertInfo" from the list
+        skip_tables.remove("SecurityIncident")
+        skip_tables.remove("SecurityAlert")
+        skip_tables.remove("AlertEvidence")
+        skip_tables.remove("AlertInfo")
+    else:
+        raise ValueError(f"Invalid layer: {layer}")
+    return skip_tables
+
+def layer_database_name(database_name, layer):
+    """Name of the database a layer is served from, with `--layer_views` the alert layer uses the tables directly."""
+    return database_name if layer == "alert" else f"{database_name}_{layer}"
+
+def layer_user(layer):
+    """MySQL user that can only read the views of a layer."""
+    return f"{layer}_agent"
+
+def generate_layer_views_sql(database_name, table_names, layer, skip_tables):
+    """Generate the statements serving a layer from the tables of another database.
+
+    The layer gets its own database with a `SELECT *` view for each table it can see, and a user that can
+    only read these views, so one copy of the data (and one buffer pool) serves every layer.
+
+    Args:
+        database_name (str): Name of the database holding the tables.
+        table_names (list): The tables in that database.
+        layer (str): The layer, "log" or "alert_only".
+        skip_tables (list): The tables the layer cannot see, see `get_skip_tables`.
+    """
+    view_database = layer_database_name(database_name, layer)
+    user = layer_user(layer)
+    statements = [
+        f"CREATE DATABASE IF NOT EXISTS {view_database};",
+        f"CREATE USER IF NOT EXISTS '{user}'@'%' IDENTIFIED BY 'admin';",
+    ]
+    for table_name in sorted(table_names):
+        if table_name in skip_tables:
+            continue
+        statements.append(
+            f"CREATE OR REPLACE SQL SECURITY DEFINER VIEW `{view_database}`.`{table_name}` AS SELECT * FROM `{database_name}`.`{table_name}`;"
+        )
+    statements += [
+        f"GRANT SELECT ON `{view_database}`.* TO '{user}'@'%';",
+        # build id of the database, see read_build_id
+        f"GRANT SELECT ON `{BUILD_DATABASE}`.* TO '{user}'@'%';",
+        # rows examined per query, see secgym.connection_pool
+        f"GRANT SELECT ON performance_schema.events_statements_history TO '{user}'@'%';",
+    ]
+    return statements
+
+BUILD_DATABASE = "secgym_builds"
+
+def generate_build_id_sql(database_name, build_id):
+    """Generate the statements recording the build id of a database, to run once its data is loaded.
+
+    The id changes whenever the data changes (a rebuild, or a delta merged into it), so that query results cached
+    by ExcytinEnv are only reused on the build they were computed on. It is kept outside of the database of the
+    tables, so that the agent does not see it.
+    """
+    return [
+        f"CREATE DATABASE IF NOT EXISTS {BUILD_DATABASE};",
+        f"CREATE TABLE IF NOT EXISTS {BUILD_DATABASE}.builds (database_name VARCHAR(64) PRIMARY KEY, build_id VARCHAR(64), updated DATETIME);",
+        f"REPLACE INTO {BUILD_DATABASE}.builds VALUES ('{database_name}', '{build_id}', NOW());",
+    ]
+
+def new_build_id(source_hash=None):
+    """The content hash of the sources if known (the same data gets the same id), a random id otherwise."""
+    return source_hash if source_hash is not None else uuid.uuid4().hex
+
+def read_build_id(cursor, database_name):
+    """The build id of a database, None if it cannot be identified.
+
+    Databases built before build ids were recorded are identified by the creation time of their tables, which
+    changes with every build (but not when rows are added).
+    """
+    try:
+        cursor.execute(f"SELECT build_id FROM {BUILD_DATABASE}.builds WHERE database_name = %s", (database_name,))
+        rows = cursor.fetchall()
+        if len(rows) > 0:
+            return rows[0][0]
+    except Error:
+        pass
+    cursor.execute(
+        "SELECT COUNT(*), MAX(CREATE_TIME) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s", (database_name,)
+    )
+    count, created = cursor.fetchall()[0]
+    return None if created is None else f"created-{count}-{created}"
+
 def debug_tables(args):
     # remove one table from the list, compile and see if it works
     log_list = [
@@ -320,6 +497,14 @@ if __name__ == "__main__":
     parser.add_argument('--respawn', action='store_true', help='Delete and recreate the container')
     parser.add_argument('--debug', action='store_true', help='Debug mode')
     parser.add_argument('--layer', type=str, default="alert", help='Layer to use for the agent')
+    parser.add_argument('--skip_catalog', action='store_true', help='Do not build the schema catalog served by ExcytinEnv.get_schema')
+    parser.add_argument('--typed_columns', action='store_true', help='Use DATETIME, BIGINT and JSON columns instead of TEXT for all columns')
+    parser.add_argument('--index_from', type=str, default=None, help='Folder of env logs (e.g. latest_experiments) to plan indexes from')
+    parser.add_argument('--index_min_count', type=int, default=5, help='Minimum number of logged queries filtering on a column to index it')
+    parser.add_argument('--snapshot', action='store_true', help='Restore the container from a snapshot if the CSV files did not change, save a snapshot after building it otherwise')
+    parser.add_argument('--layer_views', action='store_true', help='Build the alert layer and serve the log and alert_only layers from views of it, instead of separate containers')
+    parser.add_argument('--summary_tables', action='store_true', help='Build summary tables (alerts per entity, process tree edges, sign-ins per account and IP) for the alert layer')
+    parser.add_argument('--bulk_load', type=int, default=0, help='Load the data over this many concurrent connections after the container starts, instead of in the init file')
     args = parser.parse_args()
     # make sure the data is downloaded and stored in the 'large_data' folder
 
@@ -336,61 +521,123 @@ if __name__ == "__main__":
         debug_tables(args)
         exit(0)
 
-    # - Log level: minimum info, everything should be excluded
-    if args.layer == "log":
-        skip_tables = ["AzureDiagnostics", "LAQueryLogs", "SecurityIncident", "SecurityAlert", "AlertEvidence", "AlertInfo"]
-    # - Incident level: Have access to security incidents, but not the alerts
-    elif args.layer == "incident":
-        skip_tables = ["AzureDiagnostics", "LAQueryLogs", "SecurityAlert", "AlertEvidence", "AlertInfo"]
-    elif args.layer == "alert":
-        # - Alert level: Have access to all:
-        skip_tables = ["AzureDiagnostics", "LAQueryLogs"]
-    elif args.layer == "alert_only":
-        skip_tables = []
-        for fname in os.listdir(csv_folder):
-            if fname.endswith(".meta") or fname.startswith("._") or fname.startswith(".DS_Store"):
-                continue
-            if fname.endswith(".csv"):
-                skip_tables.append(fname.replace(".csv", ""))
-            elif os.path.isdir(os.path.join(csv_folder, fname)):
-                skip_tables.append(fname)
-            else:
-                raise ValueError(f"Invalid file type: {fname}")
+    # tables downloaded as parquet are written out as CSV for LOAD DATA, skipped if already up to date
+    from secgym.database.log_io import has_parquet_files, parquet_folder_to_csv
+    if has_parquet_files(csv_folder):
+        print(f"> 0. Wrote {parquet_folder_to_csv(csv_folder, verbose=True)} CSV files from parquet files")
 
-            # remove SecurityIncident", "SecurityAlert", "AlertEvidence", "AlertInfo" from the list
-        skip_tables.remove("SecurityIncident")
-        skip_tables.remove("SecurityAlert")
-        skip_tables.remove("AlertEvidence")
-        skip_tables.remove("AlertInfo")
-    else:
-        raise ValueError(f"Invalid layer: {args.layer}")
+    skip_tables = get_skip_tables(args.layer, csv_folder)
+    if args.layer_views and args.layer != "alert":
+        raise ValueError("--layer_views builds the tables of the alert layer, please use --layer alert.")
+    if args.summary_tables and args.layer != "alert":
+        raise ValueError("--summary_tables are only built for the alert layer, please use --layer alert.")
 
     # 1. create a .sql file from the CSV  filesin the 'large_data' folder
     #skip_tables = ["AzureDiagnostics", "LAQueryLogs", "SecurityIncident"] #TODO: add "AlertEvidence", "AlertInfo","SecurityAlert"
     # skip_tables += ["DeviceFileEvents"]
-    create_sql_file_from_csv_folder(
-        csv_folder=csv_folder,
-        sql_file_path=sql_file_path,
-        database_name=args.database_name,
-        skip_tables=skip_tables,
-        verbose=True
-    )
-    print(f"> 1. SQL file created: {sql_file_path}")
-
-    # 2. start a MySQL docker container
-    print("> 2 Starting a MySQL container...")
-    container, port = create_container(
-        csv_folder=csv_folder,
-        sql_file_path=sql_file_path,
-        database_name=args.database_name,
-        container_name=args.container_name,
-        port=args.port,
-        respawn=args.respawn
-    )
+    index_plan = None
+    if args.index_from is not None:
+        from secgym.database.index_planner import plan_indexes_from_logs
+        index_plan = plan_indexes_from_logs(csv_folder, to_abs_path(args.index_from), skip_tables, min_count=args.index_min_count)
+        print(f"> 0. Planned {sum(len(indexes) for indexes in index_plan.values())} indexes from {args.index_from}")
+    snapshot_path, source_hash, restored = None, None, False
+    if args.snapshot:
+        from secgym.database.snapshot import hash_csv_folder, snapshot_matches, invalidate_snapshot, restore_mysql_container
+        snapshot_path = to_abs_path(f"snapshots/{args.container_name}.tar")
+        source_hash = hash_csv_folder(
+            csv_folder, skip_tables, options={
+                "typed_columns": args.typed_columns, "index_plan": index_plan, "layer_views": args.layer_views,
+                "summary_tables": args.summary_tables,
+            }
+        )
+        if snapshot_matches(snapshot_path, source_hash):
+            print(f"> 0.1 Snapshot {snapshot_path} matches the CSV files, restoring it...")
+            container, port = restore_mysql_container(snapshot_path, args.container_name, args.port)
+            restored = True
+        else:
+            invalidate_snapshot(snapshot_path)
+
+    if not restored:
+        build_statements = generate_build_id_sql(args.database_name, new_build_id(source_hash))
+        create_sql_file_from_csv_folder(
+            csv_folder=csv_folder,
+            sql_file_path=sql_file_path,
+            database_name=args.database_name,
+            skip_tables=skip_tables,
+            verbose=True,
+            typed_columns=args.typed_columns,
+            index_plan=index_plan,
+            load_data=args.bulk_load == 0
+        )
+        if args.layer_views:
+            table_names = [table_name for table_name, _, _ in get_table_files(csv_folder, skip_tables)]
+            with open(sql_file_path, 'a', encoding='utf-8') as sql_file:
+                for layer in ["log", "alert_only"]:
+                    statements = generate_layer_views_sql(
+                        args.database_name, table_names, layer, get_skip_tables(layer, csv_folder)
+                    )
+                    sql_file.write("\n\n" + "\n\n".join(statements))
+        summary_statements = []
+        if args.summary_tables:
+            from secgym.database.summary_tables import generate_summary_tables_sql
+            type_maps = {table_name: type_map for table_name, type_map, _ in get_table_files(csv_folder, skip_tables)}
+            summary_statements = generate_summary_tables_sql(type_maps, verbose=True)
+            if args.bulk_load == 0:
+                # built by the init file once all tables are loaded
+                with open(sql_file_path, 'a', encoding='utf-8') as sql_file:
+                    sql_file.write(f"\n\nUSE {args.database_name};\n\n" + "\n\n".join(summary_statements))
+        if args.bulk_load == 0:
+            # last statements of the init file, once everything is loaded
+            with open(sql_file_path, 'a', encoding='utf-8') as sql_file:
+                sql_file.write("\n\n" + "\n\n".join(build_statements))
+        print(f"> 1. SQL file created: {sql_file_path}")
+
+        if not args.skip_catalog:
+            from secgym.database.schema_catalog import build_schema_catalog
+            catalog_path = to_abs_path(f"catalogs/{args.container_name}.json")
+            build_schema_catalog(csv_folder, catalog_path, skip_tables=skip_tables)
+            print(f"> 1.1 Schema catalog created: {catalog_path}")
+
+        # 2. start a MySQL docker container
+        print("> 2 Starting a MySQL container...")
+        container, port = create_container(
+            csv_folder=csv_folder,
+            sql_file_path=sql_file_path,
+            database_name=args.database_name,
+            container_name=args.container_name,
+            port=args.port,
+            respawn=args.respawn
+        )
+
+        if container.status == "exited":
+            print(f"Error: Container {args.container_name} has exited due to an error.")
+            exit(1)
+        if args.bulk_load > 0:
+            from secgym.database.bulk_loader import bulk_load
+            wait_until_ready(port, container=container)
+            print(f"> 2.1 Loading data over {args.bulk_load} connections...")
+            bulk_load(
+                csv_folder=csv_folder,
+                database_name=args.database_name,
+                port=port,
+                skip_tables=skip_tables,
+                num_workers=args.bulk_load,
+                typed_columns=args.typed_columns,
+                index_plan=index_plan
+            )
+            if len(summary_statements) > 0:
+                from secgym.database.summary_tables import build_summary_tables
+                print("> 2.2 Building summary tables...")
+                connection = mysql.connector.connect(host='localhost', port=port, user='root', password='admin', database=args.database_name)
+                build_summary_tables(connection, summary_statements)
+                connection.close()
+            connection = mysql.connector.connect(host='localhost', port=port, user='root', password='admin')
+            cursor = connection.cursor()
+            for statement in build_statements:
+                cursor.execute(statement)
+            connection.commit()
+            connection.close()
 
-    if container.status == "exited":
-        print(f"Error: Container {args.container_name} has exited due to an error.")
-        exit(1)
     # 3. test connection to the MySQL container
     connection = mysql.connector.connect(
         host='localhost',
@@ -411,4 +658,9 @@ if __name__ == "__main__":
         print("Tables in the database:", tables)
     
     print("> 5. Stopping the MySQL container...")
-    container.stop()
\ No newline at end of file
+    container.stop()
+
+    if args.snapshot and not restored:
+        from secgym.database.snapshot import save_mysql_snapshot
+        print("> 6. Saving a snapshot of the database...")
+        save_mysql_snapshot(container, snapshot_path, source_hash, database_name=args.database_name)
\ No newline at end of file
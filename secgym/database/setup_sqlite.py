@@ -0,0 +1,118 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+
+from secgym.database.process_logs import SEPARATOR, QUOTECHAR
+from secgym.database.setup_database import get_table_files, get_skip_tables, to_abs_path
+from secgym.database.schema_catalog import build_schema_catalog
+from secgym.database.snapshot import hash_csv_folder, snapshot_matches, invalidate_snapshot, write_manifest
+
+# CSV fields can hold whole JSON documents
+csv.field_size_limit(sys.maxsize)
+
+
+def create_sqlite_db_from_csv_folder(
+        csv_folder,
+        db_path,
+        skip_tables=["SecurityAlert", "SecurityIncident"],
+        batch_size=10000,
+        verbose=False
+        ):
+    """Load a folder of CSV and .meta files into a single SQLite file.
+
+    This is the embedded counterpart of `create_sql_file_from_csv_folder` + `create_container`:
+    the same tables are created with the same (text) columns, and can be served by `ExcytinEnv(backend="sqlite")`.
+    Columns use `COLLATE NOCASE` to match MySQL's case-insensitive default collation.
+
+    Args:
+        csv_folder (str): Path to the folder containing the CSV and .meta files.
+        db_path (str): Path to the output SQLite file, replaced if it exists.
+        skip_tables (list): List of table names to skip.
+        batch_size (int): Number of rows inserted per batch.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    try:
+        for table_name, type_map, csv_files in get_table_files(csv_folder, skip_tables, verbose=verbose):
+            start_time = time.time()
+            columns = list(type_map.keys())
+            column_defs = ",\n    ".join(f'"{col}" TEXT COLLATE NOCASE' for col in columns)
+            connection.execute(f'CREATE TABLE "{table_name}" (\n    {column_defs}\n)')
+
+            insert_sql = f'INSERT INTO "{table_name}" VALUES ({", ".join(["?"] * len(columns))})'
+            num_rows = 0
+            for csv_file in csv_files:
+                num_rows += _load_csv(connection, os.path.join(csv_folder, csv_file), insert_sql, len(columns), batch_size)
+            connection.commit()
+            if verbose:
+                print(f"Loaded {table_name}: {num_rows} rows in {time.time() - start_time:.2f} seconds")
+    finally:
+        connection.close()
+
+
+def _load_csv(connection, csv_path, insert_sql, num_columns, batch_size):
+    """Insert the rows of one CSV file, skipping malformed rows like LOAD DATA does with IGNORE."""
+    num_rows = 0
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f, delimiter=SEPARATOR, quotechar=QUOTECHAR)
+        next(reader, None)  # header
+        batch = []
+        for row in reader:
+            if len(row) != num_columns:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                connection.executemany(insert_sql, batch)
+                num_rows += len(batch)
+                batch = []
+        if len(batch) > 0:
+            connection.executemany(insert_sql, batch)
+            num_rows += len(batch)
+    return num_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Setup an embedded SQLite database from CSV files')
+    parser.add_argument('--csv', type=str, help='Folder containing the CSV files')
+    parser.add_argument('--db_file', type=str, help='Output SQLite file')
+    parser.add_argument('--layer', type=str, default="alert", help='Layer to use for the agent')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the database file even if the CSV files did not change')
+    args = parser.parse_args()
+
+    csv_folder = to_abs_path(args.csv)
+    db_path = to_abs_path(args.db_file)
+    if args.layer == "alert_only":
+        db_path = db_path.replace(".db", "_alert_only.db")
+    skip_tables = get_skip_tables(args.layer, csv_folder)
+
+    # the database file is its own snapshot, it is only rebuilt when the CSV files change
+    source_hash = hash_csv_folder(csv_folder, skip_tables)
+    if not args.rebuild and snapshot_matches(db_path, source_hash):
+        print(f"SQLite database {db_path} matches the CSV files, nothing to do.")
+        sys.exit(0)
+    invalidate_snapshot(db_path)
+    create_sqlite_db_from_csv_folder(
+        csv_folder=csv_folder,
+        db_path=db_path,
+        skip_tables=skip_tables,
+        verbose=True
+    )
+    write_manifest(db_path, source_hash, "sqlite")
+    print(f"SQLite database created: {db_path}")
+
+    # the env looks up the catalog by container name, which is the name of the database file
+    container_name = os.path.basename(db_path).replace(".db", "")
+    catalog_path = to_abs_path(f"catalogs/{container_name}.json")
+    build_schema_catalog(csv_folder, catalog_path, skip_tables=skip_tables)
+    print(f"Schema catalog created: {catalog_path}")
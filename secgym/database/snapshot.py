@@ -0,0 +1,156 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import time
+from datetime import datetime
+
+from secgym.database.container_manager import wait_until_ready
+from secgym.database.setup_database import get_table_files
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_csv_folder(csv_folder, skip_tables=[], options={}):
+    """Content hash of the tables that go into a database, together with the build options.
+
+    Args:
+        csv_folder (str): Path to the folder containing the CSV and .meta files.
+        skip_tables (list): List of table names left out of the database.
+        options (dict): Anything else that changes the built database, e.g. typed columns or the index plan.
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    for table_name, type_map, csv_files in sorted(get_table_files(csv_folder, skip_tables), key=lambda t: t[0]):
+        digest.update(json.dumps([table_name, type_map]).encode("utf-8"))
+        for csv_file in sorted(csv_files):
+            digest.update(csv_file.encode("utf-8"))
+            with open(os.path.join(csv_folder, csv_file), "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(snapshot_path):
+    return snapshot_path + ".manifest.json"
+
+
+def write_manifest(snapshot_path, source_hash, kind, **extra):
+    """Record the source hash of a snapshot next to it, once the snapshot is complete."""
+    manifest = {"hash": source_hash, "kind": kind, "created": datetime.now().isoformat(), **extra}
+    tmp_path = _manifest_path(snapshot_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, _manifest_path(snapshot_path))
+
+
+def invalidate_snapshot(snapshot_path):
+    """Remove the manifest of a snapshot before it is rebuilt, so that a partial rebuild never matches."""
+    if os.path.exists(_manifest_path(snapshot_path)):
+        os.remove(_manifest_path(snapshot_path))
+
+
+def snapshot_matches(snapshot_path, source_hash):
+    """Whether a complete snapshot built from the same sources exists."""
+    manifest_path = _manifest_path(snapshot_path)
+    if not os.path.exists(snapshot_path) or not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, "r") as f:
+        return json.load(f).get("hash") == source_hash
+
+
+def save_mysql_snapshot(container, snapshot_path, source_hash, database_name="env_monitor_db"):
+    """Save the data directory of a MySQL container as a tarball.
+
+    The container is stopped first so that the data directory is consistent on disk.
+
+    Args:
+        container: The docker container, as returned by `create_container`.
+        snapshot_path (str): Path to the output tarball.
+        source_hash (str): Hash of the sources, see `hash_csv_folder`.
+    """
+    start_time = time.time()
+    container.reload()
+    if container.status == "running":
+        container.stop()
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    stream, _ = container.get_archive("/var/lib/mysql")
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in stream:
+            f.write(chunk)
+    os.replace(tmp_path, snapshot_path)
+    write_manifest(snapshot_path, source_hash, "mysql", database_name=database_name)
+    print(f"Saved snapshot {snapshot_path} ({os.path.getsize(snapshot_path) / 1e6:.1f} MB) in {time.time() - start_time:.1f} seconds")
+
+
+def extract_datadir(snapshot_path, datadir_parent):
+    """Extract a fresh copy of the data directory of a snapshot, replacing an older copy.
+
+    Returns:
+        str: The extracted data directory.
+    """
+    shutil.rmtree(datadir_parent, ignore_errors=True)
+    tmp_parent = datadir_parent + ".tmp"
+    shutil.rmtree(tmp_parent, ignore_errors=True)
+    os.makedirs(tmp_parent)
+    with tarfile.open(snapshot_path, "r") as tar:
+        tar.extractall(tmp_parent)
+    os.replace(tmp_parent, datadir_parent)
+    return os.path.join(datadir_parent, "mysql")
+
+
+def restore_mysql_container(snapshot_path, container_name, port="3306"):
+    """Start a MySQL container on the data directory of a snapshot, without loading any data.
+
+    The server writes to its data directory, so the tarball is extracted again for every restore, into a
+    directory of the container next to the snapshot (`<snapshot>.<container_name>.d`), which is bind-mounted
+    as /var/lib/mysql; as the data directory is already initialized, the MySQL entrypoint starts the server
+    right away. An existing container with the same name is replaced, along with its data directory.
+
+    Returns:
+        Tuple: The container and the port.
+    """
+    import docker
+    from docker.errors import NotFound
+
+    start_time = time.time()
+    client = docker.from_env()
+    try:
+        container = client.containers.get(container_name)
+        container.remove(force=True)
+        print(f"Removed existing container {container_name}")
+    except NotFound:
+        pass
+
+    datadir = extract_datadir(snapshot_path, f"{snapshot_path}.{container_name}.d")
+
+    container = client.containers.run(
+        "mysql:9.0",
+        name=container_name,
+        environment={
+            "MYSQL_ROOT_PASSWORD": "admin",
+            "MYSQL_ROOT_HOST": "%"
+        },
+        ports={
+            "3306/tcp": port
+        },
+        volumes={
+            os.path.abspath(datadir): {
+                'bind': '/var/lib/mysql',
+                'mode': 'rw'
+            }
+        },
+        detach=True
+    )
+    wait_until_ready(port, container=container)
+    container.reload()
+    print(f"Restored container {container_name} from {snapshot_path} on port {port} in {time.time() - start_time:.1f} seconds")
+    return container, port
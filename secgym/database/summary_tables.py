@@ -0,0 +1,123 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import time
+from typing import Dict, List
+
+from secgym.database.index_planner import generate_create_index_sql
+
+# fields of the SecurityAlert entities that identify them, see secgym.utils.utils.process_entity_identifiers
+ENTITY_FIELDS = [
+    "Name", "UPNSuffix", "AadUserId", "Sid", "HostName", "AzureID", "Address", "Url", "DomainName",
+    "MailboxPrimaryAddress", "Recipient", "Sender", "AppId", "ProcessId", "CommandLine", "Value",
+]
+
+
+def _alert_entity_map_sql() -> str:
+    json_columns = ",\n        ".join(f"`{field}` TEXT PATH '$.{field}'" for field in ENTITY_FIELDS)
+    field_names = "\n        UNION ALL ".join(f"SELECT '{field}' AS EntityField" for field in ENTITY_FIELDS)
+    cases = " ".join(f"WHEN '{field}' THEN e.`{field}`" for field in ENTITY_FIELDS)
+    # one row per alert and identifying field of its entities, entries that only reference another
+    # entity ($ref) have no Type and are left out
+    return f"""CREATE TABLE AlertEntityMap AS
+SELECT SystemAlertId, AlertName, AlertSeverity, TimeGenerated, EntityType, EntityField, EntityValue
+FROM (
+    SELECT a.SystemAlertId, a.AlertName, a.AlertSeverity, a.TimeGenerated, e.EntityType, f.EntityField,
+        CASE f.EntityField {cases} END AS EntityValue
+    FROM SecurityAlert a
+    JOIN JSON_TABLE(IF(JSON_VALID(a.Entities), a.Entities, '[]'), '$[*]' COLUMNS (
+        EntityType VARCHAR(64) PATH '$.Type',
+        {json_columns}
+    )) e
+    CROSS JOIN (
+        {field_names}
+    ) f
+    WHERE e.EntityType IS NOT NULL
+) entities
+WHERE EntityValue IS NOT NULL AND EntityValue <> '';"""
+
+
+def _process_tree_edges_sql() -> str:
+    return """CREATE TABLE ProcessTreeEdges AS
+SELECT DeviceName, InitiatingProcessFileName AS ParentFileName, FileName AS ChildFileName,
+    COUNT(*) AS EventCount, MIN(TimeGenerated) AS FirstSeen, MAX(TimeGenerated) AS LastSeen,
+    MIN(ProcessCommandLine) AS ExampleCommandLine
+FROM DeviceProcessEvents
+GROUP BY DeviceName, InitiatingProcessFileName, FileName;"""
+
+
+def _signin_summary_sql() -> str:
+    return """CREATE TABLE SigninSummary AS
+SELECT UserPrincipalName, IPAddress, COUNT(*) AS SigninCount,
+    SUM(ResultType = '0') AS SuccessCount, SUM(ResultType <> '0') AS FailureCount,
+    MIN(TimeGenerated) AS FirstSeen, MAX(TimeGenerated) AS LastSeen
+FROM SigninLogs
+GROUP BY UserPrincipalName, IPAddress;"""
+
+
+# name: source table, the columns it needs, the statement building the summary and its indexes
+SUMMARY_TABLES = {
+    "AlertEntityMap": {
+        "source": "SecurityAlert",
+        "columns": ["SystemAlertId", "AlertName", "AlertSeverity", "TimeGenerated", "Entities"],
+        "sql": _alert_entity_map_sql,
+        "indexes": [["EntityValue"], ["SystemAlertId"]],
+    },
+    "ProcessTreeEdges": {
+        "source": "DeviceProcessEvents",
+        "columns": ["DeviceName", "InitiatingProcessFileName", "FileName", "ProcessCommandLine", "TimeGenerated"],
+        "sql": _process_tree_edges_sql,
+        "indexes": [["DeviceName", "ParentFileName"], ["ChildFileName"]],
+    },
+    "SigninSummary": {
+        "source": "SigninLogs",
+        "columns": ["UserPrincipalName", "IPAddress", "ResultType", "TimeGenerated"],
+        "sql": _signin_summary_sql,
+        "indexes": [["UserPrincipalName"], ["IPAddress"]],
+    },
+}
+
+
+def generate_summary_tables_sql(type_maps: Dict[str, Dict[str, str]], verbose: bool = False) -> List[str]:
+    """Generate the statements building the summary tables whose source table is in the database.
+
+    The summaries are materialized once the source tables are loaded, and indexed on the columns
+    investigations pivot on, e.g. all alerts of an entity is a lookup of `AlertEntityMap.EntityValue`.
+
+    Args:
+        type_maps (dict): Type map of each table in the database, see `get_table_files`.
+
+    Returns:
+        list: The statements, in order.
+    """
+    statements = []
+    for summary_name, summary in SUMMARY_TABLES.items():
+        type_map = type_maps.get(summary["source"])
+        if type_map is None:
+            continue
+        missing = [column for column in summary["columns"] if column not in type_map]
+        if len(missing) > 0:
+            print(f"Warning: Skipping summary table {summary_name}, {summary['source']} has no column {', '.join(missing)}.")
+            continue
+        if verbose:
+            print(f"Adding summary table {summary_name} from {summary['source']}")
+        statements.append(f"DROP TABLE IF EXISTS {summary_name};")
+        statements.append(summary["sql"]())
+        for columns in summary["indexes"]:
+            # all indexed columns are text, indexed on a prefix
+            statements.append(generate_create_index_sql(summary_name, columns, {}))
+    return statements
+
+
+def build_summary_tables(connection, statements: List[str], verbose: bool = True) -> float:
+    """Run the statements of `generate_summary_tables_sql` on a connection to the database, returns the seconds it took."""
+    start_time = time.time()
+    cursor = connection.cursor()
+    for statement in statements:
+        statement_start = time.time()
+        cursor.execute(statement)
+        if verbose and statement.startswith("CREATE TABLE"):
+            print(f"{statement.split()[2]}: {max(cursor.rowcount, 0)} rows in {time.time() - statement_start:.1f} seconds")
+    connection.commit()
+    cursor.close()
+    return time.time() - start_time
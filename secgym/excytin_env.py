@@ -4,14 +4,21 @@
 
 import gymnasium as gym
 import numpy as np
-import datetime, json, logging, os, re
+import datetime, json, logging, os, re, threading, time
 from typing import Dict, List, Tuple, Union
-import mysql.connector
 from datetime import datetime
 from time import sleep
 
 from secgym.utils.utils import get_full_question
 from secgym.evaluator import LLMEvaluator
+from secgym.connection_pool import get_connection_pool
+from secgym.query_cache import QueryCache, database_identity, get_default_query_cache, is_cacheable
+from secgym.sqlite_backend import get_sqlite_pool
+from secgym.trajectory_log import TrajectoryLogWriter, is_jsonl_file
+from secgym.database.schema_catalog import load_schema_catalog, format_schema
+from secgym.database.setup_database import layer_database_name, layer_user, read_build_id
+from secgym.database.container_manager import get_container_manager
+from secgym.observation import get_renderer, fit_token_budget
 
 ATTACKS = {
     "incident_5": {
@@ -58,9 +65,88 @@ ATTACKS = {
 
 AlphineSkiHouseInfo = {"port": "3314", "container_name": "alpineskihouse"}
 
+# env action answered from the schema catalog: "SCHEMA" or "SCHEMA <table>"
+SCHEMA_ACTION = re.compile(r"^\s*schema(?:\s+`?(\w+)`?)?\s*;?\s*$", re.IGNORECASE)
+# default of the `timeout` arguments, i.e. `query_timeout`, as None means no limit
+_DEFAULT = object()
 
-def start_container(container_name):
-    pass
+
+def get_attack_info(attack: str, layer: str = "alert", use_full_db: bool = False, layer_views: bool = False, verbose: bool = True) -> dict:
+    """Copy of the ATTACKS entry of an attack, with the container and port the env uses for the layer."""
+    # copy so the container/port overrides below do not leak into ATTACKS
+    attack_info = dict(ATTACKS[attack])
+    if use_full_db:
+        if verbose:
+            print("Warning: Replace dataset with full dataset.")
+        attack_info["port"] = AlphineSkiHouseInfo["port"]
+        attack_info["container_name"] = AlphineSkiHouseInfo["container_name"]
+    if layer == "alert_only" and not layer_views:
+        attack_info["container_name"] += "_alert_only"
+        if verbose:
+            print(
+                f"Warning: Change container name to {attack_info['container_name']} for alert only, using the same port as {ATTACKS[attack]['container_name']}."
+            )
+    return attack_info
+
+
+def start_container(container_name: str, port: str) -> float:
+    """Start the container if it is not running and wait until the database answers, returns the seconds waited."""
+    return get_container_manager().ensure_ready(container_name, port)
+
+
+class ResultCollector:
+    """Collect a streamed result, keeping rows only until the display budget is used up.
+
+    Rows are kept while the string form of the result fits in `max_str_len` (or there are no more than
+    `max_entry_return` of them), which matches truncating the full result. Once the budget is used up,
+    the remaining rows are only counted, up to `max_count_rows`.
+    """
+
+    def __init__(self, max_entry_return: int, max_str_len: int, max_count_rows: int):
+        self.max_entry_return = max_entry_return
+        self.max_str_len = max_str_len
+        self.max_count_rows = max_count_rows
+        self.rows = []
+        self.columns = []
+        self.str_len = 2  # brackets of the list
+        self.retrieved = 0
+        self.limited = False
+        self.exact_count = True
+
+    def add_batch(self, batch: list) -> bool:
+        """Add a batch of fetched rows, returns whether more rows should be fetched."""
+        if len(batch) == 0:
+            return False
+        self.retrieved += len(batch)
+        if not self.limited:
+            for row in batch:
+                self.rows.append(row)
+                self.str_len += len(str(row)) + 2
+            if self.str_len > self.max_str_len and len(self.rows) > self.max_entry_return:
+                self.rows = self.rows[: self.max_entry_return]
+                self.limited = True
+        if self.limited and self.retrieved >= self.max_count_rows:
+            self.exact_count = False
+            return False
+        return True
+
+    def result(self) -> dict:
+        """
+        Returns:
+            dict: with fields
+                - rows (list): The rows to display.
+                - columns (list): The column names.
+                - retrieved (int): Number of rows retrieved, a lower bound if `exact_count` is False.
+                - exact_count (bool): Whether all rows were counted.
+                - limited (bool): Whether `rows` is truncated to `max_entry_return`.
+        """
+        return {
+            "rows": self.rows,
+            "columns": self.columns,
+            "retrieved": self.retrieved,
+            "exact_count": self.exact_count,
+            "limited": self.limited,
+        }
 
 
 class ExcytinEnv(gym.Env):
@@ -79,17 +165,40 @@ class ExcytinEnv(gym.Env):
         split: str = "test",
         use_full_db: bool = False,
         layer: str = "alert",
+        pool_size: int = 8,  # max connections shared by all envs on the same container
+        query_cache: Union[QueryCache, bool] = True,  # True: process-wide cache, False: no caching
+        fetch_size: int = 1000,  # rows fetched per round trip when streaming a result
+        max_count_rows: int = 100000,  # stop counting rows after this and report "at least N"
+        backend: str = "mysql",  # "mysql" for the docker containers, "sqlite" for an embedded database file
+        db_file: Union[str, None] = None,  # sqlite file, defaults to database/sqlite_files/<container_name>.db
+        query_timeout: Union[float, None] = 30,  # seconds before a query is cancelled, None for no limit
+        track_rows_examined: bool = False,  # look up rows examined per query in performance_schema, one more round-trip per query
+        catalog_file: Union[str, None] = None,  # schema catalog, defaults to database/catalogs/<container_name>.json
+        observation_format: str = "repr",  # "repr" (python repr of the rows), "tsv" or "markdown" (tables with a header)
+        max_col_width: Union[int, None] = 200,  # cells are cut to this many characters in tsv/markdown
+        max_obs_tokens: Union[int, None] = None,  # show only as many rows as fit in this many tokens, None for no limit
+        layer_views: bool = False,  # serve the log/alert_only layers from the views of the alert container (setup with --layer_views)
+        auto_start: bool = False,  # start the container if it is not running and wait until it is ready
     ):
         self.noise_level = noise_level
         self.max_steps = max_steps
         self.max_entry_return = max_entry_return
         self.max_str_len = max_str_len
+        self.fetch_size = fetch_size
+        self.max_count_rows = max_count_rows
+        self.query_timeout = query_timeout
+        self.track_rows_examined = track_rows_examined
+        self.last_query_stats = {}
+        self.observation_format = observation_format
+        self.render_rows = get_renderer(observation_format, max_col_width=max_col_width)
+        self.max_obs_tokens = max_obs_tokens
         self.layer = layer
         # evaluator
         self.evaluator = evaluator
 
         if save_file is False:
             print("Warning: No save file provided. Logging will not be saved.")
+            self.save_file = None
         else:
             if isinstance(save_file, bool):
                 os.makedirs("results", exist_ok=True)
@@ -112,16 +221,7 @@ class ExcytinEnv(gym.Env):
                 )
             self.attack = attack
 
-        attack_info = ATTACKS[self.attack]
-        if use_full_db:
-            print("Warning: Replace dataset with full dataset.")
-            attack_info["port"] = AlphineSkiHouseInfo["port"]
-            attack_info["container_name"] = AlphineSkiHouseInfo["container_name"]
-        if self.layer == "alert_only":
-            attack_info["container_name"] += "_alert_only"
-            print(
-                f"Warning: Change container name to {attack_info['container_name']} for alert only, using the same port as {ATTACKS[self.attack]['container_name']}."
-            )
+        attack_info = get_attack_info(self.attack, layer=self.layer, use_full_db=use_full_db, layer_views=layer_views)
 
         curr_path = os.path.dirname(os.path.abspath(__file__))
         if split == "test":
@@ -132,25 +232,74 @@ class ExcytinEnv(gym.Env):
             self._all_questions = json.load(f)
             self.num_questions = len(self._all_questions)
 
-        # set up container
+        # set up container, connections are borrowed from a pool shared by all envs on the same container
         self.container_name = attack_info["container_name"]
         self.container = None
-        self.connection = mysql.connector.connect(
-            host="localhost", port=attack_info["port"], user="root", password="admin"
-        )
-        if self.connection.is_connected():
-            self.cursor = self.connection.cursor()
-            self.cursor.execute("SET SESSION MAX_EXECUTION_TIME=30000")
-            self.cursor.execute(f"USE {database_name};")
+        self.port = attack_info["port"]
+        self.db_user, self.db_password = "root", "admin"
+        base_database_name = database_name
+        if layer_views:
+            if backend != "mysql":
+                raise ValueError("layer_views is only supported with the mysql backend.")
+            # a user that can only read the views of the layer in its own database
+            database_name = layer_database_name(database_name, layer)
+            if layer != "alert":
+                self.db_user = layer_user(layer)
+        self.database_name = database_name
+        self.pool_size = pool_size
+        self.backend = backend
+        if backend == "mysql":
+            if auto_start:
+                start_container(self.container_name, self.port)
+            self.pool = get_connection_pool(
+                port=self.port, database_name=database_name, pool_size=pool_size,
+                user=self.db_user, password=self.db_password
+            )
+            database_location = f"{self.container_name}:{self.port}/{database_name}"
+        elif backend == "sqlite":
+            if db_file is None:
+                db_file = os.path.join(curr_path, f"database/sqlite_files/{self.container_name}.db")
+            if not os.path.exists(db_file):
+                raise ValueError(
+                    f"Database file {db_file} not found, please build it with secgym/database/setup_sqlite.py."
+                )
+            self.db_file = os.path.abspath(db_file)
+            self.pool = get_sqlite_pool(self.db_file, database_name=database_name, pool_size=pool_size)
+            database_location = f"sqlite:{self.db_file}"
+        else:
+            raise ValueError(f"Invalid backend: {backend}, please choose from 'mysql' or 'sqlite'.")
+        if catalog_file is None:
+            catalog_file = os.path.join(curr_path, f"database/catalogs/{self.container_name}.json")
+        self.schema_catalog = load_schema_catalog(catalog_file)
+
+        if query_cache is True:
+            self.query_cache = get_default_query_cache()
+        elif query_cache is False:
+            self.query_cache = None
         else:
-            raise ValueError("Could not connect to the database.")
+            self.query_cache = query_cache
+        self.build_id = self._read_build_id(base_database_name) if self.query_cache is not None else None
+        if self.query_cache is not None and self.build_id is None:
+            print(f"Warning: Cannot identify the build of {database_location}, query results will not be cached.")
+            self.query_cache = None
+        self.database_id = database_identity(database_location, layer, self.build_id)
 
         # saved logs
         self.step_count = 0
         self.curr_question: Union[dict, None] = None
         self.curr_trajectory = []
+        self.curr_qid = None
         self.all_logs = []
-        if os.path.exists(self.save_file):
+        # a .jsonl or .jsonl.gz save file is appended to, one line per question,
+        # in that case all_logs only holds the logs not saved yet
+        self.log_writer = None
+        if is_jsonl_file(self.save_file):
+            self.log_writer = TrajectoryLogWriter(self.save_file)
+            if len(self.log_writer) > 0:
+                print(
+                    f"Warning: Save file {self.save_file} already has {len(self.log_writer)} logs, will append to the file."
+                )
+        elif self.save_file is not None and os.path.exists(self.save_file):
             print(
                 f"Warning: Save file {self.save_file} already exists, by default will append to the file."
             )
@@ -158,6 +307,14 @@ class ExcytinEnv(gym.Env):
                 self.all_logs = json.load(f)
 
         self.check_layer(layer)
+        if self.schema_catalog is not None:
+            # the catalog may describe tables this database does not have (e.g. built for all tables of the
+            # container, or for another layer), keep the ones the agent can actually query
+            tables = {row[0].lower() for row in self._run_sql("SHOW TABLES;")}
+            self.schema_catalog = {
+                **self.schema_catalog,
+                "tables": {t: v for t, v in self.schema_catalog["tables"].items() if t.lower() in tables},
+            }
 
     def get_attack_list(self):
         """Get the list of attacks."""
@@ -165,12 +322,152 @@ class ExcytinEnv(gym.Env):
 
     def get_table_names(self):
         """Get the table names."""
-        self.cursor.execute("SHOW TABLES;")
-        return self.cursor.fetchall()
+        return self._run_sql("SHOW TABLES;")
+
+    def _read_build_id(self, database_name: str) -> Union[str, None]:
+        """Identity of the data of the database, part of the cache keys so that results do not outlive a rebuild."""
+        if self.backend == "sqlite":
+            stat = os.stat(self.db_file)
+            return f"{stat.st_size}-{stat.st_mtime_ns}"
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    return read_build_id(cursor, database_name)
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Warning: Could not read the build id: {e}")
+            return None
+
+    def _run_sql(self, query: str, timeout=_DEFAULT) -> list:
+        """Run a query on a pooled connection and fetch all rows."""
+        return self._cached(query, self.database_id, self._fetch_all, timeout)
+
+    def _fetch_result(self, query: str, timeout=_DEFAULT) -> dict:
+        """Run a query and stream only as many rows as can be displayed."""
+        return self._cached(query, self._result_cache_key(), self._fetch_streaming, timeout)
+
+    def _result_cache_key(self) -> str:
+        # the kept rows depend on the display budget
+        return f"{self.database_id}#{self.max_entry_return},{self.max_str_len},{self.max_count_rows}"
+
+    def _new_query_stats(self) -> dict:
+        """Start the resource accounting of a query, available as `last_query_stats` afterwards."""
+        self.last_query_stats = {
+            "wall_time": 0.0,  # seconds, including fetching
+            "rows_examined": None,  # as reported by the server, None if unknown
+            "cache_hit": False,
+            "timed_out": False,
+        }
+        return self.last_query_stats
+
+    def _cached(self, query: str, database_key: str, fetch_fn, timeout=_DEFAULT):
+        """Serve read-only queries from the cache when possible, otherwise run `fetch_fn` on a pooled cursor.
+
+        The query is cancelled on the server if it runs longer than `timeout` (defaults to `query_timeout`) seconds,
+        None or 0 for no limit.
+        """
+        timeout = self.query_timeout if timeout is _DEFAULT else timeout
+        stats = self._new_query_stats()
+        start_time = time.time()
+        use_cache = self.query_cache is not None and is_cacheable(query)
+        if use_cache:
+            hit, result = self.query_cache.get(database_key, query)
+            if hit:
+                stats.update({"cache_hit": True, "rows_examined": 0, "wall_time": time.time() - start_time})
+                return result
+
+        connection = self.pool.acquire()
+        # the timer stays armed until the connection is released, and may no longer fire once it is reused
+        armed = {"lock": threading.Lock(), "active": True}
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._cancel_query, args=(connection, stats, armed))
+            timer.daemon = True
+            timer.start()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            result = fetch_fn(cursor)
+            # rows left unread when the count stopped early are not drained, the pool discards the connection
+            if not connection.unread_result:
+                cursor.close()
+                if self.track_rows_examined:
+                    stats["rows_examined"] = self.pool.rows_examined(connection)
+        except Exception as e:
+            if stats["timed_out"]:
+                raise TimeoutError(f"Query exceeded {timeout} seconds and was cancelled.") from e
+            raise
+        finally:
+            try:
+                self.pool.release(connection, before_reuse=lambda: self._disarm(armed))
+            finally:
+                self._disarm(armed)
+                if timer is not None:
+                    timer.cancel()
+                stats["wall_time"] = time.time() - start_time
+
+        if use_cache:
+            self.query_cache.put(database_key, query, result)
+        return result
+
+    def _cancel_query(self, connection, stats: dict, armed: dict) -> None:
+        with armed["lock"]:
+            if not armed["active"]:
+                return
+            stats["timed_out"] = True
+            try:
+                self.pool.cancel(connection)
+            except Exception as e:
+                print(f"Warning: Could not cancel query: {e}")
+
+    @staticmethod
+    def _disarm(armed: dict) -> None:
+        with armed["lock"]:
+            armed["active"] = False
+
+    @staticmethod
+    def _fetch_all(cursor) -> list:
+        return cursor.fetchall()
+
+    def _fetch_streaming(self, cursor) -> dict:
+        """Fetch rows in batches, keeping rows only until the display budget is used up."""
+        collector = ResultCollector(self.max_entry_return, self.max_str_len, self.max_count_rows)
+        if cursor.description is None:  # statement without a result set
+            return collector.result()
+        collector.columns = [d[0] for d in cursor.description]
+        while collector.add_batch(cursor.fetchmany(self.fetch_size)):
+            pass
+        return collector.result()
 
     def get_schema(self, table_name: str) -> List[Dict]:
-        """Get the schema of a table."""
-        return None
+        """Get the schema of a table.
+
+        Served from the schema catalog built with the database (name, type, distinct_estimate, empty_count and samples
+        for each column), falls back to `DESCRIBE` (name and type only) when there is no catalog.
+        """
+        if self.schema_catalog is not None:
+            for name, table in self.schema_catalog["tables"].items():
+                if name.lower() == table_name.lower():
+                    return table["columns"]
+            raise ValueError(f"Table {table_name} not found.")
+        return [{"name": row[0], "type": row[1]} for row in self._run_sql(f"DESCRIBE `{table_name}`;")]
+
+    def _schema_step(self, action: str) -> Tuple[str, float, bool, Dict, bool]:
+        """Answer a `SCHEMA [table]` action, returns observation, reward, done, info and query_success."""
+        try:
+            return self.describe_schema(SCHEMA_ACTION.match(action).group(1)), 0, False, {"schema_action": True}, True
+        except Exception as e:
+            return f"{e.__class__.__name__}: {e}", 0, False, {"schema_action": True}, False
+
+    def describe_schema(self, table_name: Union[str, None] = None) -> str:
+        """Describe all tables, or the columns of one table, as text. Used for the `SCHEMA [table]` action."""
+        if self.schema_catalog is not None:
+            return format_schema(self.schema_catalog, table_name)
+        if table_name is None:
+            return str(self.get_table_names())
+        return str(self._run_sql(f"DESCRIBE `{table_name}`;"))
 
     def getAllQuestions(self) -> List[dict]:
         return self._all_questions
@@ -190,33 +487,38 @@ class ExcytinEnv(gym.Env):
             "reward": self.curr_trajectory[-1]["reward"],
             "success_query_count": success_query_count,
             "total_query_count": total_query_count,
+            "qid": self.curr_qid,
             "question": self.curr_question,
             "trajectory": self.curr_trajectory,
         }
 
     def save_logging(self):
-        if self.save_file:
+        if self.log_writer is not None:
+            for log in self.all_logs:
+                self.log_writer.append(log, qid=log.get("qid"))
+            self.all_logs = []
+        elif self.save_file:
             with open(self.save_file, "w") as f:
                 json.dump(self.all_logs, f, indent=4)
 
     def execute_query(self, query: str) -> Tuple[np.ndarray, bool]:
         """Execute a query and return the result."""
         try:
-            self.cursor.execute(query)
-            # print(self.cursor.column_names)
-            return self.cursor.fetchall(), True
+            return self._run_sql(query), True
         except Exception as e:
             return f"{e.__class__.__name__}: {e.__context__}", False
 
     def step(
-        self, action: str, submit=False, stringify=True
+        self, action: str, submit=False, stringify=True, timeout=_DEFAULT
     ) -> Tuple[np.ndarray, float, bool, Dict]:
         """Take a step in the environment.
 
         Args:
             action (str): The action to take. It should be a SQL query or a string that is the final answer.
+                `SCHEMA` lists all tables and their columns, `SCHEMA <table>` describes the columns of a table, both without a round-trip to the database.
             submit (bool, optional): Whether to submit the action. Defaults to False. If set, the final answer should be passed as the action.
             stringify (bool, optional): Whether to stringify the result. Defaults to True.
+            timeout (float, optional): Seconds before the query is cancelled, None or 0 for no limit. Defaults to `query_timeout`.
 
         Returns:
             Tuple[np.ndarray, float, bool, Dict]: The observation, reward, done, and info.
@@ -224,6 +526,7 @@ class ExcytinEnv(gym.Env):
             In info:
                 - query_success (bool): Whether the query was run successfully.
                 - submit (bool): Whether the action was submitted.
+                - query_stats (dict): For queries, wall_time, rows_examined, rows_returned, observation_bytes, cache_hit and timed_out.
         """
         if self.curr_question is None:
             raise ValueError("Cannot step in the environment without resetting first.")
@@ -231,35 +534,60 @@ class ExcytinEnv(gym.Env):
         query_success = True
         if submit:
             observation, reward, done, info = self._submit(action)
+        elif self.step_count < self.max_steps and SCHEMA_ACTION.match(action):
+            observation, reward, done, info, query_success = self._schema_step(action)
         elif self.step_count < self.max_steps:
+            result = None
             try:
-                self.cursor.execute(action)
-                observation = self.cursor.fetchall()
-
-                limit_entry = False
-                retrieved_len = len(observation)
-                if len(str(observation)) > self.max_str_len:
-                    if len(observation) > self.max_entry_return:
-                        observation = observation[: self.max_entry_return]
-                        limit_entry = True
-                if stringify:
-                    observation = str(observation)
-                    if limit_entry:
-                        observation = f"Retrieved {retrieved_len} entries. Displaying first {self.max_entry_return} entries.\n{observation}"
+                result = self._fetch_result(action, timeout)
+                observation = self._format_result(result, stringify)
             except Exception as e:
-                observation = f"{e.__class__.__name__}: {e.__context__}"
+                observation = self._format_error(e)
                 query_success = False
 
             reward = 0
             done = False
-            info = {}
+            info = {"query_stats": self._query_step_stats(result, observation)}
         else:
-            print("Warning: Maximum steps reached. Ending the episode.")
-            observation = ""
-            reward = 0
-            done = True
-            info = {}
-
+            observation, reward, done, info = self._max_steps_reached()
+
+        return self._record_step(action, observation, reward, done, info, query_success, submit)
+
+    def _format_result(self, result: dict, stringify: bool):
+        """Turn a fetched result into an observation, rendered with `observation_format` if `stringify`."""
+        observation = result["rows"]
+        if stringify:
+            rows = result["rows"]
+            # results cached before column names were kept have none
+            render = lambda rows: self.render_rows(rows, result.get("columns"))
+            if self.max_obs_tokens is None:
+                observation, num_shown = render(rows), len(rows)
+            else:
+                observation, num_shown = fit_token_budget(rows, render, self.max_obs_tokens)
+            if result["limited"] or num_shown < len(rows):
+                retrieved = result["retrieved"] if result["exact_count"] else f"at least {result['retrieved']}"
+                observation = f"Retrieved {retrieved} entries. Displaying first {num_shown} entries.\n{observation}"
+        return observation
+
+    @staticmethod
+    def _format_error(e: Exception) -> str:
+        if isinstance(e, TimeoutError):
+            return f"{e.__class__.__name__}: {e}"
+        return f"{e.__class__.__name__}: {e.__context__}"
+
+    def _query_step_stats(self, result: Union[dict, None], observation) -> dict:
+        """Resource accounting of the last query, recorded in the step info."""
+        stats = dict(self.last_query_stats)
+        stats["rows_returned"] = 0 if result is None else result["retrieved"]
+        stats["observation_bytes"] = len(str(observation).encode("utf-8"))
+        return stats
+
+    def _max_steps_reached(self) -> Tuple[str, float, bool, Dict]:
+        print("Warning: Maximum steps reached. Ending the episode.")
+        return "", 0, True, {}
+
+    def _record_step(self, action, observation, reward, done, info, query_success, submit):
+        """Count the step and add it to the current trajectory."""
         self.step_count += 1
 
         info.update({"query_success": query_success, "submit": submit})
@@ -298,6 +626,7 @@ class ExcytinEnv(gym.Env):
             observation = self._all_questions[idx]
 
         self.curr_question = observation
+        self.curr_qid = idx
         self.step_count = 0
         self.curr_trajectory = []
 
@@ -311,8 +640,14 @@ class ExcytinEnv(gym.Env):
         pass
 
     def close(self):
-        """Close the environment."""
-        self.connection.close()
+        """Close the environment.
+
+        The connection pool is shared with other envs on the same container and stays open,
+        use `secgym.connection_pool.close_all_pools` to close it.
+        """
+        if self.log_writer is not None:
+            self.save_logging()
+            self.log_writer.close()
 
     def _submit(self, answer: str) -> Tuple[np.ndarray, float, bool, Dict]:
         """Submit the answer and return the result.
@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import datetime
+from typing import Callable, List, Union
+
+OBSERVATION_FORMATS = ["repr", "tsv", "markdown"]
+
+_ENCODINGS = {}
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Count the tokens of a text with tiktoken, the encoding is loaded on first use."""
+    if encoding_name not in _ENCODINGS:
+        import tiktoken
+
+        _ENCODINGS[encoding_name] = tiktoken.get_encoding(encoding_name)
+    return len(_ENCODINGS[encoding_name].encode(text, disallowed_special=()))
+
+
+def format_value(value, max_col_width: Union[int, None] = None) -> str:
+    """Plain text form of a database value: no quotes, datetimes as ISO strings, NULL for None."""
+    if value is None:
+        text = "NULL"
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        text = value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    elif isinstance(value, (bytes, bytearray)):
+        text = value.decode("utf-8", errors="replace")
+    else:
+        text = str(value)
+    # one row per line, one cell per column
+    text = text.replace("\t", " ").replace("\r", " ").replace("\n", " ")
+    if max_col_width is not None and len(text) > max_col_width:
+        text = text[: max_col_width - 3] + "..."
+    return text
+
+
+def _split_constant_columns(columns: List[str], cells: List[List[str]]):
+    """Pull out the columns that have the same value in every row."""
+    if len(cells) < 2:
+        return columns, cells, []
+    keep = [i for i in range(len(columns)) if any(row[i] != cells[0][i] for row in cells)]
+    constants = [(columns[i], cells[0][i]) for i in range(len(columns)) if i not in keep]
+    return [columns[i] for i in keep], [[row[i] for i in keep] for row in cells], constants
+
+
+def _merge_repeated_rows(cells: List[List[str]]):
+    """Merge consecutive identical rows, returns the rows and how often each one repeats."""
+    merged, counts = [], []
+    for row in cells:
+        if len(merged) > 0 and row == merged[-1]:
+            counts[-1] += 1
+        else:
+            merged.append(row)
+            counts.append(1)
+    return merged, counts
+
+
+def _render_table(columns: List[str], cells: List[List[str]], markdown: bool) -> str:
+    if markdown:
+        escape = lambda s: s.replace("|", "\\|")
+        lines = ["| " + " | ".join(escape(c) for c in columns) + " |", "|" + "---|" * len(columns)]
+        lines += ["| " + " | ".join(escape(c) for c in row) + " |" for row in cells]
+    else:
+        lines = ["\t".join(columns)] + ["\t".join(row) for row in cells]
+    return "\n".join(lines)
+
+
+def render_table(
+    rows: list,
+    columns: Union[List[str], None] = None,
+    markdown: bool = False,
+    max_col_width: Union[int, None] = 200,
+    dedup: bool = True,
+) -> str:
+    """Render rows as a TSV or markdown table with a header.
+
+    Args:
+        rows (list): The rows, as tuples.
+        columns (list, optional): The column names, `col1`, `col2`... if unknown.
+        markdown (bool): Markdown table instead of tab separated values.
+        max_col_width (int, optional): Cells longer than this are cut, None to keep them whole.
+        dedup (bool): Show columns with the same value in every row once above the table,
+            and merge consecutive identical rows into one with a `repeated` count.
+    """
+    if len(rows) == 0:
+        return "(no rows)"
+    if columns is None or len(columns) != len(rows[0]):
+        columns = [f"col{i + 1}" for i in range(len(rows[0]))]
+    cells = [[format_value(v, max_col_width) for v in row] for row in rows]
+    columns = list(columns)
+
+    header = []
+    if dedup:
+        columns, cells, constants = _split_constant_columns(columns, cells)
+        if len(constants) > 0:
+            header.append("Same in all rows: " + "; ".join(f"{c}={v}" for c, v in constants))
+        cells, counts = _merge_repeated_rows(cells)
+        if any(c > 1 for c in counts):
+            columns.append("repeated")
+            cells = [row + [str(c)] for row, c in zip(cells, counts)]
+    if len(columns) == 0:
+        return "\n".join(header)
+    return "\n".join(header + [_render_table(columns, cells, markdown)])
+
+
+def render_repr(rows: list) -> str:
+    """The Python repr of the rows, as ExcytinEnv always returned them."""
+    return "[" + ", ".join(str(row) for row in rows) + "]"
+
+
+def get_renderer(
+    observation_format: str = "repr",
+    max_col_width: Union[int, None] = 200,
+    dedup: bool = True,
+) -> Callable[[list, Union[List[str], None]], str]:
+    """Get a function that renders (rows, columns) as an observation string."""
+    if observation_format == "repr":
+        return lambda rows, columns: render_repr(rows)
+    if observation_format in ["tsv", "markdown"]:
+        markdown = observation_format == "markdown"
+        return lambda rows, columns: render_table(rows, columns, markdown, max_col_width, dedup)
+    raise ValueError(f"Invalid observation format: {observation_format}, please choose from {OBSERVATION_FORMATS}.")
+
+
+def fit_token_budget(rows: list, render: Callable[[list], str], max_tokens: int):
+    """Render as many leading rows as fit in `max_tokens` tokens.
+
+    Returns:
+        Tuple[str, int]: The rendered text and the number of rows in it (at least one if there are rows).
+    """
+    text = render(rows)
+    if len(rows) <= 1 or count_tokens(text) <= max_tokens:
+        return text, len(rows)
+    # the token count grows with the number of rows, search for the largest prefix that fits
+    low, high = 1, len(rows) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(render(rows[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return render(rows[:low]), low
@@ -0,0 +1,241 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Tuple, Union
+
+# quoted literals and identifiers are kept verbatim when normalizing a query
+QUOTED_LITERAL = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)")
+_READ_ONLY = ("select", "with", "show", "describe", "desc")
+# statements that write, or a SELECT writing its result (INTO OUTFILE/DUMPFILE/@var); INSERT() and REPLACE() are also string functions
+WRITE_KEYWORDS = re.compile(
+    r"\b(?:into|update|delete|create|alter|drop|truncate|rename|grant|revoke|lock|unlock|call|handler|load|set|"
+    r"prepare|execute|deallocate)\b|\b(?:insert|replace)\b(?!\s*\()",
+    re.IGNORECASE,
+)
+# results that change from one run to the next on the same data
+NONDETERMINISTIC = re.compile(
+    r"\b(?:now|sysdate|curdate|curtime|utc_date|utc_time|utc_timestamp|rand|random|uuid|uuid_short|"
+    r"connection_id|last_insert_id|found_rows|row_count|sleep|benchmark|get_lock|is_free_lock|is_used_lock|"
+    r"user|current_user|session_user|system_user|database|schema)\s*\("
+    r"|\b(?:current_date|current_time|current_timestamp|localtime|localtimestamp|current_user)\b"
+    r"|\bunix_timestamp\s*\(\s*\)"
+    r"|@"  # session and user variables
+    r"|^show\s+(?:full\s+)?processlist\b|^show\s+(?:global\s+|session\s+)?(?:status|variables)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a SQL query so trivially different spellings share one cache entry.
+
+    Whitespace outside of quoted literals is collapsed and trailing semicolons are removed.
+    """
+    parts = QUOTED_LITERAL.split(query.strip())
+    for i in range(0, len(parts), 2):  # even parts are outside of quotes
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _unquoted(query: str) -> str:
+    # quoted literals and identifiers are left out, e.g. a column named `now`
+    return " ".join(QUOTED_LITERAL.split(query.strip())[::2])
+
+
+def is_read_only(query: str) -> bool:
+    """Whether a statement only reads: it starts with SELECT, WITH, SHOW or DESCRIBE, and has no INTO or
+    write keyword outside of quotes (e.g. `WITH ... DELETE` or `SELECT ... INTO OUTFILE`)."""
+    words = query.split(None, 1)
+    if len(words) == 0 or words[0].lower() not in _READ_ONLY:
+        return False
+    return WRITE_KEYWORDS.search(_unquoted(query)) is None
+
+
+def is_cacheable(query: str) -> bool:
+    """Only read-only statements whose result only depends on the data are cached."""
+    return is_read_only(query) and NONDETERMINISTIC.search(_unquoted(query)) is None
+
+
+def _to_json(value: Any) -> Any:
+    """Tag the values JSON has no type for, so that `_from_json` gives back the same rows."""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    if isinstance(value, tuple):
+        return {"tuple": [_to_json(v) for v in value]}
+    if isinstance(value, dict):
+        return {"dict": {str(k): _to_json(v) for k, v in value.items()}}
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    if isinstance(value, time):
+        return {"time": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"timedelta": value.total_seconds()}
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot cache a value of type {type(value).__name__}.")
+
+
+_FROM_JSON = {
+    "tuple": lambda v: tuple(_from_json(x) for x in v),
+    "dict": lambda v: {k: _from_json(x) for k, x in v.items()},
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "timedelta": lambda v: timedelta(seconds=v),
+    "decimal": Decimal,
+    "bytes": base64.b64decode,
+}
+
+
+def _from_json(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if isinstance(value, dict):
+        (tag, inner), = value.items()
+        return _FROM_JSON[tag](inner)
+    return value
+
+
+def dump_result(value: Any) -> str:
+    """Serialize a query result (rows of plain values, or the dict of `ResultCollector.result`) as JSON."""
+    return json.dumps(_to_json(value))
+
+
+def load_result(data: str) -> Any:
+    """Inverse of `dump_result`. Unlike unpickling, loading a planted cache file cannot run code."""
+    return _from_json(json.loads(data))
+
+
+def database_identity(location: str, layer: str, build_id: str) -> str:
+    """Identity of a database in the cache keys: where it is served from, the layer and the build of its data.
+
+    The log and alert layers can be served by the same container and database name, and a container can be
+    rebuilt (or have rows merged into it) with the same name, so neither the location nor the layer alone is enough.
+    """
+    return f"{location}@{layer}#{build_id}"
+
+
+class QueryCache:
+    """LRU cache of query results with a byte budget.
+
+    Keys are (database identity, normalized SQL), see `database_identity`. The incident databases are
+    read-only during evaluation, so a result can be reused across resets and across envs.
+    If `disk_path` is given, entries are also written to a SQLite file that other processes can read.
+    Results are stored as JSON (see `dump_result`), a result that cannot be is not cached.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entry_bytes: int = 16 * 1024 * 1024,
+        disk_path: Union[str, None] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_path = disk_path
+
+        self._entries = OrderedDict()  # key -> (serialized value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._disk = None
+        if disk_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, timeout=30, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_results (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._disk.commit()
+
+    @staticmethod
+    def make_key(database: str, query: str) -> str:
+        return f"{database}\n{normalize_query(query)}"
+
+    def get(self, database: str, query: str) -> Tuple[bool, Any]:
+        """Look up a query, returns (hit, value)."""
+        key = self.make_key(database, query)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, load_result(self._entries[key][0])
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value FROM query_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    try:
+                        value = load_result(row[0])
+                    except (TypeError, ValueError, KeyError):
+                        value = None  # not written by `put`
+                    if value is not None:
+                        self._insert(key, row[0])
+                        self.hits += 1
+                        return True, value
+            self.misses += 1
+            return False, None
+
+    def put(self, database: str, query: str, value: Any) -> None:
+        """Store the result of a successful query."""
+        try:
+            data = dump_result(value)
+        except TypeError:
+            return
+        if len(data) > self.max_entry_bytes:
+            return
+        key = self.make_key(database, query)
+        with self._lock:
+            self._insert(key, data)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO query_results (key, value) VALUES (?, ?)", (key, data)
+                )
+                self._disk.commit()
+
+    def _insert(self, key: str, data: bytes) -> None:
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+        self._entries[key] = (data, len(data))
+        self._size += len(data)
+        while self._size > self.max_bytes and len(self._entries) > 0:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM query_results")
+                self._disk.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_DEFAULT_CACHE = None
+
+
+def get_default_query_cache() -> QueryCache:
+    """The process-wide cache shared by all envs that do not pass their own."""
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = QueryCache(disk_path=os.environ.get("SECGYM_QUERY_CACHE"))
+    return _DEFAULT_CACHE
@@ -0,0 +1,248 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from queue import Queue, Empty
+from typing import Callable, Dict, Union
+
+from secgym.query_cache import QUOTED_LITERAL
+
+# MySQL statements without a SQLite equivalent, rewritten to queries with the same output columns
+_SHOW_TABLES = re.compile(r"^show\s+(?:full\s+)?tables(?:\s+(?:from|in)\s+\S+)?$", re.IGNORECASE)
+_SHOW_DATABASES = re.compile(r"^show\s+(?:databases|schemas)$", re.IGNORECASE)
+_DESCRIBE = re.compile(
+    r"^(?:describe|desc|show\s+(?:full\s+)?(?:columns|fields)\s+(?:from|in))\s+`?(\w+)`?(?:\s+(?:from|in)\s+\S+)?$",
+    re.IGNORECASE,
+)
+_SHOW_CREATE_TABLE = re.compile(r"^show\s+create\s+table\s+`?(\w+)`?$", re.IGNORECASE)
+_NO_RESULT = re.compile(r"^(?:use\s+\S+|set\s+.*)$", re.IGNORECASE | re.DOTALL)
+# LEFT/RIGHT are join keywords in SQLite and cannot be called as functions
+_KEYWORD_FUNCTIONS = re.compile(r"\b(LEFT|RIGHT)\s*\(", re.IGNORECASE)
+
+
+def translate_mysql_query(query: str, database_name: str = "env_monitor_db") -> Union[str, None]:
+    """Rewrite the MySQL-only statements agents commonly use into SQLite.
+
+    Returns None for statements that should be accepted but have no result (`USE`, `SET`).
+    Other queries are passed through, standard SQL, backticks and `LIMIT a, b` work as is in SQLite.
+    """
+    stripped = query.strip().rstrip(";").strip()
+    if _NO_RESULT.match(stripped):
+        return None
+    if _SHOW_TABLES.match(stripped):
+        return (
+            f"SELECT name AS Tables_in_{database_name} FROM sqlite_master "
+            "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )
+    if _SHOW_DATABASES.match(stripped):
+        return f"SELECT '{database_name}' AS Database"
+    match = _DESCRIBE.match(stripped)
+    if match:
+        return (
+            "SELECT name AS Field, CASE WHEN type = '' THEN 'text' ELSE lower(type) END AS Type, "
+            "CASE WHEN \"notnull\" THEN 'NO' ELSE 'YES' END AS \"Null\", "
+            "CASE WHEN pk THEN 'PRI' ELSE '' END AS \"Key\", dflt_value AS \"Default\", '' AS Extra "
+            f"FROM pragma_table_info('{match.group(1)}')"
+        )
+    match = _SHOW_CREATE_TABLE.match(stripped)
+    if match:
+        return f"SELECT name AS \"Table\", sql AS \"Create Table\" FROM sqlite_master WHERE name = '{match.group(1)}'"
+
+    parts = QUOTED_LITERAL.split(query)
+    for i in range(0, len(parts), 2):  # even parts are outside of quotes
+        parts[i] = _KEYWORD_FUNCTIONS.sub(lambda m: f"MYSQL_{m.group(1).upper()}(", parts[i])
+    return "".join(parts)
+
+
+def _regexp(pattern, value):
+    if pattern is None or value is None:
+        return None
+    return re.search(pattern, str(value), re.IGNORECASE) is not None
+
+
+def _concat(*args):
+    if any(a is None for a in args):
+        return None
+    return "".join(str(a) for a in args)
+
+
+def _locate(substr, value, pos=1):
+    if substr is None or value is None:
+        return None
+    return str(value).find(str(substr), int(pos) - 1) + 1
+
+
+def _substring_index(value, delim, count):
+    if value is None or delim is None or count is None:
+        return None
+    parts = str(value).split(str(delim))
+    count = int(count)
+    if count >= 0:
+        return str(delim).join(parts[:count])
+    return str(delim).join(parts[count:])
+
+
+def _register_mysql_functions(connection: sqlite3.Connection) -> None:
+    """Register MySQL functions missing from SQLite."""
+    connection.create_function("REGEXP", 2, _regexp, deterministic=True)
+    connection.create_function("CONCAT", -1, _concat, deterministic=True)
+    connection.create_function("LOCATE", 2, _locate, deterministic=True)
+    connection.create_function("LOCATE", 3, _locate, deterministic=True)
+    connection.create_function("SUBSTRING_INDEX", 3, _substring_index, deterministic=True)
+    connection.create_function("LCASE", 1, lambda x: None if x is None else str(x).lower(), deterministic=True)
+    connection.create_function("UCASE", 1, lambda x: None if x is None else str(x).upper(), deterministic=True)
+    connection.create_function("MYSQL_LEFT", 2, lambda x, n: None if x is None else str(x)[: int(n)], deterministic=True)
+    connection.create_function("MYSQL_RIGHT", 2, lambda x, n: None if x is None else (str(x)[-int(n):] if int(n) > 0 else ""), deterministic=True)
+    connection.create_function("NOW", 0, lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+
+class SQLiteCursor:
+    """Cursor with the subset of the mysql.connector cursor API used by ExcytinEnv."""
+
+    def __init__(self, cursor: sqlite3.Cursor, database_name: str):
+        self._cursor = cursor
+        self._database_name = database_name
+        self._has_result = True
+
+    @property
+    def description(self):
+        return self._cursor.description if self._has_result else None
+
+    @property
+    def column_names(self):
+        description = self.description
+        return tuple(d[0] for d in description) if description is not None else ()
+
+    def execute(self, query: str):
+        translated = translate_mysql_query(query, self._database_name)
+        self._has_result = translated is not None
+        if translated is not None:
+            self._cursor.execute(translated)
+
+    def fetchmany(self, size: int) -> list:
+        return self._cursor.fetchmany(size) if self._has_result else []
+
+    def fetchall(self) -> list:
+        return self._cursor.fetchall() if self._has_result else []
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Wraps a read-only sqlite3 connection to look like a mysql.connector connection."""
+
+    unread_result = False
+
+    def __init__(self, connection: sqlite3.Connection, database_name: str):
+        self._connection = connection
+        self._database_name = database_name
+
+    def cursor(self) -> SQLiteCursor:
+        return SQLiteCursor(self._connection.cursor(), self._database_name)
+
+    def consume_results(self) -> None:
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    def interrupt(self) -> None:
+        self._connection.interrupt()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class SQLiteConnectionPool:
+    """Pool of read-only connections to an embedded database file, same interface as `ConnectionPool`.
+
+    The file is opened immutable and memory-mapped, so any number of processes can read it at once.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        database_name: str = "env_monitor_db",
+        pool_size: int = 8,
+        mmap_size: int = 1 << 30,
+    ):
+        self.db_path = db_path
+        self.database_name = database_name
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self._idle = Queue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self) -> SQLiteConnection:
+        connection = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        connection.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        _register_mysql_functions(connection)
+        return SQLiteConnection(connection, self.database_name)
+
+    def acquire(self) -> SQLiteConnection:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def release(self, connection: SQLiteConnection, before_reuse: Union[Callable[[], None], None] = None) -> None:
+        if before_reuse is not None:
+            before_reuse()
+        self._idle.put(connection)
+        self._slots.release()
+
+    def cancel(self, connection: SQLiteConnection) -> None:
+        """Abort the statement running on a borrowed connection."""
+        connection.interrupt()
+
+    @staticmethod
+    def rows_examined(connection: SQLiteConnection) -> None:
+        """Not tracked by SQLite."""
+        return None
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
+_POOLS: Dict[str, SQLiteConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_sqlite_pool(db_path: str, database_name: str = "env_monitor_db", pool_size: int = 8) -> SQLiteConnectionPool:
+    """Get the process-wide pool for a database file, creating it on first use."""
+    with _POOLS_LOCK:
+        if db_path not in _POOLS:
+            _POOLS[db_path] = SQLiteConnectionPool(db_path, database_name=database_name, pool_size=pool_size)
+        return _POOLS[db_path]
+
+
+def close_all_sqlite_pools() -> None:
+    """Close the idle connections of every pool in this process."""
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
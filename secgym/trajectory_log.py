@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import gzip
+import json
+import os
+import zlib
+from typing import BinaryIO, Iterator, List, Tuple, Union
+
+
+def is_jsonl_file(path: Union[str, None]) -> bool:
+    return path is not None and (path.endswith(".jsonl") or path.endswith(".jsonl.gz"))
+
+
+class TrajectoryLogWriter:
+    """Append-only JSON Lines log of episodes with an index for resume.
+
+    Each episode is one line in `path`, so saving costs the same no matter how many episodes are logged.
+    If `path` ends with `.gz`, each line is written as its own gzip member, the file stays a valid gzip
+    stream and every record can still be read on its own.
+
+    The index `<path>.idx` has one JSON line per record with its qid, byte offset and length. On open,
+    only the index is read; records missing from it (e.g. the index was lost or not synced) are indexed
+    again by scanning the data file after the last indexed record, and a record cut short by a crash is
+    truncated away. Records are fsynced every `fsync_every` appends and on `close`.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 10):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.compress = path.endswith(".gz")
+        self.fsync_every = fsync_every
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        self.index = self._recover()
+        self._file = open(self.path, "ab")
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+        self._unsynced = 0
+
+    def _recover(self) -> List[dict]:
+        """Read the index, index the complete records after it and drop an incomplete last record."""
+        index = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # partially written last line
+                    index.append(entry)
+        data_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        while len(index) > 0 and index[-1]["offset"] + index[-1]["length"] > data_size:
+            index.pop()
+        end = index[-1]["offset"] + index[-1]["length"] if len(index) > 0 else 0
+
+        if data_size > end:
+            with open(self.path, "rb") as f:
+                f.seek(end)
+                for length, record in self._scan_records(f):
+                    qid = record.get("qid") if isinstance(record, dict) else None
+                    index.append({"qid": qid, "offset": end, "length": length})
+                    end += length
+        if data_size > end:
+            print(f"Warning: Dropping an incomplete record of {data_size - end} bytes at the end of {self.path}.")
+            with open(self.path, "ab") as f:
+                f.truncate(end)
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            for entry in index:
+                f.write(json.dumps(entry) + "\n")
+        return index
+
+    def _scan_records(self, f: BinaryIO) -> Iterator[Tuple[int, dict]]:
+        """Yield the length and content of each complete record from the current position of `f`."""
+        if not self.compress:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield len(line), json.loads(line)
+                except json.JSONDecodeError:
+                    return
+            return
+
+        data = memoryview(f.read())
+        position = 0
+        while position < len(data):
+            # each record is its own gzip member
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                line = decompressor.decompress(data[position:])
+                record = json.loads(line) if decompressor.eof and line.endswith(b"\n") else None
+            except (zlib.error, json.JSONDecodeError):
+                return
+            if record is None:
+                return
+            length = len(data) - position - len(decompressor.unused_data)
+            yield length, record
+            position += length
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def qids(self) -> List[Union[int, None]]:
+        """The question indices of the logged episodes, in order."""
+        return [entry["qid"] for entry in self.index]
+
+    def append(self, record: dict, qid: Union[int, None] = None) -> None:
+        data = (json.dumps(record) + "\n").encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data)
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        entry = {"qid": qid, "offset": offset, "length": len(data)}
+        self._index_file.write(json.dumps(entry) + "\n")
+        self._index_file.flush()
+        self.index.append(entry)
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """Flush the log and the index to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+        self._unsynced = 0
+
+    def read(self, i: int) -> dict:
+        """Read the i-th record without parsing the rest of the file."""
+        entry = self.index[i]
+        with open(self.path, "rb") as f:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+        if self.compress:
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+            self._index_file.close()
+
+
+def read_trajectory_log(path: str) -> Iterator[dict]:
+    """Iterate over the records of a JSON Lines log written by `TrajectoryLogWriter`."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
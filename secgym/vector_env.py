@@ -0,0 +1,145 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from secgym.evaluator import LLMEvaluator
+from secgym.excytin_env import ExcytinEnv, _DEFAULT
+
+
+class VectorExcytinEnv:
+    """N independent episodes over one incident database, stepped as a batch.
+
+    Each slot is an `ExcytinEnv` on the same attack; all of them borrow connections from the same
+    pool and share the query cache and the evaluator. `step` takes one action per slot and runs the
+    queries (and the evaluation of submissions) concurrently, so a tick costs about as much as its
+    slowest action instead of the sum of all of them:
+
+        venv = VectorExcytinEnv(attack, evaluator=evaluator, num_envs=8, save_file="env.jsonl")
+        observations, infos = venv.reset(list(range(8)))
+        observations, rewards, dones, infos = venv.step(actions, submits)
+        observation, info = venv.reset_at(i, next_idx)  # refill a slot whose episode is done
+
+    A slot whose action is None is not stepped, e.g. because it is idle or waiting for its LLM call.
+    Finished episodes of all slots are logged to the single `save_file`, in the order they end.
+    """
+
+    def __init__(
+        self,
+        attack: Union[str, int],
+        evaluator: LLMEvaluator,
+        num_envs: int = 4,
+        save_file: Union[str, bool] = True,
+        **kwargs,  # passed on to ExcytinEnv
+    ):
+        if num_envs < 1:
+            raise ValueError("num_envs should be at least 1.")
+        self.num_envs = num_envs
+        kwargs.setdefault("pool_size", num_envs)
+        # the first slot owns the save file, the logs of the other slots are handed over to it
+        self.envs = [ExcytinEnv(attack, evaluator=evaluator, save_file=save_file, **kwargs)]
+        self.envs += [
+            ExcytinEnv(attack, evaluator=evaluator, save_file=False, **kwargs) for _ in range(num_envs - 1)
+        ]
+        self.attack = self.envs[0].attack
+        self.num_questions = self.envs[0].num_questions
+        self.max_steps = self.envs[0].max_steps
+        self.save_file = self.envs[0].save_file
+        self._executor = ThreadPoolExecutor(max_workers=num_envs)
+
+    def getAllQuestions(self) -> List[dict]:
+        return self.envs[0].getAllQuestions()
+
+    @property
+    def active(self) -> np.ndarray:
+        """Whether each slot has an episode, i.e. has been reset at least once."""
+        return np.array([env.curr_question is not None for env in self.envs])
+
+    def reset(self, idxs: List[Union[int, None]], save_log=True) -> Tuple[List, List[Dict]]:
+        """Reset the slots to the given questions.
+
+        Args:
+            idxs (list): One question index per slot, None to leave a slot as it is.
+            save_log (bool): Whether to save the logs of the episodes that end here.
+
+        Returns:
+            Tuple[List, List[Dict]]: The observation and info of each slot, None for slots that are left as they are.
+        """
+        self._check_batch(idxs, "idxs")
+        futures = [
+            None if idx is None else self._executor.submit(env.reset, idx, False)
+            for env, idx in zip(self.envs, idxs)
+        ]
+        results = [None if f is None else f.result() for f in futures]
+        self._collect_logs(save_log)
+        observations = [None if r is None else r[0] for r in results]
+        infos = [None if r is None else r[1] for r in results]
+        return observations, infos
+
+    def reset_at(self, i: int, idx: int, save_log=True) -> Tuple[str, Dict]:
+        """Reset a single slot, e.g. to start the next question when its episode is done."""
+        observation, info = self.envs[i].reset(idx, save_log=False)
+        self._collect_logs(save_log)
+        return observation, info
+
+    def step(
+        self, actions: List[Union[str, None]], submits: Union[List[bool], None] = None, stringify=True, timeout=_DEFAULT
+    ) -> Tuple[List, np.ndarray, np.ndarray, List[Dict]]:
+        """Take a step in every slot that has an action, concurrently. See `ExcytinEnv.step`.
+
+        Args:
+            actions (list): One action per slot, None to skip a slot.
+            submits (list, optional): One submit flag per slot. Defaults to no submissions.
+
+        Returns:
+            Tuple[List, np.ndarray, np.ndarray, List[Dict]]: The observations, rewards, done flags and infos.
+                Skipped slots have a None observation, reward 0, done False and info {"skipped": True}.
+        """
+        self._check_batch(actions, "actions")
+        if submits is None:
+            submits = [False] * self.num_envs
+        self._check_batch(submits, "submits")
+
+        futures = [
+            None if action is None else self._executor.submit(env.step, action, submit, stringify, timeout)
+            for env, action, submit in zip(self.envs, actions, submits)
+        ]
+        observations, rewards, dones, infos = [], np.zeros(self.num_envs), np.zeros(self.num_envs, dtype=bool), []
+        for i, future in enumerate(futures):
+            if future is None:
+                observations.append(None)
+                infos.append({"skipped": True})
+                continue
+            observation, reward, done, info = future.result()
+            observations.append(observation)
+            rewards[i] = reward
+            dones[i] = done
+            infos.append(info)
+        return observations, rewards, dones, infos
+
+    def _check_batch(self, batch: list, name: str) -> None:
+        if len(batch) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} {name}, one per env, got {len(batch)}.")
+
+    def _collect_logs(self, save_log: bool) -> None:
+        """Hand the finished episodes of all slots to the first one, which owns the save file."""
+        owner = self.envs[0]
+        for env in self.envs[1:]:
+            owner.all_logs.extend(env.all_logs)
+            env.all_logs = []
+        if save_log:
+            owner.save_logging()
+
+    def close(self):
+        """Log the episodes still in progress and close all slots."""
+        for env in self.envs:
+            if len(env.curr_trajectory) != 0:
+                env.all_logs.append(env.get_logging())
+                env.curr_trajectory = []
+        self._collect_logs(save_log=True)
+        for env in self.envs:
+            env.close()
+        self._executor.shutdown()
@@ -0,0 +1,40 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import sqlite3
+
+import pytest
+
+from secgym.sqlite_backend import close_all_sqlite_pools
+
+# the tables `ExcytinEnv.check_layer` expects in the alert layer, plus one log table
+ALERT_TABLES = ["AlertEvidence", "AlertInfo", "SecurityAlert", "SigninLogs"]
+
+
+def write_sqlite_db(path, tables):
+    connection = sqlite3.connect(path)
+    for table_name, rows in tables.items():
+        connection.execute(f"CREATE TABLE {table_name} (TimeGenerated TEXT, Name TEXT)")
+        connection.executemany(f"INSERT INTO {table_name} VALUES (?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def build_sqlite_db():
+    """Build a database file for the sqlite backend, by default with `ALERT_TABLES` of a few rows each."""
+    def build(path, tables=None):
+        if tables is None:
+            tables = {
+                table_name: [("2024-06-20", "alice"), ("2024-06-21", "bob"), ("2024-06-22", "carol")]
+                for table_name in ALERT_TABLES
+            }
+        write_sqlite_db(path, tables)
+        return str(path)
+    return build
+
+
+@pytest.fixture(autouse=True)
+def close_sqlite_pools():
+    yield
+    close_all_sqlite_pools()
@@ -0,0 +1,172 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import asyncio
+
+import pytest
+
+from secgym import async_env
+from secgym.async_env import AsyncExcytinEnv
+from secgym.excytin_env import ExcytinEnv
+
+QUERIES = ["SELECT Name FROM SigninLogs", "SHOW TABLES", "SELECT * FROM MissingTable", "SCHEMA"]
+
+
+def make_env(env_class, db_file, **kwargs):
+    return env_class(
+        "incident_5", evaluator=None, save_file=False, backend="sqlite", db_file=db_file, query_cache=False, **kwargs
+    )
+
+
+def test_astep_and_areset_match_step_and_reset(tmp_path, build_sqlite_db):
+    db_file = build_sqlite_db(tmp_path / "incident_5.db")
+    sync_env = make_env(ExcytinEnv, db_file)
+    async_env = make_env(AsyncExcytinEnv, db_file)
+
+    async def run_episode():
+        question = await async_env.areset(idx=1)
+        steps = [await async_env.astep(query) for query in QUERIES]
+        return question, steps
+
+    question, steps = asyncio.run(run_episode())
+    assert question == sync_env.reset(idx=1)
+    for query, (observation, reward, done, info) in zip(QUERIES, steps):
+        expected = sync_env.step(query)
+        assert (observation, reward, done) == expected[:3]
+        assert info["query_success"] == expected[3]["query_success"]
+    assert [step["action"] for step in async_env.curr_trajectory] == QUERIES
+
+
+class FakeCursor:
+    """Unbuffered cursor over `rows`, executing in `delay` seconds unless the query is killed."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.closed = False
+
+    async def execute(self, query):
+        await asyncio.sleep(self.connection.delay)
+        if self.connection.killed:
+            raise RuntimeError("Query execution was interrupted")
+        if query.upper().startswith("SELECT"):
+            self.description = [("Name",)]
+
+    async def fetchmany(self, size):
+        rows, self.connection.rows = self.connection.rows[:size], self.connection.rows[size:]
+        return rows
+
+    async def fetchall(self):
+        rows, self.connection.rows = self.connection.rows, []
+        return rows
+
+    async def close(self):
+        # aiomysql reads the rest of the result here
+        self.connection.drained = True
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, num_rows=3, delay=0.0):
+        self.rows = [(f"user{i}",) for i in range(num_rows)]
+        self.delay = delay
+        self.killed = False
+        self.drained = False
+        self.closed = False
+
+    def thread_id(self):
+        return 42
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+        self.released = []
+
+    async def acquire(self):
+        return self.connection
+
+    def release(self, connection):
+        self.released.append(connection)
+
+
+class KillRecorder:
+    def __init__(self, connection):
+        self.connection = connection
+        self.killed = []
+
+    def kill_query(self, connection_id):
+        self.killed.append(connection_id)
+        self.connection.killed = True
+
+
+@pytest.fixture
+def mysql_env(tmp_path, build_sqlite_db, monkeypatch):
+    """An async env whose MySQL queries go to `FakeConnection`, returns (env, connection, pool, kills)."""
+    env = make_env(AsyncExcytinEnv, build_sqlite_db(tmp_path / "incident_5.db"), track_rows_examined=False)
+
+    def use(connection):
+        pool = FakePool(connection)
+
+        async def get_pool(*args, **kwargs):
+            return pool
+
+        monkeypatch.setattr(async_env, "get_async_connection_pool", get_pool)
+        env.backend = "mysql"
+        env.pool = KillRecorder(connection)
+        return env, connection, pool, env.pool.killed
+
+    return use
+
+
+def test_timeout_kills_the_query(mysql_env):
+    env, connection, pool, killed = mysql_env(FakeConnection(delay=0.5))
+    with pytest.raises(TimeoutError):
+        asyncio.run(env._afetch_result("SELECT Name FROM SigninLogs", timeout=0.05))
+    assert killed == [42]
+    assert env.last_query_stats["timed_out"]
+    assert pool.released == [connection]
+
+
+@pytest.mark.parametrize("timeout", [None, 0])
+def test_timeout_none_or_zero_disables_the_limit(mysql_env, timeout):
+    env, connection, pool, killed = mysql_env(FakeConnection(delay=0.2))
+    env.query_timeout = 0.05
+    result = asyncio.run(env._afetch_result("SELECT Name FROM SigninLogs", timeout=timeout))
+    assert result["retrieved"] == 3
+    assert killed == []
+
+
+def test_partly_read_result_is_killed_not_drained(mysql_env):
+    env, connection, pool, killed = mysql_env(FakeConnection(num_rows=50))
+    env.max_entry_return, env.max_str_len, env.max_count_rows, env.fetch_size = 2, 10, 4, 2
+    result = asyncio.run(env._afetch_result("SELECT Name FROM SigninLogs"))
+    assert not result["exact_count"]
+    assert killed == [42]
+    assert not connection.drained
+    assert connection.closed
+    assert pool.released == [connection]
+
+
+def test_fully_read_select_goes_back_to_the_pool(mysql_env):
+    env, connection, pool, killed = mysql_env(FakeConnection(num_rows=3))
+    result = asyncio.run(env._afetch_result("SELECT Name FROM SigninLogs"))
+    assert result["retrieved"] == 3 and result["exact_count"]
+    assert killed == []
+    assert not connection.closed
+    assert pool.released == [connection]
+
+
+@pytest.mark.parametrize("query", ["SET SESSION MAX_EXECUTION_TIME=0", "USE other_db", "SELECT @x := 1"])
+def test_connection_whose_session_may_have_changed_is_closed(mysql_env, query):
+    env, connection, pool, killed = mysql_env(FakeConnection(num_rows=1))
+    asyncio.run(env._afetch_result(query))
+    assert killed == []
+    assert connection.closed
+    assert pool.released == [connection]
@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import re
+import threading
+import time
+
+import pytest
+
+from secgym.database import bulk_loader
+from secgym.database.bulk_loader import bulk_load
+
+SESSION_FLAGS = ["SET SESSION unique_checks = 0", "SET SESSION foreign_key_checks = 0", "SET SESSION sql_log_bin = 0"]
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self.warning_count = 0
+
+    def execute(self, sql):
+        sql = " ".join(sql.split())
+        if sql.startswith("LOAD DATA"):
+            time.sleep(0.05)  # long enough for the other workers to open their own connections
+            self.rowcount = 10
+        self.connection.log.append((self.connection, sql))
+        self.connection.statements.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, log):
+        self.log = log
+        self.statements = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class Connections(list):
+    pass
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """The connections opened by `bulk_load`, their statements are also logged in order in `connections.log`."""
+    opened = Connections()
+    opened.log = []
+    lock = threading.Lock()
+
+    def connect(**kwargs):
+        connection = FakeConnection(opened.log)
+        with lock:
+            opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(bulk_loader.mysql.connector, "connect", connect)
+    return opened
+
+
+@pytest.fixture
+def csv_folder(tmp_path):
+    """SigninLogs as one file, DeviceEvents as a folder of three chunks of different sizes."""
+    (tmp_path / "SigninLogs.csv").write_text("TimeGenerated❖Name\n" + "2024-06-20❖alice\n")
+    (tmp_path / "SigninLogs.meta").write_text(json.dumps({"TimeGenerated": "datetime", "Name": "string"}))
+    (tmp_path / "DeviceEvents").mkdir()
+    (tmp_path / "DeviceEvents" / "DeviceEvents_0.meta").write_text(json.dumps({"DeviceName": "string"}))
+    for i, num_rows in enumerate([8, 20, 10]):
+        (tmp_path / "DeviceEvents" / f"DeviceEvents_{i}.csv").write_text("DeviceName\n" + "host\n" * num_rows)
+    return str(tmp_path)
+
+
+def loaded_files(statements):
+    return [m.group(1) for sql in statements for m in [re.search(r"mysql-files/(\S+)'", sql)] if m is not None]
+
+
+def test_every_worker_connection_gets_the_session_flags(csv_folder, connections):
+    bulk_load(csv_folder, "env_monitor_db", skip_tables=[], num_workers=3, verbose=False)
+    assert len(connections) > 1
+    for connection in connections:
+        assert connection.statements[:3] == SESSION_FLAGS
+        assert connection.closed
+    assert sorted(loaded_files(sql for _, sql in connections.log)) == [
+        "DeviceEvents/DeviceEvents_0.csv", "DeviceEvents/DeviceEvents_1.csv", "DeviceEvents/DeviceEvents_2.csv",
+        "SigninLogs.csv",
+    ]
+
+
+def test_one_job_per_chunk_largest_first(csv_folder, connections):
+    stats = bulk_load(csv_folder, "env_monitor_db", skip_tables=[], num_workers=1, verbose=False)
+    assert loaded_files(connections[0].statements) == [
+        "DeviceEvents/DeviceEvents_1.csv", "DeviceEvents/DeviceEvents_2.csv", "DeviceEvents/DeviceEvents_0.csv",
+        "SigninLogs.csv",
+    ]
+    assert stats["DeviceEvents"]["rows"] == 30
+    assert stats["SigninLogs"]["rows"] == 10
+
+
+def test_only_files_loads_the_given_chunks(csv_folder, connections):
+    stats = bulk_load(
+        csv_folder, "env_monitor_db", skip_tables=[], only_files=["DeviceEvents/DeviceEvents_2.csv"], verbose=False
+    )
+    assert loaded_files(sql for _, sql in connections.log) == ["DeviceEvents/DeviceEvents_2.csv"]
+    assert list(stats) == ["DeviceEvents"]
+
+
+def test_indexes_are_built_after_the_last_chunk(csv_folder, connections):
+    index_plan = {"DeviceEvents": [["DeviceName"]], "SigninLogs": [["Name"], ["TimeGenerated"]]}
+    bulk_load(csv_folder, "env_monitor_db", skip_tables=[], num_workers=3, index_plan=index_plan, verbose=False)
+    log = [sql for _, sql in connections.log]
+    for table_name, num_indexes in [("DeviceEvents", 1), ("SigninLogs", 2)]:
+        loads = [i for i, sql in enumerate(log) if sql.startswith("LOAD DATA") and f"INTO TABLE {table_name}" in sql]
+        indexes = [i for i, sql in enumerate(log) if sql.startswith("CREATE INDEX") and f"ON `{table_name}`" in sql]
+        assert len(indexes) == num_indexes
+        assert min(indexes) > max(loads)
+
@@ -0,0 +1,123 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from secgym.connection_pool import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query):
+        self.connection.statements.append(query)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, fail_reset=False, reset_supported=True):
+        self.fail_reset = fail_reset
+        self.reset_supported = reset_supported
+        self.statements = []
+        self.unread_result = False
+        self.consumed = False
+        self.connected = True
+        self.connection_id = 7
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_connected(self):
+        return self.connected
+
+    def cmd_reset_connection(self):
+        if self.fail_reset:
+            raise RuntimeError("reset failed")
+        if not self.reset_supported:
+            return False
+        self.statements.append("RESET")
+        return True
+
+    def consume_results(self):
+        self.consumed = True
+        self.unread_result = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(connection, pool_size=1):
+    pool = ConnectionPool(port=3306, database_name="env_monitor_db", pool_size=pool_size, max_execution_time=1000)
+    pool._connect = lambda: connection
+    return pool
+
+
+def test_release_resets_the_session():
+    connection = FakeConnection()
+    pool = make_pool(connection)
+    with pool.connection() as borrowed:
+        borrowed.cursor().execute("USE other_db")
+        borrowed.cursor().execute("SET SESSION MAX_EXECUTION_TIME=1")
+    assert connection.statements[2:] == ["RESET", "SET SESSION MAX_EXECUTION_TIME=1000", "USE env_monitor_db;"]
+    assert pool.acquire() is connection
+
+
+def test_release_closes_a_connection_that_cannot_be_reset():
+    connection = FakeConnection(fail_reset=True)
+    pool = make_pool(connection)
+    pool.release(pool.acquire())
+    assert connection.closed
+    assert pool._idle.empty()
+    # the slot is given back
+    replacement = FakeConnection()
+    pool._connect = lambda: replacement
+    assert pool.acquire() is replacement
+
+
+def test_session_is_not_configured_again_without_a_reset():
+    # e.g. a server older than 5.7.3
+    connection = FakeConnection(reset_supported=False)
+    pool = make_pool(connection)
+    with pool.connection() as borrowed:
+        borrowed.cursor().execute("USE other_db")
+    assert connection.statements == ["USE other_db"]
+    assert connection.closed
+    assert pool._idle.empty()
+
+
+def test_connections_released_after_close_are_closed():
+    borrowed, idle = FakeConnection(), FakeConnection()
+    pool = make_pool(borrowed, pool_size=2)
+    pool.acquire()
+    pool._idle.put(idle)
+    pool.close()
+    assert idle.closed
+    pool.release(borrowed)
+    assert borrowed.closed
+    assert "RESET" not in borrowed.statements
+    assert pool._idle.empty()
+
+
+def test_release_discards_a_connection_with_unread_rows():
+    connection = FakeConnection()
+    pool = make_pool(connection)
+    killed = []
+    pool.kill_query = killed.append
+    connection.unread_result = True
+    pool.release(pool.acquire())
+    assert killed == [7]
+    assert connection.closed
+    assert not connection.consumed
+    assert "RESET" not in connection.statements
+    assert pool._idle.empty()
+
+
+def test_before_reuse_runs_before_the_connection_is_handed_out():
+    connection = FakeConnection()
+    pool = make_pool(connection)
+    seen = []
+    pool.release(pool.acquire(), before_reuse=lambda: seen.append(pool._idle.qsize()))
+    assert seen == [0]
+    assert pool._idle.qsize() == 1
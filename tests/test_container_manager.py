@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import socket
+
+import pytest
+from docker.errors import NotFound
+
+from secgym.database import container_manager
+from secgym.database.container_manager import ContainerManager, probe_mysql, wait_until_ready
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def test_probe_fails_fast_on_a_closed_port():
+    assert not probe_mysql(free_port(), connect_timeout=0.5)
+
+
+class FakeContainer:
+    def __init__(self, name, port, status="running", statuses=()):
+        self.name = name
+        self.status = status
+        self.started = False
+        self._statuses = list(statuses)  # status after each reload
+        self.attrs = {"HostConfig": {"PortBindings": {"3306/tcp": [{"HostIp": "", "HostPort": str(port)}]}}}
+
+    def reload(self):
+        if len(self._statuses) > 0:
+            self.status = self._statuses.pop(0)
+
+    def start(self):
+        self.started = True
+        self.status = "running"
+
+
+def failing_probes(monkeypatch, num_failures):
+    """Make the first `num_failures` probes fail, returns the probe count and the sleeps."""
+    probes, sleeps = [], []
+
+    def probe(*args, **kwargs):
+        probes.append(args)
+        return len(probes) > num_failures
+
+    monkeypatch.setattr(container_manager, "probe_mysql", probe)
+    monkeypatch.setattr(container_manager.time, "sleep", sleeps.append)
+    return probes, sleeps
+
+
+def test_wait_until_ready_backs_off_exponentially(monkeypatch):
+    probes, sleeps = failing_probes(monkeypatch, 5)
+    wait_until_ready("3306", initial_interval=0.1, max_interval=0.5)
+    assert len(probes) == 6
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+
+
+def test_wait_until_ready_times_out(monkeypatch):
+    failing_probes(monkeypatch, 100)
+    with pytest.raises(TimeoutError):
+        wait_until_ready("3306", timeout=-1)
+
+
+def test_wait_until_ready_stops_when_the_container_exits(monkeypatch):
+    probes, _ = failing_probes(monkeypatch, 100)
+    container = FakeContainer("incident_5", 3306, statuses=["running", "exited"])
+    with pytest.raises(RuntimeError, match="exited"):
+        wait_until_ready("3306", container=container)
+    assert len(probes) == 2
+
+
+class FakeDockerClient:
+    def __init__(self, containers):
+        self.containers = self
+        self._containers = {container.name: container for container in containers}
+
+    def get(self, name):
+        if name not in self._containers:
+            raise NotFound(name)
+        return self._containers[name]
+
+
+def make_manager(monkeypatch, containers, probe=True):
+    monkeypatch.setattr(container_manager, "probe_mysql", lambda *args, **kwargs: probe)
+    manager = ContainerManager()
+    manager._client = FakeDockerClient(containers)
+    return manager
+
+
+def test_stopped_container_is_started_even_if_another_one_answers_on_its_port(monkeypatch):
+    # the alert_only container is running on the port shared with the alert container
+    alert = FakeContainer("incident_5", 3306, status="exited")
+    manager = make_manager(monkeypatch, [alert, FakeContainer("incident_5_alert_only", 3306)])
+    manager.ensure_ready("incident_5", "3306")
+    assert alert.started
+    assert manager.status("incident_5")["ready"]
+
+
+def test_container_published_on_another_port_is_not_ready(monkeypatch):
+    manager = make_manager(monkeypatch, [FakeContainer("incident_5", 3307)])
+    with pytest.raises(ValueError, match="3307"):
+        manager.ensure_ready("incident_5", "3306")
+    manager.register("incident_5", "3306")
+    assert not manager.status("incident_5")["ready"]
+
+
+def test_missing_container_is_only_accepted_when_external(monkeypatch):
+    manager = make_manager(monkeypatch, [])
+    with pytest.raises(ValueError, match="does not exist"):
+        manager.ensure_ready("incident_5", "3306")
+    assert not manager.status("incident_5")["ready"]
+
+    manager.register("incident_5", "3306", external=True)
+    manager.ensure_ready("incident_5")
+    assert manager.status("incident_5")["ready"]
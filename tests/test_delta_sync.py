@@ -0,0 +1,75 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import os
+
+import docker
+import pandas as pd
+import pytest
+
+from secgym.database.bulk_loader import check_csv_mount
+from secgym.database.delta_sync import files_high_water_mark, list_tables, merge_delta
+from secgym.database.log_io import write_log_table
+
+TYPE_MAP = {"TimeGenerated": "datetime", "Name": "string"}
+
+
+def write_table(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_log_table(pd.DataFrame(rows, columns=list(TYPE_MAP)), path)
+
+
+def test_merge_moves_the_delta_in_as_new_chunks(tmp_path):
+    folder, delta = str(tmp_path / "incident_5"), str(tmp_path / "incident_5_delta" / "sync")
+    write_table(os.path.join(folder, "SigninLogs.csv"), [["2024-06-20T00:00:00Z", "alice"]])
+    with open(os.path.join(folder, "SigninLogs.meta"), "w") as f:
+        json.dump(TYPE_MAP, f)
+    write_table(os.path.join(delta, "SigninLogs", "SigninLogs_20240621.csv"), [["2024-06-21T00:00:00Z", "bob"]])
+
+    added = merge_delta(delta, folder, verbose=False)
+    assert added == ["SigninLogs/SigninLogs_20240621.csv"]
+    assert list_tables(folder) == {"SigninLogs": ["SigninLogs/SigninLogs_0.csv", "SigninLogs/SigninLogs_20240621.csv"]}
+    assert os.path.exists(os.path.join(folder, "SigninLogs", "SigninLogs_0.meta"))
+    high_water_mark, _ = files_high_water_mark(folder, list_tables(folder)["SigninLogs"], TYPE_MAP)
+    assert high_water_mark == pd.Timestamp("2024-06-21T00:00:00Z")
+
+
+class FakeContainer:
+    def __init__(self, port, mounts):
+        self.name = "incident_5"
+        self.attrs = {
+            "HostConfig": {"PortBindings": {"3306/tcp": [{"HostIp": "", "HostPort": port}]}},
+            "Mounts": [{"Destination": destination, "Source": source} for destination, source in mounts.items()],
+        }
+
+
+class FakeDockerClient:
+    def __init__(self, containers):
+        self.containers = self
+        self._containers = containers
+
+    def list(self):
+        return self._containers
+
+
+@pytest.mark.parametrize("mounts, error", [
+    ({"/var/lib/mysql": "/snapshots/incident_5.tar.incident_5.d/mysql"}, "does not mount a CSV folder"),
+    ({"/var/lib/mysql-files": "/data/incident_5"}, "mounts /data/incident_5"),
+    ({}, "does not mount a CSV folder"),
+])
+def test_check_csv_mount_rejects_containers_without_the_folder(tmp_path, monkeypatch, mounts, error):
+    monkeypatch.setattr(docker, "from_env", lambda: FakeDockerClient([FakeContainer("3306", mounts)]))
+    with pytest.raises(ValueError, match=error):
+        check_csv_mount(str(tmp_path), "3306")
+
+
+def test_check_csv_mount_accepts_the_mounted_folder(tmp_path, monkeypatch):
+    containers = [
+        FakeContainer("3307", {"/var/lib/mysql-files": "/elsewhere"}),
+        FakeContainer("3306", {"/var/lib/mysql-files": str(tmp_path)}),
+    ]
+    monkeypatch.setattr(docker, "from_env", lambda: FakeDockerClient(containers))
+    check_csv_mount(str(tmp_path), "3306")
+    with pytest.raises(ValueError, match="No running container"):
+        check_csv_mount(str(tmp_path), "3310")
@@ -0,0 +1,90 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import glob
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from azure.monitor.query import LogsQueryStatus
+
+from secgym.database import download_logs
+from secgym.database.log_io import read_log_table
+
+T0 = datetime(2024, 6, 20, 12, 0, 0, tzinfo=timezone.utc)
+
+
+class FakeTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = ["TimeGenerated", "Name"]
+        self.columns_types = ["datetime", "string"]
+
+
+class FakeResponse:
+    def __init__(self, rows=None, error=None):
+        self.status = LogsQueryStatus.SUCCESS if error is None else LogsQueryStatus.PARTIAL
+        self.partial_error = error
+        self.tables = [FakeTable(rows or [])]
+
+
+class FakeClient:
+    """Answers the segmented query: the first `rn <= end` rows of the window, ordered by TimeGenerated."""
+
+    def __init__(self, rows, errors=0):
+        self.rows = sorted(rows, key=lambda row: row[0])
+        self.errors = errors
+
+    def query_workspace(self, workspace_id, query, timespan=None):
+        if self.errors > 0:
+            self.errors -= 1
+            return FakeResponse(error="Response size too large")
+        end = int(re.search(r"rn <= (\d+)", query).group(1))
+        rows = [list(row) for row in self.rows if timespan[0] <= row[0] < timespan[1]]
+        return FakeResponse(rows[:end])
+
+
+def download(tmp_path, monkeypatch, client, row_per_query, total_count, total_size):
+    monkeypatch.setattr(
+        download_logs, "check_segemented_query",
+        lambda *args, **kwargs: (True, row_per_query, total_count, total_size)
+    )
+    timespan = (T0 - timedelta(minutes=1), T0 + timedelta(hours=1))
+    download_logs.query_and_save_data("workspace", "SigninLogs", timespan, str(tmp_path), client=client)
+    files = sorted(glob.glob(os.path.join(tmp_path, "SigninLogs", "SigninLogs_*.csv")))
+    return [name for f in files for name in read_log_table(f)["Name"]]
+
+
+def test_rows_with_the_time_of_a_cut_off_are_kept(tmp_path, monkeypatch):
+    rows = [
+        (T0, "first"),
+        (T0 + timedelta(seconds=1), "tie-1"),
+        (T0 + timedelta(seconds=1), "tie-2"),
+        (T0 + timedelta(seconds=2), "last"),
+    ]
+    names = download(tmp_path, monkeypatch, FakeClient(rows), row_per_query=2, total_count=4, total_size=400)
+    assert names == ["first", "tie-1", "tie-2", "last"]
+
+
+def test_error_with_a_zero_count_keeps_the_row_limit(tmp_path, monkeypatch):
+    rows = [(T0, "first"), (T0 + timedelta(seconds=1), "second")]
+    # the count was taken before the rows arrived
+    names = download(tmp_path, monkeypatch, FakeClient(rows, errors=1), row_per_query=5, total_count=0, total_size=0)
+    assert names == ["first", "second"]
+
+
+def test_parquet_table_gets_a_new_chunk_on_append(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    monkeypatch.setattr(download_logs, "check_segemented_query", lambda *args, **kwargs: (False, 10, 1, 100))
+
+    class Client:
+        def query_workspace(self, workspace_id, query, timespan=None):
+            return FakeResponse([[T0, "new"]])
+
+    (tmp_path / "SigninLogs.parquet").write_bytes(b"existing")
+    (tmp_path / "SigninLogs.meta").write_text('{"TimeGenerated": "datetime", "Name": "string"}')
+    download_logs.query_and_save_data("workspace", "SigninLogs", timedelta(days=1), str(tmp_path), append=True, client=Client())
+
+    assert (tmp_path / "SigninLogs" / "SigninLogs_0.parquet").read_bytes() == b"existing"
+    assert read_log_table(str(tmp_path / "SigninLogs" / "SigninLogs_1.parquet"))["Name"].tolist() == ["new"]
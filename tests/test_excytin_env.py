@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import os
+import time
+
+import pytest
+
+from secgym import excytin_env
+from secgym.excytin_env import ExcytinEnv
+from secgym.query_cache import QueryCache
+from secgym.sqlite_backend import close_all_sqlite_pools, get_sqlite_pool
+
+
+def make_env(db_file, layer="alert", query_cache=True, **kwargs):
+    return ExcytinEnv(
+        "incident_5", evaluator=None, save_file=False, backend="sqlite", db_file=str(db_file), layer=layer,
+        query_cache=query_cache, **kwargs
+    )
+
+
+ALERT_TABLES = ["AlertEvidence", "AlertInfo", "SecurityAlert", "SigninLogs"]
+
+
+def test_cache_is_not_shared_across_layers_or_builds(tmp_path, build_sqlite_db):
+    db_file = tmp_path / "incident_5.db"
+    build_sqlite_db(db_file, {table_name: [("2024-06-20", "alice")] for table_name in ALERT_TABLES})
+    cache = QueryCache()
+    alert_env = make_env(db_file, layer="alert", query_cache=cache)
+    assert alert_env.execute_query("SELECT Name FROM SigninLogs")[0] == [("alice",)]
+
+    # the log layer built in place of the alert layer, under the same name, with other rows
+    close_all_sqlite_pools()
+    os.remove(db_file)
+    build_sqlite_db(db_file, {"SigninLogs": [("2024-06-21", "bob")]})
+    os.utime(db_file, ns=(1, 1))
+    log_env = make_env(db_file, layer="log", query_cache=cache)
+    assert log_env.database_id != alert_env.database_id
+    assert [row[0] for row in log_env.get_table_names()] == ["SigninLogs"]
+    assert log_env.execute_query("SELECT Name FROM SigninLogs")[0] == [("bob",)]
+    assert log_env.last_query_stats["cache_hit"] is False
+
+
+class SlowReleasePool:
+    """Delegates to a pool, taking `delay` seconds to release a connection."""
+
+    def __init__(self, pool, delay):
+        self.pool = pool
+        self.delay = delay
+        self.cancelled = []
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def cancel(self, connection):
+        self.cancelled.append(connection)
+
+    def release(self, connection, before_reuse=None):
+        time.sleep(self.delay)
+        self.pool.release(connection, before_reuse=before_reuse)
+
+
+def test_query_timeout_is_armed_until_the_connection_is_released(tmp_path, build_sqlite_db):
+    db_file = tmp_path / "incident_5.db"
+    build_sqlite_db(db_file, {table_name: [("2024-06-20", "alice")] for table_name in ALERT_TABLES})
+    env = make_env(db_file, query_cache=None)
+    env.pool = SlowReleasePool(env.pool, delay=0.3)
+    env._cached("SELECT Name FROM SigninLogs", env.database_id, env._fetch_all, timeout=0.1)
+    assert len(env.pool.cancelled) == 1
+
+    # once released, the connection may be reused by another env and is never cancelled
+    env.pool.delay = 0
+    env._cached("SELECT Name FROM SigninLogs", env.database_id, env._fetch_all, timeout=0.1)
+    time.sleep(0.2)
+    assert len(env.pool.cancelled) == 1
+
+
+@pytest.mark.parametrize("timeout, cancelled", [((), 1), ((None,), 0), ((0,), 0), ((0.1,), 1)])
+def test_step_timeout_none_or_zero_disables_the_limit(tmp_path, build_sqlite_db, timeout, cancelled):
+    db_file = tmp_path / "incident_5.db"
+    build_sqlite_db(db_file, {table_name: [("2024-06-20", "alice")] for table_name in ALERT_TABLES})
+    env = make_env(db_file, query_cache=None, query_timeout=0.1)
+    env.pool = SlowReleasePool(env.pool, delay=0.3)
+    env.reset(idx=0)
+    env.step("SELECT Name FROM SigninLogs", False, True, *timeout)
+    assert len(env.pool.cancelled) == cancelled
+
+
+def test_schema_catalog_only_describes_live_tables(tmp_path, build_sqlite_db):
+    db_file = tmp_path / "incident_5.db"
+    build_sqlite_db(db_file, {"SigninLogs": [("2024-06-20", "alice")]})
+    catalog_file = tmp_path / "incident_5.json"
+    columns = [{"name": "TimeGenerated", "type": "datetime"}, {"name": "Name", "type": "string"}]
+    with open(catalog_file, "w", encoding="utf-8") as f:
+        json.dump({"tables": {name: {"row_count": 1, "columns": columns} for name in ALERT_TABLES}}, f)
+
+    env = make_env(db_file, layer="log", query_cache=None, catalog_file=str(catalog_file))
+    assert list(env.schema_catalog["tables"]) == ["SigninLogs"]
+    assert env.describe_schema().startswith("1 tables:")
+    with pytest.raises(ValueError):
+        env.get_schema("SecurityAlert")
+
+
+def test_layer_views_connect_as_the_layer_user(tmp_path, build_sqlite_db, monkeypatch):
+    db_file = build_sqlite_db(tmp_path / "incident_5.db", {"SigninLogs": [("2024-06-20", "alice")]})
+    requested = []
+
+    def get_connection_pool(**kwargs):
+        requested.append(kwargs)
+        return get_sqlite_pool(db_file)
+
+    monkeypatch.setattr(excytin_env, "get_connection_pool", get_connection_pool)
+    env = ExcytinEnv(
+        "incident_5", evaluator=None, save_file=False, layer="log", layer_views=True, auto_start=False, query_cache=False
+    )
+    assert requested == [
+        {"port": "3306", "database_name": "env_monitor_db_log", "pool_size": 8, "user": "log_agent", "password": "admin"}
+    ]
+    assert env.execute_query("SELECT Name FROM SigninLogs")[0] == [("alice",)]
@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+
+from secgym.database.index_planner import (
+    generate_create_index_sql,
+    iter_logged_queries,
+    mine_filter_columns,
+    plan_indexes,
+)
+from secgym.trajectory_log import TrajectoryLogWriter
+
+TYPE_MAPS = {
+    "SigninLogs": {"UserPrincipalName": "string", "TimeGenerated": "datetime", "Status": "dynamic", "IPAddress": "string"},
+    "AlertInfo": {"AlertId": "string", "Title": "string"},
+}
+
+
+def log(*actions):
+    trajectory = [{"action": action, "info": {}} for action in actions]
+    return {"trajectory": trajectory + [{"action": "done", "info": {"submit": True}}]}
+
+
+def test_queries_are_read_from_json_and_jsonl_logs(tmp_path):
+    with open(tmp_path / "env_a.json", "w", encoding="utf-8") as f:
+        json.dump([log("SELECT 1")], f)
+    for name in ["env_b.jsonl", "env_c.jsonl.gz"]:
+        writer = TrajectoryLogWriter(str(tmp_path / name))
+        writer.append(log(f"SELECT '{name}'"), qid=0)
+        writer.close()
+    (tmp_path / "other.json").write_text(json.dumps([log("SELECT 'other'")]))
+
+    assert sorted(iter_logged_queries(str(tmp_path))) == ["SELECT 'env_b.jsonl'", "SELECT 'env_c.jsonl.gz'", "SELECT 1"]
+
+
+def test_plan_puts_composite_indexes_first_and_skips_dynamic_columns():
+    queries = 5 * [
+        "SELECT * FROM SigninLogs WHERE UserPrincipalName = 'a' AND TimeGenerated > '2024-01-01'",
+        "SELECT * FROM SigninLogs WHERE Status = 'x' AND IPAddress LIKE '%10.0'",
+        "SELECT * FROM AlertInfo WHERE Title = 'AlertId = 1'",
+    ]
+    column_counts, pair_counts = mine_filter_columns(queries, TYPE_MAPS)
+    # neither the literal nor the leading wildcard LIKE count as a filter
+    assert ("AlertInfo", "AlertId") not in column_counts
+    assert ("SigninLogs", "IPAddress") not in column_counts
+
+    plan = plan_indexes(TYPE_MAPS, column_counts, pair_counts)
+    assert plan == {
+        "SigninLogs": [["UserPrincipalName", "TimeGenerated"], ["TimeGenerated"]],
+        "AlertInfo": [["Title"]],
+    }
+
+
+def test_columns_below_min_count_are_not_indexed():
+    queries = 4 * ["SELECT * FROM AlertInfo WHERE AlertId = '1'"]
+    assert plan_indexes(TYPE_MAPS, *mine_filter_columns(queries, TYPE_MAPS)) == {}
+
+
+def test_create_index_sql():
+    columns = ["UserPrincipalName", "TimeGenerated"]
+    assert generate_create_index_sql("SigninLogs", columns, TYPE_MAPS["SigninLogs"]) == (
+        "CREATE INDEX `idx_UserPrincipalName_TimeGenerated` ON `SigninLogs` "
+        "(`UserPrincipalName`(64), `TimeGenerated`(64));"
+    )
+    assert generate_create_index_sql("SigninLogs", columns, TYPE_MAPS["SigninLogs"], typed=True) == (
+        "CREATE INDEX `idx_UserPrincipalName_TimeGenerated` ON `SigninLogs` "
+        "(`UserPrincipalName`(64), `TimeGenerated`);"
+    )
+
+
+def test_long_index_names_stay_distinct():
+    prefix = ["InitiatingProcessAccountObjectId", "InitiatingProcessCommandLine"]
+    names = set()
+    for last in ["Timestamp", "DeviceName"]:
+        sql = generate_create_index_sql("DeviceProcessEvents", prefix + [last], {})
+        name = sql.split("`")[1]
+        assert len(name) <= 64
+        names.add(name)
+    assert len(names) == 2
@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from secgym.database import log_downloader
+from secgym.database.log_downloader import LogDownloader
+from secgym.database.log_io import read_log_table
+
+T0 = datetime(2024, 6, 20, tzinfo=timezone.utc)
+END = T0 + timedelta(hours=12)
+
+
+class FakeTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = ["TimeGenerated", "Name"]
+        self.columns_types = ["datetime", "string"]
+
+
+class FakeResponse:
+    def __init__(self, status, rows=(), error=None):
+        self.status = status
+        self.partial_error = error
+        self.tables = [FakeTable(list(rows))]
+
+
+class ThrottledError(Exception):
+    status_code = 429
+
+
+class StubClient:
+    """One row per hour of the day, windows with more than `max_rows` rows come back truncated.
+
+    `errors` maps a window start to the exceptions its next queries raise, in order.
+    """
+
+    def __init__(self, max_rows=100, errors=None):
+        self.rows = [[T0 + timedelta(hours=h, minutes=30), f"user{h}"] for h in range(24)]
+        self.max_rows = max_rows
+        self.errors = errors or {}
+        self.windows = []
+
+    def query_workspace(self, workspace_id, query, timespan=None):
+        start, end = timespan
+        self.windows.append((start, end))
+        if len(self.errors.get(start, [])) > 0:
+            raise self.errors[start].pop(0)
+        rows = [row for row in self.rows if start <= row[0] < end]
+        if len(rows) > self.max_rows:
+            return FakeResponse("PARTIAL", rows[: self.max_rows], error="result truncated")
+        return FakeResponse("SUCCESS", rows)
+
+
+def make_downloader(tmp_path, client, **kwargs):
+    return LogDownloader("workspace", str(tmp_path / "logs"), client=client, max_workers=2, verbose=False, **kwargs)
+
+
+def downloaded_names(tmp_path):
+    folder = tmp_path / "logs" / "SigninLogs"
+    files = sorted(f for f in os.listdir(folder) if f.endswith(".csv"))
+    return [name for f in files for name in read_log_table(str(folder / f))["Name"]]
+
+
+def test_truncated_windows_are_split_until_they_fit(tmp_path):
+    client = StubClient(max_rows=2)
+    downloader = make_downloader(tmp_path, client, window=timedelta(hours=8))
+    rows = downloader.download(["SigninLogs"], T0, END)
+
+    assert rows == {"SigninLogs": 12}
+    assert downloaded_names(tmp_path) == [f"user{h}" for h in range(12)]
+    # 8 and 4 hour windows hold too many rows
+    assert downloader.manifest.get("SigninLogs", T0, T0 + timedelta(hours=8))["status"] == "split"
+    assert downloader.manifest.get("SigninLogs", T0, T0 + timedelta(hours=4))["status"] == "split"
+    assert downloader.manifest.get("SigninLogs", T0, T0 + timedelta(hours=2))["status"] == "done"
+    # the next run plans the halves directly
+    planned = downloader.plan(["SigninLogs"], T0, END)
+    assert [(end - start) for _, start, end in planned] == [timedelta(hours=2)] * 6
+
+
+def test_window_is_not_split_below_min_window(tmp_path):
+    downloader = make_downloader(tmp_path, StubClient(max_rows=0), window=timedelta(hours=1), min_window=timedelta(hours=1))
+    assert downloader.download(["SigninLogs"], T0, T0 + timedelta(hours=2)) == {"SigninLogs": 0}
+    assert downloader.manifest.get("SigninLogs", T0, T0 + timedelta(hours=1))["status"] == "failed"
+
+
+def test_resume_only_downloads_the_missing_windows(tmp_path):
+    make_downloader(tmp_path, StubClient()).download(["SigninLogs"], T0, END)
+
+    client = StubClient()
+    downloader = make_downloader(tmp_path, client)
+    assert downloader.download(["SigninLogs"], T0, END) == {"SigninLogs": 12}
+    assert client.windows == []
+
+    # a chunk that was removed (or changed) is downloaded again
+    entry = downloader.manifest.get("SigninLogs", T0 + timedelta(hours=6), END)
+    os.remove(tmp_path / "logs" / entry["file"])
+    assert make_downloader(tmp_path, client).download(["SigninLogs"], T0, END) == {"SigninLogs": 12}
+    assert client.windows == [(T0 + timedelta(hours=6), END)]
+    assert downloaded_names(tmp_path) == [f"user{h}" for h in range(12)]
+
+
+def test_failed_window_is_recorded_and_retried_by_the_next_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_downloader.time, "sleep", lambda seconds: None)
+    client = StubClient(errors={T0: [ThrottledError("Too many requests"), ValueError("Bad request")]})
+    downloader = make_downloader(tmp_path, client)
+    assert downloader.download(["SigninLogs"], T0, END) == {"SigninLogs": 6}
+    # retried once when throttled, then failed
+    assert client.windows.count((T0, T0 + timedelta(hours=6))) == 2
+    entry = downloader.manifest.get("SigninLogs", T0, T0 + timedelta(hours=6))
+    assert entry["status"] == "failed" and entry["error"] == "Bad request"
+
+    assert make_downloader(tmp_path, client).download(["SigninLogs"], T0, END) == {"SigninLogs": 12}
+
+
+def test_throttled_window_fails_after_max_retries(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(log_downloader.time, "sleep", sleeps.append)
+    client = StubClient(errors={T0: [ThrottledError("throttled")] * 3})
+    downloader = make_downloader(tmp_path, client, max_retries=3)
+    with pytest.raises(TimeoutError):
+        downloader.download_window("SigninLogs", T0, T0 + timedelta(hours=6))
+    assert len(sleeps) == 3
+    assert downloader.concurrency.limit == 1
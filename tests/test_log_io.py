@@ -0,0 +1,157 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import io
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from secgym.database.log_io import (
+    SENTINEL,
+    LogTableWriter,
+    SeparatorTranscoder,
+    apply_type_map,
+    csv_folder_to_parquet,
+    parquet_folder_to_csv,
+    read_log_table,
+    read_separated_csv,
+    read_type_map,
+    table_to_chunk_folder,
+)
+
+CONTENT = 'TimeGenerated❖Name❖Data\n2024-06-20❖alice❖"a❖b"\n2024-06-21❖bob❖"c"\n'
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "SigninLogs.csv"
+    path.write_text(CONTENT, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 5, 1 << 20])
+def test_transcoder_replaces_separators_cut_by_blocks(csv_path, block_size):
+    with io.BufferedReader(SeparatorTranscoder(csv_path, block_size=block_size)) as f:
+        assert f.read().decode("utf-8") == CONTENT.replace("❖", SENTINEL)
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_read_matches_the_python_parser(csv_path, engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow", exc_type=ImportError)
+    expected = pd.read_csv(csv_path, sep="❖", engine="python", dtype=str)
+    df = read_separated_csv(csv_path, engine=engine, dtype=str)
+    pd.testing.assert_frame_equal(df, expected)
+    assert df["Data"].tolist() == ["a❖b", "c"]
+
+
+def test_read_in_chunks(csv_path):
+    chunks = list(read_separated_csv(csv_path, chunksize=1, dtype=str))
+    assert [chunk["Name"].tolist() for chunk in chunks] == [["alice"], ["bob"]]
+
+
+def test_file_with_the_sentinel_falls_back_to_the_python_parser(tmp_path):
+    path = tmp_path / "SigninLogs.csv"
+    path.write_text(f"Name❖Data\nal{SENTINEL}ice❖1\n", encoding="utf-8")
+    df = read_separated_csv(str(path), dtype=str)
+    assert df["Name"].tolist() == [f"al{SENTINEL}ice"]
+
+
+PAGES = [
+    pd.DataFrame({"TimeGenerated": ["2024-06-21T00:00:00Z", "2024-06-20T00:00:00Z"], "Name": ["alice", "bob"], "Data": [{"a": 1}, None]}),
+    pd.DataFrame({"TimeGenerated": ["2024-06-22T00:00:00Z"], "Name": ["carol"], "Data": ['{"b": 2}']}),
+]
+TYPE_MAP = {"TimeGenerated": "datetime", "Name": "string", "Data": "dynamic"}
+
+
+def write_pages(path, pages, append=False):
+    with LogTableWriter(path, TYPE_MAP, append=append) as writer:
+        for page in pages:
+            writer.write(page)
+    return writer
+
+
+def test_csv_pages_are_appended(tmp_path):
+    path = str(tmp_path / "SigninLogs.csv")
+    write_pages(path, PAGES)
+    writer = write_pages(path, PAGES[::-1], append=True)
+    assert writer.num_rows == 3
+    assert (writer.min_time, writer.max_time) == (pd.Timestamp("2024-06-20", tz="UTC"), pd.Timestamp("2024-06-22", tz="UTC"))
+    df = read_log_table(path)
+    assert df["Name"].tolist() == ["alice", "bob", "carol", "carol", "alice", "bob"]
+    assert df["Data"].tolist() == ['{"a": 1}', "{}", '{"b": 2}', '{"b": 2}', '{"a": 1}', "{}"]
+
+
+def test_parquet_pages_are_row_groups(tmp_path):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    import pyarrow.parquet as pq
+
+    path = str(tmp_path / "SigninLogs.parquet")
+    write_pages(path, PAGES + PAGES)
+    assert pq.ParquetFile(path).num_row_groups == 4
+    assert read_log_table(path)["Name"].tolist() == ["alice", "bob", "carol", "alice", "bob", "carol"]
+
+
+def test_parquet_files_are_not_rewritten_to_append(tmp_path):
+    path = tmp_path / "SigninLogs.parquet"
+    path.write_bytes(b"PAR1")
+    with pytest.raises(ValueError, match="table_to_chunk_folder"):
+        LogTableWriter(str(path), TYPE_MAP, append=True)
+    assert path.read_bytes() == b"PAR1"
+
+
+def test_table_moves_to_its_first_chunk(tmp_path):
+    for extension in [".parquet", ".csv", ".meta"]:
+        (tmp_path / f"SigninLogs{extension}").write_text(extension)
+    (tmp_path / "AlertInfo.csv").write_text(".csv")
+
+    path = table_to_chunk_folder(str(tmp_path / "SigninLogs.parquet"))
+    assert path == str(tmp_path / "SigninLogs" / "SigninLogs_0.parquet")
+    assert sorted(os.listdir(tmp_path)) == ["AlertInfo.csv", "SigninLogs"]
+    for extension in [".parquet", ".csv", ".meta"]:
+        assert (tmp_path / "SigninLogs" / f"SigninLogs_0{extension}").read_text() == extension
+
+
+def test_apply_type_map():
+    df = pd.DataFrame({
+        "TimeGenerated": ["2024-06-20T10:00:00Z", "2024-06-20 11:00:00.5+00:00", ""],
+        "Count": ["3", "", "x"],
+        "Enabled": ["True", "false", ""],
+        "Data": ['{"a": 1}', "", None],
+        "Name": ["alice", None, 7],
+    })
+    typed = apply_type_map(df, {**TYPE_MAP, "Count": "long", "Enabled": "bool"})
+    assert typed["TimeGenerated"].tolist()[:2] == [
+        pd.Timestamp("2024-06-20 10:00:00", tz="UTC"), pd.Timestamp("2024-06-20 11:00:00.5", tz="UTC")
+    ]
+    assert pd.isna(typed["TimeGenerated"][2])
+    assert str(typed["Count"].dtype) == "Int64"
+    assert typed["Count"][0] == 3 and typed["Count"].isna().tolist() == [False, True, True]
+    assert typed["Enabled"].tolist()[:2] == [True, False] and pd.isna(typed["Enabled"][2])
+    assert typed["Data"].tolist() == ['{"a": 1}', "{}", "{}"]
+    assert typed["Name"].tolist()[0::2] == ["alice", "7"] and pd.isna(typed["Name"][1])
+
+
+def test_type_map_round_trips_through_parquet(tmp_path):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    csv_path = tmp_path / "SigninLogs.csv"
+    csv_path.write_text(CONTENT, encoding="utf-8")
+    (tmp_path / "SigninLogs.meta").write_text(json.dumps(TYPE_MAP))
+
+    assert csv_folder_to_parquet(str(tmp_path), remove_csv=True) == 1
+    parquet_path = str(tmp_path / "SigninLogs.parquet")
+    assert read_type_map(parquet_path) == TYPE_MAP
+    df = read_log_table(parquet_path)
+    assert str(df["TimeGenerated"].dtype).startswith("datetime64") and df["TimeGenerated"].dt.tz is not None
+    assert df["Data"].tolist() == ["a❖b", "c"]
+
+    # and back to the CSV the MySQL load reads, with the same values
+    os.remove(tmp_path / "SigninLogs.meta")
+    assert parquet_folder_to_csv(str(tmp_path)) == 1
+    assert json.loads((tmp_path / "SigninLogs.meta").read_text()) == TYPE_MAP
+    back = read_log_table(str(csv_path))
+    assert back["Name"].tolist() == ["alice", "bob"]
+    assert back["Data"].tolist() == ["a❖b", "c"]
+    assert pd.to_datetime(back["TimeGenerated"], utc=True).tolist() == df["TimeGenerated"].tolist()
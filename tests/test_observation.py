@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import datetime
+
+import pytest
+
+from secgym import observation
+from secgym.observation import fit_token_budget, get_renderer, render_table
+
+COLUMNS = ["TimeGenerated", "Account", "Host"]
+
+
+def test_constant_columns_are_pulled_out():
+    rows = [
+        (datetime.datetime(2024, 6, 20, 10, 0), "alice", "host1"),
+        (datetime.datetime(2024, 6, 20, 11, 0), "alice", "host1"),
+    ]
+    assert render_table(rows, COLUMNS) == (
+        "Same in all rows: Account=alice; Host=host1\n"
+        "TimeGenerated\n"
+        "2024-06-20 10:00:00\n"
+        "2024-06-20 11:00:00"
+    )
+
+
+def test_consecutive_repeated_rows_are_merged():
+    rows = [("t1", "alice", "host1"), ("t1", "alice", "host1"), ("t2", "bob", "host1"), ("t1", "alice", "host1")]
+    assert render_table(rows, COLUMNS, markdown=True) == (
+        "Same in all rows: Host=host1\n"
+        "| TimeGenerated | Account | repeated |\n"
+        "|---|---|---|\n"
+        "| t1 | alice | 2 |\n"
+        "| t2 | bob | 1 |\n"
+        "| t1 | alice | 1 |"
+    )
+
+
+def test_without_dedup_every_row_and_column_is_kept():
+    rows = [("t1", None, "a|b\tc"), ("t1", None, "a|b\tc")]
+    assert render_table(rows, COLUMNS, dedup=False) == (
+        "TimeGenerated\tAccount\tHost\n"
+        "t1\tNULL\ta|b c\n"
+        "t1\tNULL\ta|b c"
+    )
+    assert render_table(rows, COLUMNS, markdown=True, dedup=False).splitlines()[-1] == "| t1 | NULL | a\\|b c |"
+
+
+def test_single_row_and_long_cells():
+    assert render_table([("x" * 20,)], ["Data"], max_col_width=10) == "Data\nxxxxxxx..."
+    assert render_table([], COLUMNS) == "(no rows)"
+    assert render_table([(1, 2)], None) == "col1\tcol2\n1\t2"
+    assert get_renderer("repr")([(1, "a")], None) == "[(1, 'a')]"
+    with pytest.raises(ValueError):
+        get_renderer("html")
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Count words as tokens, returns the texts that were counted."""
+    counted = []
+
+    def count_tokens(text):
+        counted.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(observation, "count_tokens", count_tokens)
+    return counted
+
+
+@pytest.mark.parametrize("max_tokens", [1, 7, 50, 99, 100, 1000])
+def test_token_budget_keeps_the_largest_prefix_that_fits(word_tokens, max_tokens):
+    rows = [(f"user{i}", f"host{i}") for i in range(50)]
+    render = lambda rows: render_table(rows, ["Account", "Host"], dedup=False)
+    text, num_rows = fit_token_budget(rows, render, max_tokens)
+
+    # the header is 2 tokens and each row 2 more
+    expected = min(50, max(1, (max_tokens - 2) // 2))
+    assert num_rows == expected
+    assert text == render(rows[:expected])
+    if num_rows > 1:
+        assert len(text.split()) <= max_tokens
+    # a binary search over the row counts, not one render per row
+    assert len(word_tokens) <= 8
+
+
+def test_token_budget_keeps_one_row_even_if_it_does_not_fit(word_tokens):
+    rows = [("a " * 100,)]
+    assert fit_token_budget(rows, lambda rows: render_table(rows, ["Data"]), 5) == (render_table(rows, ["Data"]), 1)
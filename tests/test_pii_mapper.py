@@ -0,0 +1,46 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# pii_mapper is run as a script from secgym/database, next to process_logs
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "secgym", "database"))
+from secgym.database.pii_anony.pii_mapper import detect_pii, extract_pii  # noqa: E402
+
+VALUES = [
+    "alice@contoso.com",
+    "10.0.0.1",
+    "login from 10.0.0.1 by bob@contoso.com",
+    "fe80::1ff:fe23:4567:890a",
+    "00:1A:2B:3C:4D:5E",
+    "S-1-5-21-1004336348-1177238915-682003330-512",
+    "c9f2b9c2-8a3e-4c1f-9a5e-2f3b1c9d8e7f",
+    '{"latitude":47.6,"longitude":-122.3}',
+    "https://contoso-my.sharepoint.com/personal/alice_vnevado_alpineskihouse_co/Documents",
+    "MailItemsAccessed",
+    "josé@contoso.com",
+    "",
+    12345,
+]
+
+
+def test_extract_pii_matches_detect_pii():
+    result = extract_pii(VALUES + [None, "alice@contoso.com"])
+    assert len(result) == len(VALUES)
+    for value in VALUES:
+        kind, matches = detect_pii(value)
+        row = result.loc[str(value)]
+        assert (None if pd.isna(row["kind"]) else row["kind"]) == kind, value
+        assert row["matches"] == matches, value
+
+
+@pytest.mark.parametrize("value, kind", [
+    ("login from 10.0.0.1 by bob@contoso.com", "ip"),
+    ("MailItemsAccessed", None),
+])
+def test_detectors_run_in_priority_order(value, kind):
+    assert detect_pii(value)[0] == kind
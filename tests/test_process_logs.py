@@ -0,0 +1,17 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+
+from secgym.database.log_io import read_separated_csv
+from secgym.database.process_logs import process_csv
+
+
+def test_process_csv_fills_empty_dynamic_values(tmp_path):
+    with open(tmp_path / "SigninLogs.meta", "w") as f:
+        json.dump({"columns": ["Name", "Details"], "dtypes": ["string", "dynamic"]}, f)
+    (tmp_path / "SigninLogs.csv").write_text('Name❖Details\nalice❖\nbob❖"{""a"": 1}"\n', encoding="utf-8")
+
+    process_csv(str(tmp_path))
+    df = read_separated_csv(str(tmp_path / "SigninLogs.csv"), dtype=str)
+    assert df["Details"].tolist() == ["{}", '{"a": 1}']
@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import pickle
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from secgym.query_cache import QueryCache, database_identity, dump_result, is_cacheable, load_result, normalize_query
+
+UNPICKLED = []
+
+
+def record_unpickling():
+    UNPICKLED.append(True)
+
+
+class Planted:
+    def __reduce__(self):
+        return record_unpickling, ()
+
+
+def test_normalize_query_keeps_literals():
+    assert normalize_query("SELECT  *\n FROM t WHERE a = 'x  y' ;") == "SELECT * FROM t WHERE a = 'x  y'"
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM SecurityAlert",
+    "show tables;",
+    "DESCRIBE SigninLogs",
+    "SELECT * FROM t WHERE Account = 'user@domain.com'",
+    "SELECT `now` FROM t",
+    "SELECT * FROM t WHERE TimeGenerated > '2024-06-20' AND UserId = 'rand()'",
+    "SELECT REPLACE(Account, 'a', 'b'), INSERT(Name, 1, 2, 'x') FROM t",
+    "SELECT * FROM t WHERE Operation = 'Update' OR Note = 'insert into x'",
+    "WITH a AS (SELECT 1) SELECT * FROM a",
+])
+def test_cacheable(query):
+    assert is_cacheable(query)
+
+
+@pytest.mark.parametrize("query", [
+    "DROP TABLE t",
+    "INSERT INTO t VALUES (1)",
+    "SELECT * FROM t WHERE TimeGenerated > NOW() - INTERVAL 1 DAY",
+    "SELECT * FROM t ORDER BY RAND() LIMIT 5",
+    "select current_timestamp",
+    "SELECT UNIX_TIMESTAMP()",
+    "SELECT @@version",
+    "SELECT DATABASE()",
+    "SHOW PROCESSLIST",
+    "SHOW GLOBAL STATUS",
+    "WITH a AS (SELECT id FROM t) DELETE FROM t WHERE id IN (SELECT id FROM a)",
+    "WITH a AS (SELECT 1) UPDATE t SET x = 1",
+    "SELECT * FROM t INTO OUTFILE '/tmp/t.csv'",
+    "SELECT * FROM t INTO DUMPFILE '/tmp/t'",
+    "SELECT 1 INTO @x",
+    "SELECT * FROM t FOR UPDATE",
+    "EXPLAIN ANALYZE SELECT * FROM t",
+    "REPLACE INTO t VALUES (1)",
+])
+def test_not_cacheable(query):
+    assert not is_cacheable(query)
+
+
+def test_unix_timestamp_of_a_value_is_cacheable():
+    assert is_cacheable("SELECT UNIX_TIMESTAMP(TimeGenerated) FROM t")
+
+
+def test_keys_are_isolated_by_layer_and_build(tmp_path):
+    disk_path = str(tmp_path / "cache.db")
+    cache = QueryCache(disk_path=disk_path)
+    alert = database_identity("incident_5:3306/env_monitor_db", "alert", "build-1")
+    cache.put(alert, "SHOW TABLES", [("SecurityAlert",)])
+
+    # the log layer built under the same container, port and database name
+    log = database_identity("incident_5:3306/env_monitor_db", "log", "build-2")
+    rebuilt = database_identity("incident_5:3306/env_monitor_db", "alert", "build-3")
+    # a new process reading the persistent cache
+    other_process = QueryCache(disk_path=disk_path)
+    assert other_process.get(log, "SHOW TABLES") == (False, None)
+    assert other_process.get(rebuilt, "SHOW TABLES") == (False, None)
+    assert other_process.get(alert, "SHOW  TABLES;") == (True, [("SecurityAlert",)])
+
+
+def test_lru_eviction_by_bytes():
+    cache = QueryCache(max_bytes=400, max_entry_bytes=300)
+    cache.put("db", "SELECT 1", "x" * 150)
+    cache.put("db", "SELECT 2", "y" * 150)
+    cache.get("db", "SELECT 1")
+    cache.put("db", "SELECT 3", "z" * 150)
+    assert cache.get("db", "SELECT 2") == (False, None)
+    assert cache.get("db", "SELECT 1")[0]
+    cache.put("db", "SELECT 4", "w" * 1000)
+    assert cache.get("db", "SELECT 4") == (False, None)
+
+
+def test_results_round_trip_as_json():
+    result = {
+        "rows": [(1, "a", None, 1.5, datetime(2024, 6, 20, 1, 2, 3), Decimal("1.10"), b"\x00")],
+        "columns": ["a", "b", "c", "d", "e", "f", "g"],
+        "exact_count": True,
+    }
+    assert load_result(dump_result(result)) == result
+
+
+def test_planted_cache_file_is_not_unpickled(tmp_path):
+    disk_path = str(tmp_path / "cache.db")
+    QueryCache(disk_path=disk_path)
+    database = database_identity("incident_5:3306/env_monitor_db", "alert", "build-1")
+    connection = sqlite3.connect(disk_path)
+    connection.execute(
+        "INSERT INTO query_results (key, value) VALUES (?, ?)",
+        (QueryCache.make_key(database, "SHOW TABLES"), pickle.dumps(Planted())),
+    )
+    connection.commit()
+    connection.close()
+
+    assert QueryCache(disk_path=disk_path).get(database, "SHOW TABLES") == (False, None)
+    assert UNPICKLED == []
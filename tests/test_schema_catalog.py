@@ -0,0 +1,32 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import subprocess
+import sys
+
+from secgym.database.schema_catalog import DistinctCounter
+
+ESTIMATE_SCRIPT = """
+from secgym.database.schema_catalog import DistinctCounter
+counter = DistinctCounter(k=64)
+for i in range(5000):
+    counter.add(f"user{i}@contoso.com")
+print(counter.estimate())
+"""
+
+
+def test_distinct_count_is_exact_below_k():
+    counter = DistinctCounter(k=16)
+    for value in ["a", "b", "a", "c", "b"]:
+        counter.add(value)
+    assert counter.estimate() == 3
+
+
+def test_distinct_estimate_is_the_same_in_every_process():
+    # string hashes are salted per process unless PYTHONHASHSEED is set
+    estimates = {
+        subprocess.run([sys.executable, "-c", ESTIMATE_SCRIPT], capture_output=True, text=True, check=True).stdout
+        for _ in range(3)
+    }
+    assert len(estimates) == 1
+    assert abs(int(estimates.pop()) - 5000) < 5000 * 0.3
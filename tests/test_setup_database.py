@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import pytest
+
+from secgym.database.setup_database import (
+    dtype_to_sql,
+    generate_create_table_sql,
+    generate_layer_views_sql,
+    generate_typed_load_data_sql,
+    get_skip_tables,
+    layer_database_name,
+    layer_user,
+    sql_value_expression,
+)
+
+# the SET expression and the typed column of each type of the .meta files
+TYPED_COLUMNS = {
+    "string": ("NULLIF(@v0, '')", "TEXT"),
+    "bool": ("NULLIF(@v0, '')", "TEXT"),
+    "long": ("CAST(NULLIF(@v0, '') AS SIGNED)", "BIGINT"),
+    "datetime": (
+        "STR_TO_DATE(NULLIF(TRIM(TRAILING 'Z' FROM SUBSTRING_INDEX(REPLACE(@v0, 'T', ' '), '+', 1)), ''), "
+        "IF(LOCATE('.', @v0) > 0, '%Y-%m-%d %H:%i:%s.%f', '%Y-%m-%d %H:%i:%s'))",
+        "DATETIME(6)",
+    ),
+    "dynamic": ("IF(@v0 = '', '{}', IF(JSON_VALID(@v0), @v0, JSON_QUOTE(@v0)))", "JSON"),
+    "guid": ("NULLIF(@v0, '')", "TEXT"),  # not a type of the .meta files, loaded as a string
+}
+
+
+@pytest.mark.parametrize("dtype", list(TYPED_COLUMNS))
+def test_value_expression_matches_the_column_type(dtype):
+    expression, sql_type = TYPED_COLUMNS[dtype]
+    assert sql_value_expression("@v0", dtype) == expression
+    assert dtype_to_sql(dtype, typed=True) == sql_type
+    assert dtype_to_sql(dtype) == "TEXT"
+
+
+def test_typed_load_data_sql():
+    type_map = {"TimeGenerated": "datetime", "Count": "long", "Data": "dynamic", "Name": "string"}
+    assert generate_typed_load_data_sql("SigninLogs/SigninLogs_1.csv", "SigninLogs", type_map) == """
+LOAD DATA INFILE '/var/lib/mysql-files/SigninLogs/SigninLogs_1.csv'
+IGNORE INTO TABLE `SigninLogs`
+FIELDS TERMINATED BY '❖'
+ENCLOSED BY '"'
+LINES TERMINATED BY '\\n'
+IGNORE 1 ROWS
+(@v0, @v1, @v2, @v3)
+SET
+    `TimeGenerated` = STR_TO_DATE(NULLIF(TRIM(TRAILING 'Z' FROM SUBSTRING_INDEX(REPLACE(@v0, 'T', ' '), '+', 1)), ''), IF(LOCATE('.', @v0) > 0, '%Y-%m-%d %H:%i:%s.%f', '%Y-%m-%d %H:%i:%s')),
+    `Count` = CAST(NULLIF(@v1, '') AS SIGNED),
+    `Data` = IF(@v2 = '', '{}', IF(JSON_VALID(@v2), @v2, JSON_QUOTE(@v2))),
+    `Name` = NULLIF(@v3, '');
+"""
+
+
+def test_typed_create_table_sql():
+    type_map = {"TimeGenerated": "datetime", "Quantity": "long", "Data": "dynamic"}
+    assert generate_create_table_sql("Usage", type_map, typed=True) == (
+        "CREATE TABLE `Usage` (\n    TimeGenerated DATETIME(6),\n    Quantity BIGINT,\n    Data JSON\n);"
+    )
+
+
+def test_layer_views_only_expose_the_tables_of_the_layer():
+    tables = ["SigninLogs", "AlertInfo", "SecurityAlert", "AlertEvidence", "DeviceEvents"]
+    statements = generate_layer_views_sql("env_monitor_db", tables, "log", get_skip_tables("log", None))
+    assert layer_database_name("env_monitor_db", "log") == "env_monitor_db_log"
+    assert layer_database_name("env_monitor_db", "alert") == "env_monitor_db"
+    assert layer_user("log") == "log_agent"
+    assert statements == [
+        "CREATE DATABASE IF NOT EXISTS env_monitor_db_log;",
+        "CREATE USER IF NOT EXISTS 'log_agent'@'%' IDENTIFIED BY 'admin';",
+        "CREATE OR REPLACE SQL SECURITY DEFINER VIEW `env_monitor_db_log`.`DeviceEvents` AS SELECT * FROM `env_monitor_db`.`DeviceEvents`;",
+        "CREATE OR REPLACE SQL SECURITY DEFINER VIEW `env_monitor_db_log`.`SigninLogs` AS SELECT * FROM `env_monitor_db`.`SigninLogs`;",
+        "GRANT SELECT ON `env_monitor_db_log`.* TO 'log_agent'@'%';",
+        "GRANT SELECT ON `secgym_builds`.* TO 'log_agent'@'%';",
+        "GRANT SELECT ON performance_schema.events_statements_history TO 'log_agent'@'%';",
+    ]
+    # the user is never granted the database of the tables
+    assert not any("ON `env_monitor_db`." in sql for sql in statements if sql.startswith("GRANT"))
@@ -0,0 +1,32 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import tarfile
+
+from secgym.database.snapshot import extract_datadir
+
+
+def make_snapshot(tmp_path):
+    source = tmp_path / "mysql"
+    source.mkdir()
+    (source / "ibdata1").write_text("snapshot")
+    snapshot_path = str(tmp_path / "incident_5.tar")
+    with tarfile.open(snapshot_path, "w") as tar:
+        tar.add(source, arcname="mysql")
+    return snapshot_path
+
+
+def test_every_restore_gets_a_fresh_datadir(tmp_path):
+    snapshot_path = make_snapshot(tmp_path)
+    datadir = extract_datadir(snapshot_path, snapshot_path + ".incident_5.d")
+    # the server of the first container writes to its copy
+    with open(os.path.join(datadir, "ibdata1"), "w") as f:
+        f.write("written by the server")
+    open(os.path.join(datadir, "binlog.000001"), "w").close()
+
+    datadir = extract_datadir(snapshot_path, snapshot_path + ".incident_5.d")
+    assert sorted(os.listdir(datadir)) == ["ibdata1"]
+    with open(os.path.join(datadir, "ibdata1")) as f:
+        assert f.read() == "snapshot"
+    assert not os.path.exists(snapshot_path + ".incident_5.d.tmp")
@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import sqlite3
+
+import pytest
+
+from secgym.sqlite_backend import SQLiteConnectionPool, translate_mysql_query
+
+
+@pytest.fixture
+def pool(tmp_path):
+    db_path = str(tmp_path / "incident_5.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE SigninLogs (TimeGenerated TEXT, UserPrincipalName TEXT)")
+    connection.execute("INSERT INTO SigninLogs VALUES ('2024-06-20', 'alice@contoso.com')")
+    connection.commit()
+    connection.close()
+    pool = SQLiteConnectionPool(db_path)
+    yield pool
+    pool.close()
+
+
+def run(pool, query):
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def test_statements_without_a_result_are_accepted():
+    assert translate_mysql_query("USE env_monitor_db;") is None
+    assert translate_mysql_query("SET SESSION MAX_EXECUTION_TIME=1000") is None
+
+
+def test_keyword_functions_are_not_rewritten_in_literals():
+    assert translate_mysql_query("SELECT LEFT(a, 2) FROM t WHERE b = 'LEFT(x'") == (
+        "SELECT MYSQL_LEFT(a, 2) FROM t WHERE b = 'LEFT(x'"
+    )
+
+
+def test_show_and_describe(pool):
+    assert run(pool, "SHOW TABLES;") == [("SigninLogs",)]
+    assert run(pool, "SHOW DATABASES") == [("env_monitor_db",)]
+    assert [row[:2] for row in run(pool, "DESCRIBE `SigninLogs`")] == [
+        ("TimeGenerated", "text"), ("UserPrincipalName", "text")
+    ]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT SUBSTRING_INDEX(UserPrincipalName, '@', -1) FROM SigninLogs", "contoso.com"),
+    ("SELECT LEFT(UserPrincipalName, 5) FROM SigninLogs", "alice"),
+    ("SELECT RIGHT(UserPrincipalName, 3) FROM SigninLogs", "com"),
+    ("SELECT CONCAT(UserPrincipalName, '#', 1) FROM SigninLogs", "alice@contoso.com#1"),
+    ("SELECT LOCATE('@', UserPrincipalName) FROM SigninLogs", 6),
+    ("SELECT COUNT(*) FROM SigninLogs WHERE UserPrincipalName REGEXP '^ALICE'", 1),
+])
+def test_mysql_functions(pool, query, expected):
+    assert run(pool, query) == [(expected,)]
+
+
+def test_database_is_read_only(pool):
+    with pytest.raises(sqlite3.OperationalError):
+        run(pool, "DELETE FROM SigninLogs")
@@ -0,0 +1,83 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import sqlite3
+
+from secgym.database.summary_tables import SUMMARY_TABLES, build_summary_tables, generate_summary_tables_sql
+
+SIGNIN_TYPE_MAP = {"TimeGenerated": "datetime", "UserPrincipalName": "string", "IPAddress": "string", "ResultType": "string"}
+SIGNINS = [
+    ("2024-06-20 10:00:00", "alice@contoso.com", "10.0.0.1", "0"),
+    ("2024-06-20 12:00:00", "alice@contoso.com", "10.0.0.1", "50126"),
+    ("2024-06-20 11:00:00", "alice@contoso.com", "10.0.0.1", "0"),
+    ("2024-06-21 09:00:00", "alice@contoso.com", "10.0.0.2", "0"),
+    ("2024-06-21 09:30:00", "bob@contoso.com", "10.0.0.1", "50074"),
+]
+PROCESS_TYPE_MAP = {
+    column: "string"
+    for column in ["TimeGenerated", "DeviceName", "InitiatingProcessFileName", "FileName", "ProcessCommandLine"]
+}
+PROCESSES = [
+    ("2024-06-20 10:00:00", "host1", "cmd.exe", "powershell.exe", "powershell -enc b"),
+    ("2024-06-20 10:05:00", "host1", "cmd.exe", "powershell.exe", "powershell -enc a"),
+    ("2024-06-20 10:10:00", "host1", "powershell.exe", "whoami.exe", "whoami"),
+    ("2024-06-20 10:15:00", "host2", "cmd.exe", "powershell.exe", "powershell"),
+]
+
+
+def test_only_summaries_of_present_tables_with_their_columns_are_built(capsys):
+    type_maps = {
+        "SigninLogs": SIGNIN_TYPE_MAP,
+        "SecurityAlert": {"SystemAlertId": "string", "AlertName": "string"},
+    }
+    statements = generate_summary_tables_sql(type_maps)
+    warning = "Skipping summary table AlertEntityMap, SecurityAlert has no column AlertSeverity, TimeGenerated, Entities"
+    assert warning in capsys.readouterr().out
+    assert statements == [
+        "DROP TABLE IF EXISTS SigninSummary;",
+        SUMMARY_TABLES["SigninSummary"]["sql"](),
+        "CREATE INDEX `idx_UserPrincipalName` ON `SigninSummary` (`UserPrincipalName`(64));",
+        "CREATE INDEX `idx_IPAddress` ON `SigninSummary` (`IPAddress`(64));",
+    ]
+
+
+def run_summaries(tables):
+    """Build the summary tables over `tables` ({name: (type map, rows)}) in SQLite, without the MySQL indexes."""
+    connection = sqlite3.connect(":memory:")
+    for table_name, (type_map, rows) in tables.items():
+        connection.execute(f"CREATE TABLE {table_name} ({', '.join(type_map)})")
+        connection.executemany(f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(type_map))})", rows)
+    statements = generate_summary_tables_sql({table_name: type_map for table_name, (type_map, _) in tables.items()})
+    build_summary_tables(connection, [sql for sql in statements if not sql.startswith("CREATE INDEX")], verbose=False)
+    return connection
+
+
+def test_signin_summary_counts_per_user_and_ip():
+    connection = run_summaries({"SigninLogs": (SIGNIN_TYPE_MAP, SIGNINS)})
+    rows = connection.execute("SELECT * FROM SigninSummary ORDER BY UserPrincipalName, IPAddress").fetchall()
+    assert rows == [
+        ("alice@contoso.com", "10.0.0.1", 3, 2, 1, "2024-06-20 10:00:00", "2024-06-20 12:00:00"),
+        ("alice@contoso.com", "10.0.0.2", 1, 1, 0, "2024-06-21 09:00:00", "2024-06-21 09:00:00"),
+        ("bob@contoso.com", "10.0.0.1", 1, 0, 1, "2024-06-21 09:30:00", "2024-06-21 09:30:00"),
+    ]
+
+
+def test_process_tree_edges_group_parent_and_child_per_device():
+    connection = run_summaries({"DeviceProcessEvents": (PROCESS_TYPE_MAP, PROCESSES)})
+    rows = connection.execute("SELECT * FROM ProcessTreeEdges ORDER BY DeviceName, ParentFileName").fetchall()
+    assert rows == [
+        ("host1", "cmd.exe", "powershell.exe", 2, "2024-06-20 10:00:00", "2024-06-20 10:05:00", "powershell -enc a"),
+        ("host1", "powershell.exe", "whoami.exe", 1, "2024-06-20 10:10:00", "2024-06-20 10:10:00", "whoami"),
+        ("host2", "cmd.exe", "powershell.exe", 1, "2024-06-20 10:15:00", "2024-06-20 10:15:00", "powershell"),
+    ]
+
+
+def test_alert_entity_map_reads_every_identifying_field():
+    sql = SUMMARY_TABLES["AlertEntityMap"]["sql"]()
+    for field in ["HostName", "Address", "CommandLine"]:
+        assert f"`{field}` TEXT PATH '$.{field}'" in sql
+        assert f"WHEN '{field}' THEN e.`{field}`" in sql
+        assert f"SELECT '{field}' AS EntityField" in sql
+    # $ref entries and empty values are left out
+    assert "WHERE e.EntityType IS NOT NULL" in sql
+    assert "WHERE EntityValue IS NOT NULL AND EntityValue <> ''" in sql
@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+
+import pytest
+
+from secgym import trajectory_log
+from secgym.trajectory_log import TrajectoryLogWriter, read_trajectory_log
+
+
+def write_logs(path, qids, **kwargs):
+    writer = TrajectoryLogWriter(path, **kwargs)
+    for qid in qids:
+        writer.append({"qid": qid, "reward": qid % 2}, qid=qid)
+    writer.close()
+
+
+@pytest.mark.parametrize("name", ["logs.jsonl", "logs.jsonl.gz"])
+def test_missing_index_is_rebuilt_from_the_data(tmp_path, name):
+    path = str(tmp_path / name)
+    write_logs(path, [0, 1, 2])
+    os.remove(path + ".idx")
+
+    writer = TrajectoryLogWriter(path)
+    assert writer.qids() == [0, 1, 2]
+    assert writer.read(2) == {"qid": 2, "reward": 0}
+    writer.append({"qid": 3, "reward": 1}, qid=3)
+    writer.close()
+    assert [record["qid"] for record in read_trajectory_log(path)] == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize("name", ["logs.jsonl", "logs.jsonl.gz"])
+def test_short_index_keeps_the_unindexed_records(tmp_path, name):
+    path = str(tmp_path / name)
+    write_logs(path, [0, 1, 2])
+    with open(path + ".idx", "r", encoding="utf-8") as f:
+        first_line = f.readline()
+    with open(path + ".idx", "w", encoding="utf-8") as f:
+        f.write(first_line + '{"qid": 1, "off')
+
+    assert TrajectoryLogWriter(path).qids() == [0, 1, 2]
+
+
+@pytest.mark.parametrize("name", ["logs.jsonl", "logs.jsonl.gz"])
+def test_incomplete_last_record_is_dropped(tmp_path, name):
+    path = str(tmp_path / name)
+    write_logs(path, [0, 1])
+    complete_size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x1f\x8b\x08" if name.endswith(".gz") else b'{"qid": 2, "traj')
+    os.remove(path + ".idx")
+
+    writer = TrajectoryLogWriter(path)
+    assert writer.qids() == [0, 1]
+    assert os.path.getsize(path) == complete_size
+
+
+def test_fsync_every_batches_syncs(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(trajectory_log.os, "fsync", synced.append)
+    writer = TrajectoryLogWriter(str(tmp_path / "logs.jsonl"), fsync_every=3)
+    for qid in range(5):
+        writer.append({"qid": qid}, qid=qid)
+    # the log and the index once, after the third record
+    assert len(synced) == 2
+    writer.close()
+    assert len(synced) == 4
@@ -0,0 +1,57 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+
+from secgym.excytin_env import ExcytinEnv
+from secgym.trajectory_log import read_trajectory_log
+from secgym.vector_env import VectorExcytinEnv
+
+
+class NameEvaluator:
+    def checking(self, question, answer):
+        return {"reward": float(answer == "alice")}
+
+
+def env_kwargs(db_file):
+    return dict(evaluator=NameEvaluator(), backend="sqlite", db_file=db_file, query_cache=False)
+
+
+def test_batched_steps_match_the_individual_envs(tmp_path, build_sqlite_db):
+    db_file = build_sqlite_db(tmp_path / "incident_5.db")
+    save_file = str(tmp_path / "logs" / "env.jsonl")
+    venv = VectorExcytinEnv("incident_5", num_envs=3, save_file=save_file, **env_kwargs(db_file))
+    envs = [ExcytinEnv("incident_5", save_file=False, **env_kwargs(db_file)) for _ in range(3)]
+
+    observations, infos = venv.reset([0, 1, 2])
+    assert observations == [env.reset(idx)[0] for idx, env in enumerate(envs)]
+    assert [info["qid"] for info in infos] == [0, 1, 2]
+
+    ticks = [
+        (["SELECT Name FROM SigninLogs WHERE Name = 'alice'", "SELECT COUNT(*) FROM AlertInfo", "SCHEMA"], [False] * 3),
+        (["alice", None, "SELECT * FROM MissingTable"], [True, False, False]),
+    ]
+    for actions, submits in ticks:
+        observations, rewards, dones, infos = venv.step(actions, submits)
+        for i, (env, action, submit) in enumerate(zip(envs, actions, submits)):
+            if action is None:
+                assert observations[i] is None and infos[i] == {"skipped": True}
+                continue
+            observation, reward, done, info = env.step(action, submit)
+            assert (observations[i], rewards[i], dones[i]) == (observation, reward, done)
+            assert infos[i].get("query_success") == info.get("query_success")
+    assert list(rewards) == [1.0, 0.0, 0.0]
+
+    # the finished episode of the first slot is saved when the slot is refilled
+    venv.reset_at(0, 3)
+    assert [log["qid"] for log in read_trajectory_log(save_file)] == [0]
+
+    # then the episodes that are not done, slots without steps have nothing to log
+    venv.reset([None, 4, None])
+    venv.close()
+    logs = list(read_trajectory_log(save_file))
+    assert [log["qid"] for log in logs] == [0, 1, 2]
+    assert [log["reward"] for log in logs] == [1.0, 0, 0]
+    # only the first slot writes, to the single save file
+    assert [env.save_file for env in venv.envs[1:]] == [None, None]
+    assert sorted(os.listdir(tmp_path / "logs")) == ["env.jsonl", "env.jsonl.idx"]